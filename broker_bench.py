@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+"""
+hoRelay MQTT broker 延遲基準測試
+對每個 broker 重複量測連線 (CONNECT→CONNACK)、訂閱往返 (SUBSCRIBE→SUBACK) 與
+發布到收到 (PUBLISH→自己收到) 的延遲，輸出百分位數，並統計連線落在韌體 1 秒時限內的比例，
+用來調整 smartConnect 的門檻與伺服器順序
+
+用法:
+  python broker_bench.py                                  # 測試 readme 列出的 5 個預設伺服器
+  python broker_bench.py --trials 50 --csv bench.csv      # 結果附加到 CSV，方便長期追蹤
+  python broker_bench.py --local --broker-only            # 只測本機 broker（離線驗證）
+  python broker_bench.py --broker user:pass@broker.hoban.tw:1883 --json bench.json
+"""
+
+import sys
+import csv
+import json
+import time
+import asyncio
+import argparse
+from datetime import datetime
+
+import hoban_mqtt
+
+PERCENTILES = (50, 90, 95, 99)
+METRICS = ('connect', 'subscribe', 'roundtrip')
+
+def parse_target(value):
+    """'host'、'host:port' 或 'user:pass@host:port' → dict"""
+    credentials, _, address = value.rpartition('@')
+    host, port = hoban_mqtt.parse_broker(address)
+    target = {'name': address, 'host': host, 'port': port, 'username': None, 'password': None}
+    if credentials:
+        user, _, password = credentials.partition(':')
+        target['username'] = user
+        target['password'] = password or None
+    return target
+
+def percentile(sorted_values, pct):
+    """線性內插百分位數；sorted_values 必須已排序"""
+    if not sorted_values:
+        return None
+    if len(sorted_values) == 1:
+        return sorted_values[0]
+    rank = (len(sorted_values) - 1) * pct / 100
+    low = int(rank)
+    high = min(low + 1, len(sorted_values) - 1)
+    return sorted_values[low] + (sorted_values[high] - sorted_values[low]) * (rank - low)
+
+def summarize(samples):
+    """秒數樣本 → 毫秒統計"""
+    values = sorted(s * 1000 for s in samples)
+    if not values:
+        return {'count': 0}
+    summary = {
+        'count': len(values),
+        'min': round(values[0], 2),
+        'mean': round(sum(values) / len(values), 2),
+        'max': round(values[-1], 2),
+    }
+    for pct in PERCENTILES:
+        summary[f'p{pct}'] = round(percentile(values, pct), 2)
+    return summary
+
+async def run_trial(target, index, messages, timeout):
+    """單次試驗：連線、訂閱、來回發布 messages 則，回傳各項延遲（秒）"""
+    client_id = f"hoctrl-bench-{int(time.time() * 1000) % 10**9}-{index}"
+    client = hoban_mqtt.MQTTClient(target['host'], target['port'], client_id=client_id,
+                                   username=target['username'], password=target['password'])
+    result = {'connect': None, 'subscribe': None, 'roundtrip': []}
+    topic = f"hoban/bench/{client_id}"
+    try:
+        started = time.perf_counter()
+        await client.connect(timeout=timeout)
+        result['connect'] = time.perf_counter() - started
+
+        started = time.perf_counter()
+        await asyncio.wait_for(client.subscribe(topic), timeout)
+        result['subscribe'] = time.perf_counter() - started
+
+        for n in range(messages):
+            payload = f"{n}:{time.perf_counter()}"
+            started = time.perf_counter()
+            await client.publish(topic, payload)
+            while True:
+                message = await asyncio.wait_for(client.messages.get(), timeout)
+                if message is None:
+                    raise hoban_mqtt.MQTTError("連線中斷")
+                if message.payload.decode('utf-8', errors='replace') == payload:
+                    break
+            result['roundtrip'].append(time.perf_counter() - started)
+    except (OSError, asyncio.TimeoutError, hoban_mqtt.MQTTError) as e:
+        result['error'] = str(e) or type(e).__name__
+    finally:
+        await client.disconnect()
+    return result
+
+async def bench_broker(target, trials, messages, timeout, pause):
+    connect, subscribe, roundtrip, errors = [], [], [], []
+    for index in range(trials):
+        result = await run_trial(target, index, messages, timeout)
+        if result['connect'] is not None:
+            connect.append(result['connect'])
+        if result['subscribe'] is not None:
+            subscribe.append(result['subscribe'])
+        roundtrip += result['roundtrip']
+        if 'error' in result:
+            errors.append(result['error'])
+        if pause and index + 1 < trials:
+            await asyncio.sleep(pause)
+
+    within = sum(1 for c in connect if c < hoban_mqtt.CONNECT_CUTOFF)
+    return {
+        'broker': target['name'],
+        'trials': trials,
+        'failures': len(errors),
+        'errors': sorted(set(errors)),
+        'within_cutoff': round(within / trials, 3) if trials else 0.0,
+        'connect': summarize(connect),
+        'subscribe': summarize(subscribe),
+        'roundtrip': summarize(roundtrip),
+    }
+
+async def run(args):
+    targets = [parse_target(b) for b in (args.broker or ([] if args.broker_only else hoban_mqtt.PUBLIC_BROKERS))]
+    broker = None
+    if args.local:
+        broker = await hoban_mqtt.Broker('127.0.0.1', 0).start()
+        targets.append({'name': f'local:{broker.port}', 'host': '127.0.0.1', 'port': broker.port,
+                        'username': None, 'password': None})
+    if not targets:
+        raise SystemExit("❌ 沒有要測試的 broker")
+    print(f"測試 {len(targets)} 個 broker，每個 {args.trials} 次試驗、每次 {args.messages} 則往返...")
+    try:
+        # 各 broker 同時測試，同一 broker 的試驗依序進行以免互相干擾
+        return await asyncio.gather(*(bench_broker(t, args.trials, args.messages, args.timeout, args.pause)
+                                      for t in targets))
+    finally:
+        if broker:
+            await broker.stop()
+
+def _fmt(value):
+    return '-' if value is None else f"{value:.1f}"
+
+def print_report(results):
+    print(f"\n{'broker':<28} {'成功':>6} {'<1s':>6}   {'連線 p50/p90/p99 (ms)':<22} "
+          f"{'訂閱 p50/p99':<14} {'往返 p50/p99':<14}")
+    for r in results:
+        c, s, rt = r['connect'], r['subscribe'], r['roundtrip']
+        ok = r['trials'] - r['failures']
+        print(f"{r['broker']:<28} {ok:>3}/{r['trials']:<2} {r['within_cutoff']:>6.0%}   "
+              f"{_fmt(c.get('p50')) + '/' + _fmt(c.get('p90')) + '/' + _fmt(c.get('p99')):<22} "
+              f"{_fmt(s.get('p50')) + '/' + _fmt(s.get('p99')):<14} "
+              f"{_fmt(rt.get('p50')) + '/' + _fmt(rt.get('p99')):<14}")
+        for error in r['errors']:
+            print(f"    ❌ {error}")
+
+    # 依連線 p90 排序，可作為 smartConnect 的伺服器順序參考
+    ranked = sorted((r for r in results if r['connect'].get('count')),
+                    key=lambda r: (-r['within_cutoff'], r['connect']['p90']))
+    if ranked:
+        print("\n建議順序（<1s 比例高者優先，再依連線 p90）:")
+        for i, r in enumerate(ranked, 1):
+            print(f"  {i}. {r['broker']}")
+
+def csv_rows(results, timestamp):
+    for r in results:
+        row = {'timestamp': timestamp, 'broker': r['broker'], 'trials': r['trials'],
+               'failures': r['failures'], 'within_cutoff': r['within_cutoff']}
+        for metric in METRICS:
+            for key in ('mean',) + tuple(f'p{p}' for p in PERCENTILES):
+                row[f'{metric}_{key}'] = r[metric].get(key)
+        yield row
+
+def write_csv(path, results, timestamp):
+    """附加到既有 CSV，同一個檔案可累積多次量測"""
+    rows = list(csv_rows(results, timestamp))
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            exists = bool(f.readline())
+    except FileNotFoundError:
+        exists = False
+    with open(path, 'a', encoding='utf-8', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=list(rows[0].keys()))
+        if not exists:
+            writer.writeheader()
+        writer.writerows(rows)
+
+def main():
+    parser = argparse.ArgumentParser(description='hoRelay MQTT broker 延遲基準測試')
+    parser.add_argument('--broker', action='append',
+                        help='broker（host、host:port 或 user:pass@host:port，可重複；預設為 readme 的 5 個伺服器）')
+    parser.add_argument('--local', action='store_true', help='同時測試程序內啟動的本機 broker')
+    parser.add_argument('--broker-only', action='store_true', help='不加入預設伺服器，只測 --broker / --local')
+    parser.add_argument('--trials', type=int, default=20, help='每個 broker 的試驗次數（預設 20）')
+    parser.add_argument('--messages', type=int, default=5, help='每次試驗的發布往返次數（預設 5）')
+    parser.add_argument('--timeout', type=float, default=5, help='單一步驟逾時秒數（預設 5）')
+    parser.add_argument('--pause', type=float, default=0.2, help='同一 broker 兩次試驗間隔秒數（預設 0.2）')
+    parser.add_argument('--json', help='完整結果寫入 JSON 檔')
+    parser.add_argument('--csv', help='摘要附加到 CSV 檔')
+    args = parser.parse_args()
+
+    try:
+        results = asyncio.run(run(args))
+    except KeyboardInterrupt:
+        sys.exit(1)
+
+    timestamp = datetime.now().isoformat(timespec='seconds')
+    print_report(results)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'timestamp': timestamp, 'cutoff': hoban_mqtt.CONNECT_CUTOFF, 'results': results},
+                      f, ensure_ascii=False, indent=2)
+        print(f"\nJSON 已寫入: {args.json}")
+    if args.csv:
+        write_csv(args.csv, results, timestamp)
+        print(f"CSV 已附加: {args.csv}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+"""
+hoRelay broker 排名服務
+同時探測所有候選 broker，依成功率與連線延遲排序，將附有 TTL 的伺服器清單以 retained 訊息
+發布到 hoban/servers（也可寫成 JSON 檔或以 HTTP 提供），取代韌體 smartConnect 逐一嘗試、
+失敗後再等 2 秒重試的流程；select 子命令是依清單挑選伺服器的參考實作
+
+用法:
+  python broker_rank.py serve --interval 300                 # 每 5 分鐘重新排名並發布到各 broker
+  python broker_rank.py serve --once --output servers.json   # 探測一次並寫入 JSON
+  python broker_rank.py serve --serve 8080                   # 另以 http://host:8080/servers.json 提供
+  python broker_rank.py select --broker mqttgo.io            # 讀取 retained 清單並依排名連線
+"""
+
+import sys
+import json
+import time
+import asyncio
+import argparse
+
+import hoban_mqtt
+import broker_bench
+
+SERVERS_TOPIC = 'hoban/servers'
+DEFAULT_TTL = 900
+DEFAULT_PROBES = 3
+# 清單只保留前幾名，設備端可用小型 JSON 文件解析
+MAX_SERVERS = 5
+
+# ── 排名 ────────────────────────────────────────────────────────────
+
+async def probe_broker(target, probes, timeout):
+    """對單一 broker 依序探測 probes 次（連線＋訂閱＋一次往返）"""
+    latencies = []
+    for index in range(probes):
+        result = await broker_bench.run_trial(target, index, 1, timeout)
+        if 'error' not in result:
+            latencies.append(result['connect'])
+    latencies.sort()
+    return {
+        'host': target['host'],
+        'port': target['port'],
+        'success': round(len(latencies) / probes, 2) if probes else 0.0,
+        'connect_ms': round(broker_bench.percentile(latencies, 50) * 1000) if latencies else None,
+    }
+
+def rank_results(results):
+    """可連線者優先；成功率高者優先，其次連線延遲中位數低者"""
+    reachable = [r for r in results if r['connect_ms'] is not None]
+    return sorted(reachable, key=lambda r: (-r['success'], r['connect_ms']))
+
+async def rank_brokers(targets, probes=DEFAULT_PROBES, timeout=hoban_mqtt.CONNECT_CUTOFF * 3):
+    """同時探測所有 broker，總耗時約等於最慢的一個，而非全部相加"""
+    results = await asyncio.gather(*(probe_broker(t, probes, timeout) for t in targets))
+    return rank_results(results)
+
+def build_server_list(ranked, ttl=DEFAULT_TTL, now=None):
+    now = int(now if now is not None else time.time())
+    return {
+        'generated': now,
+        'expires': now + ttl,
+        'ttl': ttl,
+        'servers': [{'host': r['host'], 'port': r['port'], 'ms': r['connect_ms']}
+                    for r in ranked[:MAX_SERVERS]],
+    }
+
+# ── 參考選擇邏輯 ────────────────────────────────────────────────────
+
+def is_fresh(doc, now=None):
+    now = now if now is not None else time.time()
+    return bool(doc) and doc.get('expires', 0) > now and bool(doc.get('servers'))
+
+def candidate_servers(doc, custom=None, now=None):
+    """回傳依序嘗試的 (host, port) 清單
+
+    使用者自訂的伺服器仍最優先（與 smartConnect 相同）；清單未過期時依排名嘗試，
+    韌體的預設伺服器一律排在最後，排名內的伺服器全部連不上時仍有退路。
+    """
+    candidates = []
+    if custom:
+        candidates.append(custom)
+    if is_fresh(doc, now):
+        candidates += [(s['host'], s['port']) for s in doc['servers']]
+    candidates.append((hoban_mqtt.PUBLIC_BROKERS[0], hoban_mqtt.DEFAULT_PORT))
+    seen = set()
+    return [c for c in candidates if not (c in seen or seen.add(c))]
+
+async def connect_best(candidates, cutoff=hoban_mqtt.CONNECT_CUTOFF, **client_options):
+    """依序以 cutoff 秒嘗試每個候選伺服器，不在兩次嘗試間等待；回傳 (client, (host, port))"""
+    for host, port in candidates:
+        client = hoban_mqtt.MQTTClient(host, port, **client_options)
+        try:
+            await client.connect(timeout=cutoff)
+            return client, (host, port)
+        except (OSError, asyncio.TimeoutError, hoban_mqtt.MQTTError):
+            await client.abort()
+    return None, None
+
+async def fetch_server_list(host, port, timeout=3):
+    """從 broker 讀取 retained 的伺服器清單，沒有則回傳 None"""
+    client = hoban_mqtt.MQTTClient(host, port, client_id=f"hoctrl-select-{int(time.time())}")
+    await client.connect(timeout=timeout)
+    try:
+        await client.subscribe(SERVERS_TOPIC)
+        message = await asyncio.wait_for(client.messages.get(), timeout)
+        return json.loads(message.payload) if message else None
+    except (asyncio.TimeoutError, ValueError):
+        return None
+    finally:
+        await client.disconnect()
+
+# ── 發布 ────────────────────────────────────────────────────────────
+
+async def publish_server_list(targets, doc):
+    """將清單以 retained 發布到每個可連線的 broker，設備不論連在哪一台都讀得到"""
+    payload = json.dumps(doc, separators=(',', ':'))
+    reachable = {(s['host'], s['port']) for s in doc['servers']}
+
+    async def publish_one(target):
+        if (target['host'], target['port']) not in reachable:
+            return False
+        client = hoban_mqtt.MQTTClient(target['host'], target['port'],
+                                       client_id=f"hoctrl-rank-{int(time.time())}",
+                                       username=target['username'], password=target['password'])
+        try:
+            await client.connect(timeout=5)
+            await client.publish(SERVERS_TOPIC, payload, qos=1, retain=True)
+            return True
+        except (OSError, asyncio.TimeoutError, hoban_mqtt.MQTTError):
+            return False
+        finally:
+            await client.disconnect()
+
+    results = await asyncio.gather(*(publish_one(t) for t in targets))
+    return sum(results)
+
+class ServerListHTTP:
+    """以 GET /servers.json 提供最新清單的極簡 HTTP 端點"""
+
+    def __init__(self):
+        self.doc = None
+
+    async def handle(self, reader, writer):
+        try:
+            request = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), 5)
+            path = request.split(b' ', 2)[1] if request.count(b' ') >= 2 else b''
+            if path.split(b'?')[0] in (b'/', b'/servers.json') and self.doc:
+                body = json.dumps(self.doc, separators=(',', ':')).encode()
+                max_age = max(0, int(self.doc['expires'] - time.time()))
+                head = (f"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n"
+                        f"Content-Length: {len(body)}\r\nCache-Control: max-age={max_age}\r\n"
+                        f"Connection: close\r\n\r\n")
+            else:
+                body = b'not found'
+                head = f"HTTP/1.1 404 Not Found\r\nContent-Length: {len(body)}\r\nConnection: close\r\n\r\n"
+            writer.write(head.encode() + body)
+            await writer.drain()
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+async def serve(args, targets):
+    http = None
+    if args.serve:
+        http = ServerListHTTP()
+        server = await asyncio.start_server(http.handle, args.bind, args.serve)
+        print(f"HTTP 端點: http://{args.bind}:{args.serve}/servers.json")
+    while True:
+        started = time.time()
+        ranked = await rank_brokers(targets, args.probes, args.timeout)
+        doc = build_server_list(ranked, args.ttl)
+        print(f"\n[{time.strftime('%H:%M:%S')}] 探測 {len(targets)} 個 broker，耗時 {time.time() - started:.1f} 秒")
+        for i, s in enumerate(doc['servers'], 1):
+            print(f"  {i}. {s['host']}:{s['port']}  {s['ms']} ms")
+        if not doc['servers']:
+            print("  ❌ 沒有可連線的 broker")
+        if args.output:
+            with open(args.output, 'w', encoding='utf-8') as f:
+                json.dump(doc, f, indent=2)
+        if http:
+            http.doc = doc
+        if not args.no_publish and doc['servers']:
+            count = await publish_server_list(targets, doc)
+            print(f"  已發布到 {count} 個 broker 的 {SERVERS_TOPIC}")
+        if args.once:
+            break
+        await asyncio.sleep(args.interval)
+    if http:
+        server.close()
+        await server.wait_closed()
+
+async def select(args):
+    host, port = hoban_mqtt.parse_broker(args.broker)
+    doc = await fetch_server_list(host, port)
+    if doc is None:
+        print("未取得伺服器清單，使用預設伺服器")
+    elif not is_fresh(doc):
+        print("伺服器清單已過期，使用預設伺服器")
+    custom = hoban_mqtt.parse_broker(args.custom) if args.custom else None
+    candidates = candidate_servers(doc, custom)
+    print("嘗試順序: " + ', '.join(f"{h}:{p}" for h, p in candidates))
+    started = time.perf_counter()
+    client, chosen = await connect_best(candidates, client_id=f"hoctrl-select-{int(time.time())}")
+    if not client:
+        print("❌ 所有伺服器都無法連線")
+        return False
+    print(f"✓ 已連線 {chosen[0]}:{chosen[1]}（{(time.perf_counter() - started) * 1000:.0f} ms）")
+    await client.disconnect()
+    return True
+
+def main():
+    parser = argparse.ArgumentParser(description='hoRelay broker 排名服務')
+    sub = parser.add_subparsers(dest='command', required=True)
+    p = sub.add_parser('serve', help='探測並發布排名清單')
+    p.add_argument('--broker', action='append',
+                   help='候選 broker（host、host:port 或 user:pass@host:port，可重複；預設為 readme 的 5 個伺服器）')
+    p.add_argument('--probes', type=int, default=DEFAULT_PROBES, help=f'每個 broker 的探測次數（預設 {DEFAULT_PROBES}）')
+    p.add_argument('--timeout', type=float, default=hoban_mqtt.CONNECT_CUTOFF * 3, help='單次探測逾時秒數')
+    p.add_argument('--ttl', type=int, default=DEFAULT_TTL, help=f'清單有效秒數（預設 {DEFAULT_TTL}）')
+    p.add_argument('--interval', type=float, default=300, help='重新排名間隔秒數（預設 300）')
+    p.add_argument('--once', action='store_true', help='只探測一次')
+    p.add_argument('--output', help='清單另寫入 JSON 檔')
+    p.add_argument('--serve', type=int, metavar='PORT', help='以 HTTP 提供 /servers.json')
+    p.add_argument('--bind', default='0.0.0.0')
+    p.add_argument('--no-publish', action='store_true', help='不發布 retained 訊息')
+    p = sub.add_parser('select', help='參考客戶端：讀取清單並連線到最佳伺服器')
+    p.add_argument('--broker', default=hoban_mqtt.PUBLIC_BROKERS[0], help='讀取清單的 broker')
+    p.add_argument('--custom', help='使用者自訂伺服器（host:port），最優先嘗試')
+    args = parser.parse_args()
+
+    try:
+        if args.command == 'serve':
+            targets = [broker_bench.parse_target(b) for b in (args.broker or hoban_mqtt.PUBLIC_BROKERS)]
+            asyncio.run(serve(args, targets))
+        elif not asyncio.run(select(args)):
+            sys.exit(1)
+    except (OSError, asyncio.TimeoutError, hoban_mqtt.MQTTError) as e:
+        print(f"❌ {e}")
+        sys.exit(1)
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
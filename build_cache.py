@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+"""
+hoRelay 韌體編譯快取
+以「草稿碼原始檔 + FQBN + 額外編譯屬性 + arduino-cli/核心版本」的雜湊值為鍵，
+相同輸入直接重用先前編譯出的 .bin，不必重新編譯
+
+用法:
+  python build_cache.py list                    # 列出快取項目
+  python build_cache.py evict --max-size 512    # 依 LRU 淘汰到總大小 512 MB 以下
+  python build_cache.py evict --max-entries 20  # 依 LRU 只保留最近使用的 20 筆
+  python build_cache.py clear                   # 清空快取
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import hashlib
+import argparse
+import subprocess
+import functools
+from pathlib import Path
+
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'build', 'cache')
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+
+# 會影響編譯結果的草稿碼檔案類型（partitions.csv 決定分區表，一併納入）
+SOURCE_SUFFIXES = ('.ino', '.h', '.hpp', '.c', '.cpp', '.S', '.csv')
+# 快取保存的編譯產物（.size.json / .stack.json 是 firmware_size / stack_usage 彙整的摘要）
+ARTIFACT_SUFFIXES = ('.bin', '.elf', '.map', '.size.json', '.stack.json')
+
+META_FILE = 'meta.json'
+
+# ── 快取鍵 ──────────────────────────────────────────────────────────
+
+@functools.lru_cache(maxsize=None)
+def toolchain_version(cli, fqbn):
+    """取得 arduino-cli 版本與 FQBN 所屬核心的版本字串"""
+    parts = []
+    try:
+        res = subprocess.run([cli, 'version'], capture_output=True, text=True)
+        parts.append(res.stdout.strip())
+    except OSError:
+        parts.append('arduino-cli:unknown')
+
+    platform_id = ':'.join(fqbn.split(':')[:2])
+    try:
+        res = subprocess.run([cli, 'core', 'list', '--format', 'json'],
+                             capture_output=True, text=True)
+        data = json.loads(res.stdout or '[]')
+        # arduino-cli 1.x 回傳 {"platforms": [...]}，舊版直接回傳 list
+        platforms = data.get('platforms', []) if isinstance(data, dict) else data
+        for p in platforms:
+            if p.get('id') == platform_id:
+                version = p.get('installed_version') or p.get('installed') or ''
+                parts.append(f"{platform_id}@{version}")
+                break
+        else:
+            parts.append(f"{platform_id}@unknown")
+    except (OSError, ValueError):
+        parts.append(f"{platform_id}@unknown")
+    return ' | '.join(parts)
+
+def _iter_sources(project_dir):
+    for root, dirs, files in os.walk(project_dir):
+        dirs[:] = sorted(d for d in dirs if d != 'build' and not d.startswith('.'))
+        for name in sorted(files):
+            if name.endswith(SOURCE_SUFFIXES):
+                yield os.path.join(root, name)
+
+def compute_key(project_dir, fqbn, build_properties, toolchain):
+    """計算快取鍵（sha256 十六進位字串）"""
+    h = hashlib.sha256()
+    for path in _iter_sources(project_dir):
+        rel = os.path.relpath(path, project_dir).replace(os.sep, '/')
+        h.update(f"file:{rel}\n".encode('utf-8'))
+        with open(path, 'rb') as f:
+            h.update(hashlib.sha256(f.read()).digest())
+    h.update(f"fqbn:{fqbn}\n".encode('utf-8'))
+    for prop in build_properties:
+        h.update(f"prop:{prop}\n".encode('utf-8'))
+    h.update(f"toolchain:{toolchain}\n".encode('utf-8'))
+    return h.hexdigest()
+
+# ── 讀寫快取 ────────────────────────────────────────────────────────
+
+def _entry_dir(key, cache_dir=CACHE_DIR):
+    return os.path.join(cache_dir, key)
+
+def _read_meta(entry_dir):
+    try:
+        with open(os.path.join(entry_dir, META_FILE), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def _write_meta(entry_dir, meta):
+    tmp = os.path.join(entry_dir, META_FILE + '.tmp')
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(meta, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, os.path.join(entry_dir, META_FILE))
+
+def lookup(key, dest_dir, cache_dir=CACHE_DIR):
+    """命中時把快取的產物複製到 dest_dir 並回傳 .bin 路徑，未命中回傳 None"""
+    entry = _entry_dir(key, cache_dir)
+    meta = _read_meta(entry)
+    if not meta:
+        return None
+    bin_path = None
+    for name in meta.get('files', []):
+        src = os.path.join(entry, name)
+        if not os.path.exists(src):
+            return None
+        shutil.copy2(src, os.path.join(dest_dir, name))
+        if name.endswith('.bin') and bin_path is None:
+            bin_path = os.path.join(dest_dir, name)
+    if bin_path:
+        meta['last_used'] = time.time()
+        meta['hits'] = meta.get('hits', 0) + 1
+        _write_meta(entry, meta)
+    return bin_path
+
+def store(key, build_path, info=None, cache_dir=CACHE_DIR):
+    """把 build_path 中的編譯產物存入快取（已存在則略過）"""
+    entry = _entry_dir(key, cache_dir)
+    if _read_meta(entry):
+        return entry
+    files = sorted(p.name for p in Path(build_path).iterdir()
+                   if p.is_file() and p.name.endswith(ARTIFACT_SUFFIXES))
+    if not any(name.endswith('.bin') for name in files):
+        return None
+
+    # 先寫到暫存目錄再改名，避免平行編譯時讀到寫一半的項目
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp = entry + f".tmp{os.getpid()}-{time.monotonic_ns()}"
+    os.makedirs(tmp)
+    size = 0
+    for name in files:
+        shutil.copy2(os.path.join(build_path, name), os.path.join(tmp, name))
+        size += os.path.getsize(os.path.join(tmp, name))
+    now = time.time()
+    meta = dict(info or {})
+    meta.update({'key': key, 'files': files, 'size': size,
+                 'created': now, 'last_used': now, 'hits': 0})
+    _write_meta(tmp, meta)
+    try:
+        os.rename(tmp, entry)
+    except OSError:
+        # 其他程序已搶先寫入相同的項目
+        shutil.rmtree(tmp, ignore_errors=True)
+    return entry
+
+def list_entries(cache_dir=CACHE_DIR):
+    """回傳所有快取項目的 meta，依最近使用時間由新到舊排序"""
+    entries = []
+    if not os.path.isdir(cache_dir):
+        return entries
+    for name in os.listdir(cache_dir):
+        entry = os.path.join(cache_dir, name)
+        if '.tmp' in name or not os.path.isdir(entry):
+            continue
+        meta = _read_meta(entry)
+        if meta:
+            entries.append(meta)
+    entries.sort(key=lambda m: m.get('last_used', 0), reverse=True)
+    return entries
+
+def evict(max_bytes=None, max_entries=None, cache_dir=CACHE_DIR):
+    """依 LRU 淘汰快取項目直到符合大小與數量上限，回傳被淘汰的 key"""
+    entries = list_entries(cache_dir)
+    kept_bytes = 0
+    removed = []
+    for index, meta in enumerate(entries):
+        kept_bytes += meta.get('size', 0)
+        over_count = max_entries is not None and index >= max_entries
+        over_size = max_bytes is not None and kept_bytes > max_bytes
+        if over_count or over_size:
+            shutil.rmtree(_entry_dir(meta['key'], cache_dir), ignore_errors=True)
+            kept_bytes -= meta.get('size', 0)
+            removed.append(meta['key'])
+    return removed
+
+def clear(cache_dir=CACHE_DIR):
+    if os.path.isdir(cache_dir):
+        shutil.rmtree(cache_dir)
+
+# ── 命令列 ──────────────────────────────────────────────────────────
+
+def main():
+    parser = argparse.ArgumentParser(description='hoRelay 韌體編譯快取管理')
+    parser.add_argument('--dir', default=CACHE_DIR, help='快取目錄')
+    sub = parser.add_subparsers(dest='command', required=True)
+    sub.add_parser('list', help='列出快取項目')
+    evict_parser = sub.add_parser('evict', help='依 LRU 淘汰快取項目')
+    evict_parser.add_argument('--max-size', type=float, help='總大小上限 (MB)')
+    evict_parser.add_argument('--max-entries', type=int, help='保留項目數上限')
+    sub.add_parser('clear', help='清空快取')
+    args = parser.parse_args()
+
+    if args.command == 'list':
+        entries = list_entries(args.dir)
+        total = sum(m.get('size', 0) for m in entries)
+        print(f"快取目錄: {args.dir}")
+        print(f"項目數: {len(entries)}，總大小: {total / 1024 / 1024:.2f} MB\n")
+        for m in entries:
+            last_used = time.strftime('%Y-%m-%d %H:%M', time.localtime(m.get('last_used', 0)))
+            print(f"{m['key'][:12]}  {m.get('model', '?'):<12} "
+                  f"{m.get('size', 0) / 1024:>8.1f} KB  命中 {m.get('hits', 0):>3}  最近使用 {last_used}")
+    elif args.command == 'evict':
+        if args.max_size is None and args.max_entries is None:
+            parser.error('evict 需指定 --max-size 或 --max-entries')
+        max_bytes = int(args.max_size * 1024 * 1024) if args.max_size is not None else None
+        removed = evict(max_bytes, args.max_entries, args.dir)
+        print(f"已淘汰 {len(removed)} 個項目")
+    elif args.command == 'clear':
+        clear(args.dir)
+        print("快取已清空")
+
+if __name__ == '__main__':
+    try:
+        main()
+    except KeyboardInterrupt:
+        sys.exit(0)
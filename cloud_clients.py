@@ -0,0 +1,342 @@
+#!/usr/bin/env python3
+"""
+hoctrl 雲端客戶端（Firebase Storage / Firestore）
+憑證與客戶端在同一個程序內只建立一次（可從多個執行緒取用）；bucket 名稱第一次探測後記錄在
+build/cloud.json，之後的發布直接以 client.bucket(name) 取得 handle，不再每次 get_bucket / create_bucket
+
+後端:
+  預設                      Google Cloud（serviceAccountKey.json，找不到時用預設認證）
+  FIRESTORE_EMULATOR_HOST   Firestore 連到本機模擬器（不需要憑證）
+  STORAGE_EMULATOR_HOST     Storage 連到本機模擬器（如 fake-gcs-server，不需要憑證）
+  HOCTRL_CLOUD_LOCAL=DIR    離線測試：Storage 檔案寫入 DIR/storage/，Firestore 文件寫入 DIR/firestore.json
+
+用法:
+  python cloud_clients.py info             # 目前的後端、憑證與記錄的 bucket
+  python cloud_clients.py probe            # 重新探測 bucket 並更新記錄
+  python cloud_clients.py forget           # 清除 bucket 記錄（下次使用時重新探測）
+"""
+
+import os
+import sys
+import json
+import shutil
+import argparse
+import threading
+import importlib.util
+from pathlib import Path
+from datetime import datetime
+
+PROJECT_ID = 'hoctrl'
+# 依序嘗試；都不存在時在 BUCKET_LOCATION 建立
+BUCKET_NAMES = ('hoctrl.firebasestorage.app', 'hoctrl.appspot.com')
+BUCKET_LOCATION = 'asia-east1'
+
+STATE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'build', 'cloud.json')
+
+_lock = threading.RLock()
+_credentials = {}
+_clients = {}
+_buckets = {}
+
+# ── 憑證 ────────────────────────────────────────────────────────────
+
+def find_service_account_key(project_dir=None):
+    """在多個位置搜尋 serviceAccountKey.json"""
+    candidates = [
+        os.path.join(project_dir, 'serviceAccountKey.json') if project_dir else None,
+        'serviceAccountKey.json',
+        os.path.join('..', 'hoctrl', 'serviceAccountKey.json'),
+    ]
+    for path in candidates:
+        if path and os.path.exists(path):
+            return os.path.abspath(path)
+    return None
+
+def local_dir():
+    return os.getenv('HOCTRL_CLOUD_LOCAL') or None
+
+def get_credentials(project_dir=None):
+    """Service Account 憑證；找不到金鑰檔時回傳 None（客戶端改用預設認證）"""
+    key = find_service_account_key(project_dir)
+    if key is None:
+        return None
+    with _lock:
+        if key not in _credentials:
+            from google.oauth2 import service_account
+            _credentials[key] = service_account.Credentials.from_service_account_file(key)
+        return _credentials[key]
+
+def describe(service, project_dir=None):
+    """說明 service（'storage' 或 'firestore'）目前會使用的後端，供呼叫端顯示"""
+    if local_dir():
+        return f"本機目錄: {local_dir()}"
+    emulator = os.getenv('STORAGE_EMULATOR_HOST' if service == 'storage' else 'FIRESTORE_EMULATOR_HOST')
+    if emulator:
+        return f"模擬器: {emulator}"
+    key = find_service_account_key(project_dir)
+    return f"Service Account: {key}" if key else "預設認證"
+
+# ── 客戶端 ──────────────────────────────────────────────────────────
+
+def _client(service, project_dir, factory):
+    if local_dir():
+        cache_key = (service, 'local', local_dir())
+    elif os.getenv('STORAGE_EMULATOR_HOST' if service == 'storage' else 'FIRESTORE_EMULATOR_HOST'):
+        cache_key = (service, 'emulator', None)
+    else:
+        cache_key = (service, 'google', find_service_account_key(project_dir))
+    with _lock:
+        if cache_key not in _clients:
+            _clients[cache_key] = factory(cache_key[1])
+        return _clients[cache_key]
+
+def storage_client(project_dir=None):
+    def factory(kind):
+        if kind == 'local':
+            return LocalStorage(os.path.join(local_dir(), 'storage'))
+        from google.cloud import storage
+        if kind == 'emulator':
+            from google.auth.credentials import AnonymousCredentials
+            return storage.Client(credentials=AnonymousCredentials(), project=PROJECT_ID)
+        return storage.Client(credentials=get_credentials(project_dir), project=PROJECT_ID)
+    return _client('storage', project_dir, factory)
+
+def firestore_client(project_dir=None):
+    def factory(kind):
+        if kind == 'local':
+            return LocalFirestore(os.path.join(local_dir(), 'firestore.json'))
+        from google.cloud import firestore
+        if kind == 'emulator':
+            return firestore.Client(project=PROJECT_ID)
+        return firestore.Client(credentials=get_credentials(project_dir), project=PROJECT_ID)
+    return _client('firestore', project_dir, factory)
+
+def storage_available():
+    """只查找模組不匯入，google-cloud-storage 在真的要上傳時才載入"""
+    if local_dir():
+        return True
+    try:
+        return importlib.util.find_spec('google.cloud.storage') is not None
+    except ImportError:
+        return False
+
+def server_timestamp():
+    """publish_time 欄位的值：Firestore 由伺服器補上時間，本機後端寫入當下時間"""
+    if local_dir():
+        return LOCAL_TIMESTAMP
+    from google.cloud import firestore
+    return firestore.SERVER_TIMESTAMP
+
+# ── Bucket ──────────────────────────────────────────────────────────
+
+def _load_state():
+    try:
+        with open(STATE_PATH, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def _save_state(state):
+    os.makedirs(os.path.dirname(STATE_PATH), exist_ok=True)
+    tmp = STATE_PATH + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(state, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, STATE_PATH)
+
+def probe_bucket(client):
+    """依 BUCKET_NAMES 順序取得或建立 bucket，全部失敗時拋出最後一個錯誤"""
+    error = None
+    for name in BUCKET_NAMES:
+        try:
+            return client.get_bucket(name)
+        except Exception as e:
+            error = e
+        try:
+            return client.create_bucket(name, location=BUCKET_LOCATION)
+        except Exception as e:
+            error = e
+    raise error
+
+def get_bucket(project_dir=None):
+    """取得 Storage bucket handle。Google Cloud 後端沿用 build/cloud.json 記錄的 bucket 名稱，
+    不發出任何請求；沒有記錄時才探測並寫入記錄"""
+    client = storage_client(project_dir)
+    with _lock:
+        if id(client) in _buckets:
+            return _buckets[id(client)]
+        if isinstance(client, LocalStorage):
+            bucket = client.bucket(BUCKET_NAMES[0])
+        elif os.getenv('STORAGE_EMULATOR_HOST'):
+            bucket = probe_bucket(client)
+        else:
+            name = _load_state().get('bucket')
+            if name:
+                bucket = client.bucket(name)
+            else:
+                bucket = probe_bucket(client)
+                _save_state(dict(_load_state(), bucket=bucket.name,
+                                 probed=datetime.now().isoformat(timespec='seconds')))
+        _buckets[id(client)] = bucket
+        return bucket
+
+def forget_bucket():
+    """清除 bucket 記錄；上傳回報 bucket 不存在（404）時呼叫，下次重新探測"""
+    with _lock:
+        _buckets.clear()
+        state = _load_state()
+        if state.pop('bucket', None) is not None:
+            _save_state(state)
+
+def is_not_found(error):
+    return getattr(error, 'code', None) == 404
+
+# ── 本機後端 ────────────────────────────────────────────────────────
+
+class _Timestamp:
+    def __repr__(self):
+        return 'LOCAL_TIMESTAMP'
+
+LOCAL_TIMESTAMP = _Timestamp()
+
+class LocalStorage:
+    """以目錄模擬 Storage：{root}/{bucket}/{path}，public_url 為 file:// URI"""
+
+    def __init__(self, root):
+        self.root = root
+
+    def bucket(self, name):
+        return LocalBucket(self, name)
+
+    get_bucket = bucket
+
+class LocalBucket:
+    def __init__(self, storage, name):
+        self.storage = storage
+        self.name = name
+
+    def blob(self, path):
+        return LocalBlob(self, path)
+
+class LocalBlob:
+    def __init__(self, bucket, name):
+        self.bucket = bucket
+        self.name = name
+
+    @property
+    def path(self):
+        return os.path.join(self.bucket.storage.root, self.bucket.name, *self.name.split('/'))
+
+    @property
+    def public_url(self):
+        return Path(self.path).resolve().as_uri()
+
+    def upload_from_filename(self, filename):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp = self.path + '.tmp'
+        shutil.copyfile(filename, tmp)
+        os.replace(tmp, self.path)
+
+    def make_public(self):
+        pass
+
+class LocalFirestore:
+    """以單一 JSON 檔模擬 Firestore：{collection: {document: data}}，寫入以 os.replace 確保全有或全無"""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def collection(self, name):
+        return _LocalCollection(self, name)
+
+    def batch(self):
+        return _LocalBatch(self)
+
+    def load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def commit(self, writes):
+        """writes 為 [(collection, document, data, merge)]"""
+        now = datetime.now().isoformat(timespec='seconds')
+        with self._lock:
+            db = self.load()
+            for collection, document, data, merge in writes:
+                docs = db.setdefault(collection, {})
+                doc = docs.setdefault(document, {}) if merge else {}
+                doc.update({k: now if v is LOCAL_TIMESTAMP else v for k, v in data.items()})
+                docs[document] = doc
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            tmp = self.path + '.tmp'
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(db, f, ensure_ascii=False, indent=2)
+            os.replace(tmp, self.path)
+
+class _LocalCollection:
+    def __init__(self, db, name):
+        self.db = db
+        self.name = name
+
+    def document(self, name):
+        return _LocalDocument(self.db, self.name, name)
+
+class _LocalDocument:
+    def __init__(self, db, collection, name):
+        self.db = db
+        self.collection = collection
+        self.name = name
+
+    def set(self, data, merge=False):
+        self.db.commit([(self.collection, self.name, data, merge)])
+
+class _LocalBatch:
+    def __init__(self, db):
+        self.db = db
+        self.writes = []
+
+    def set(self, ref, data, merge=False):
+        self.writes.append((ref.collection, ref.name, data, merge))
+
+    def commit(self):
+        self.db.commit(self.writes)
+        self.writes = []
+
+# ── 命令列 ──────────────────────────────────────────────────────────
+
+def main():
+    parser = argparse.ArgumentParser(description='hoctrl 雲端客戶端')
+    parser.add_argument('--project-dir', help='搜尋 serviceAccountKey.json 的型號目錄')
+    sub = parser.add_subparsers(dest='command', required=True)
+    sub.add_parser('info', help='目前的後端、憑證與記錄的 bucket')
+    sub.add_parser('probe', help='重新探測 bucket 並更新記錄')
+    sub.add_parser('forget', help='清除 bucket 記錄')
+    args = parser.parse_args()
+
+    if args.command == 'info':
+        print(f"Storage:   {describe('storage', args.project_dir)}")
+        print(f"Firestore: {describe('firestore', args.project_dir)}")
+        state = _load_state()
+        if state.get('bucket'):
+            print(f"Bucket:    {state['bucket']}（{state.get('probed', '?')} 探測）")
+        else:
+            print("Bucket:    未記錄（下次上傳時探測）")
+    elif args.command == 'probe':
+        forget_bucket()
+        try:
+            bucket = get_bucket(args.project_dir)
+        except ImportError:
+            print("❌ 未安裝 google-cloud-storage")
+            sys.exit(1)
+        except Exception as e:
+            print(f"❌ 無法取得 bucket: {e}")
+            sys.exit(1)
+        print(f"Bucket: {bucket.name}")
+    elif args.command == 'forget':
+        forget_bucket()
+        print("已清除 bucket 記錄")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+"""
+hoRelay 指令延遲追蹤
+以附帶關聯 ID 的控制指令（ON@a1b2c3）反覆對設備送出指令，量測「送出 → 設備 ack」的端到端延遲，
+依設備與 broker 統計直方圖與百分位數，用來掌握繼電器動作的 p99 延遲
+
+用法:
+  python command_trace.py --broker mqttgo.io --model hoRelay2 --rounds 20               # 以 status 量測
+  python command_trace.py --broker mqttgo.io --device hoban-a1b2c3d4e5f6 --toggle      # ON/OFF 交替，實際動作
+  python command_trace.py --broker mqttgo.io --tag north-traps --json trace.json
+"""
+
+import sys
+import json
+import time
+import bisect
+import asyncio
+import argparse
+
+import hoban_mqtt
+import broker_bench
+from fleet_command import CommandDispatcher, load_tags, DEFAULT_TAGS_FILE, RESULT_ACKED
+
+# 直方圖上界 (ms)，最後一格為超過 5 秒
+BUCKETS_MS = (5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+
+class LatencyHistogram:
+    """固定邊界的延遲直方圖，另保留原始樣本以計算精確百分位數"""
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS_MS) + 1)
+        self.samples = []
+        self.lost = 0
+
+    def add(self, latency_ms):
+        self.counts[bisect.bisect_left(BUCKETS_MS, latency_ms)] += 1
+        self.samples.append(latency_ms)
+
+    def summary(self):
+        values = sorted(self.samples)
+        result = {'count': len(values), 'lost': self.lost}
+        if values:
+            result.update({f'p{p}': round(broker_bench.percentile(values, p), 1)
+                           for p in broker_bench.PERCENTILES})
+            result['max'] = round(values[-1], 1)
+        result['buckets'] = {label: count for label, count in zip(bucket_labels(), self.counts)}
+        return result
+
+def bucket_labels():
+    return [f"≤{b}" for b in BUCKETS_MS] + [f">{BUCKETS_MS[-1]}"]
+
+class Tracer:
+    def __init__(self):
+        self.by_device = {}
+        self.by_broker = {}
+
+    def record(self, result):
+        for table, key in ((self.by_device, result['device_id']), (self.by_broker, result['broker'])):
+            histogram = table.setdefault(key, LatencyHistogram())
+            if result['result'] == RESULT_ACKED:
+                histogram.add(result['ack_ms'])
+            else:
+                histogram.lost += 1
+
+    def report(self):
+        return {
+            'brokers': {k: h.summary() for k, h in sorted(self.by_broker.items())},
+            'devices': {k: h.summary() for k, h in sorted(self.by_device.items())},
+        }
+
+def print_histogram(name, histogram):
+    s = histogram.summary()
+    if not s['count']:
+        print(f"\n{name}: 沒有收到任何 ack（遺失 {s['lost']}）")
+        return
+    print(f"\n{name}: {s['count']} 則，遺失 {s['lost']}，p50 {s['p50']} / p90 {s['p90']} / "
+          f"p99 {s['p99']} / max {s['max']} ms")
+    peak = max(histogram.counts)
+    for label, count in zip(bucket_labels(), histogram.counts):
+        if count:
+            print(f"  {label:>7} ms {'█' * max(1, round(count * 40 / peak)):<40} {count}")
+
+async def run(args):
+    dispatcher = CommandDispatcher(args.broker or [hoban_mqtt.PUBLIC_BROKERS[0]], args.rate, args.burst)
+    await dispatcher.start(args.discover)
+    tracer = Tracer()
+    try:
+        targets = dispatcher.select(model=args.model, version=args.version, tag=args.tag,
+                                    tags=load_tags(args.tags), device_ids=args.device)
+        # 點動型號（hoRelay1/2）沒有 OFF：--toggle 時每輪都送 ON，單獨指定 OFF 則不執行
+        pulse = set(dispatcher.unsupported(targets, 'OFF'))
+        if args.command == 'OFF' and not args.toggle and pulse:
+            for device_id in sorted(pulse):
+                print(f"❌ {device_id} ({dispatcher.tracker.records[device_id]['model']}) 不支援 OFF")
+            return None
+        latching = [d for d in targets if d not in pulse]
+        print(f"追蹤 {len(targets)} 台設備，{args.rounds} 輪")
+        for round_no in range(args.rounds):
+            command = args.command
+            if args.toggle:
+                command = 'ON' if round_no % 2 == 0 else 'OFF'
+            if args.toggle and command == 'OFF' and pulse:
+                batches = await asyncio.gather(
+                    dispatcher.send(latching, 'OFF', args.timeout, correlate=True),
+                    dispatcher.send(sorted(pulse), 'ON', args.timeout, correlate=True))
+                results = batches[0] + batches[1]
+                label = 'OFF（點動型號 ON）'
+            else:
+                results = await dispatcher.send(targets, command, args.timeout, correlate=True)
+                label = command
+            for result in results:
+                tracer.record(result)
+            acked = sum(1 for r in results if r['result'] == RESULT_ACKED)
+            print(f"  第 {round_no + 1} 輪 {label}: {acked}/{len(results)} 確認")
+            if round_no + 1 < args.rounds:
+                await asyncio.sleep(args.interval)
+        if args.toggle and args.rounds % 2 and latching:
+            # 結束時保持繼電器關閉（點動型號會自行放開）
+            await dispatcher.send(latching, 'OFF', args.timeout, wait_ack=False)
+    finally:
+        await dispatcher.close()
+    return tracer
+
+def main():
+    parser = argparse.ArgumentParser(description='hoRelay 指令延遲追蹤')
+    parser.add_argument('--broker', action='append', help='broker（可重複，預設 mqttgo.io）')
+    parser.add_argument('--command', default='status', choices=('status', 'ON', 'OFF'),
+                        help='量測用的指令（預設 status，不會動作繼電器）')
+    parser.add_argument('--toggle', action='store_true', help='ON/OFF 交替送出，量測實際繼電器動作（點動型號每輪送 ON）')
+    parser.add_argument('--model')
+    parser.add_argument('--version')
+    parser.add_argument('--tag')
+    parser.add_argument('--tags', default=DEFAULT_TAGS_FILE)
+    parser.add_argument('--device', action='append', help='指定設備 ID（可重複）')
+    parser.add_argument('--discover', type=float, default=3, help='收集 retained 狀態的秒數（預設 3）')
+    parser.add_argument('--rounds', type=int, default=10, help='量測輪數（預設 10）')
+    parser.add_argument('--interval', type=float, default=1, help='每輪間隔秒數（預設 1）')
+    parser.add_argument('--timeout', type=float, default=5, help='等待 ack 的秒數，逾時視為遺失（預設 5）')
+    parser.add_argument('--rate', type=float, default=200, help='每秒最多送出幾則指令（預設 200）')
+    parser.add_argument('--burst', type=int, default=50)
+    parser.add_argument('--worst', type=int, default=10, help='列出 p99 最差的設備數（預設 10）')
+    parser.add_argument('--json', help='將各設備與 broker 的直方圖寫入 JSON 檔')
+    args = parser.parse_args()
+
+    try:
+        tracer = asyncio.run(run(args))
+    except (OSError, asyncio.TimeoutError, hoban_mqtt.MQTTError) as e:
+        print(f"❌ MQTT 連線失敗: {e}")
+        sys.exit(1)
+    except KeyboardInterrupt:
+        sys.exit(1)
+    if tracer is None:
+        sys.exit(1)
+
+    for name, histogram in sorted(tracer.by_broker.items()):
+        print_histogram(f"broker {name}", histogram)
+
+    ranked = sorted(((h.summary(), d) for d, h in tracer.by_device.items()),
+                    key=lambda item: (-item[0]['lost'], -item[0].get('p99', float('inf'))))
+    if ranked:
+        print(f"\n延遲最差的設備:")
+        for s, device_id in ranked[:args.worst]:
+            print(f"  {device_id:<20} p50 {s.get('p50', '-'):>7}  p99 {s.get('p99', '-'):>7} ms  遺失 {s['lost']}")
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'timestamp': time.time(), **tracer.report()}, f, ensure_ascii=False, indent=2)
+        print(f"\nJSON 已寫入: {args.json}")
+
+if __name__ == '__main__':
+    main()
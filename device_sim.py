@@ -0,0 +1,437 @@
+#!/usr/bin/env python3
+"""
+hoRelay 設備模擬器
+在單一 asyncio 程序中模擬大量虛擬設備，行為對應 ho_relay3.ino：
+連線時設定 offline 遺囑並發布 retained 狀態、定期送出狀態、回應 control 主題的
+status / ON / OFF / reset / FIND_BEST_SERVER / update: 指令，並模擬 OTA 下載進度與重新開機
+
+用法:
+  python device_sim.py --local-broker --count 2000                  # 同時啟動本機 broker 與 2000 台設備
+  python device_sim.py --broker 127.0.0.1:1883 --count 500 --model hoRelay2 --version 2.0.4
+  python device_sim.py --local-broker --count 200 --ota-fail-rate 0.1 --duration 600
+"""
+
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+
+import hoban_mqtt
+import status_codec
+
+# 與韌體相同的時間參數（秒）
+STATUS_INTERVAL = 3           # loop() 每 3 秒 publishStatusWithServer
+MQTT_KEEPALIVE = 30           # mqttClient.setKeepAlive(30)
+RECONNECT_INTERVAL = 10       # 斷線後每 10 秒重連
+FIND_SERVER_DELAY = 1         # FIND_BEST_SERVER：disconnect 後 delay(1000)
+RESET_DELAY = 1               # clearWiFiConfig：發送 reset 後 delay(1000)
+UPDATE_SUCCESS_DELAY = 1      # update_success 後 delay(1000) 才 ESP.restart()
+OTA_MAX_RETRIES = 3           # startFirmwareUpdate 的 maxRetries
+OTA_BASE_DELAY = 5            # baseDelay 5000 ms，指數退避
+UPDATE_DOC_CAPACITY = 200     # StaticJsonDocument<200>
+
+DEFAULT_IMAGE_SIZE = 1_200_000
+
+def sim_device_id(index, prefix=0xfe0000000000):
+    """產生與 getDeviceId() 相同格式的 ID（hoban- 加 12 位十六進位 MAC）"""
+    return f"hoban-{prefix + index:012x}"
+
+class SimStats:
+    def __init__(self):
+        self.connected = 0
+        self.published = 0
+        self.commands = {}
+        self.updates = {'success': 0, 'failed': 0}
+
+    def command(self, name):
+        self.commands[name] = self.commands.get(name, 0) + 1
+
+class VirtualDevice:
+    """單一虛擬設備；狀態欄位與 publishStatus() 的 JSON 相同"""
+
+    def __init__(self, index, host, port, server_name, model, version, options, stats):
+        self.device_id = sim_device_id(index)
+        self.host = host
+        self.port = port
+        self.server_name = server_name
+        self.model = model
+        self.version = version
+        self.options = options
+        self.stats = stats
+        self.rng = random.Random(index)
+        self.rssi = self.rng.randint(-88, -45)
+        self.ip = f"192.168.{(index >> 8) & 0xFF}.{(index & 0xFF) or 1}"
+        self.relay = 0
+        self.is_updating = False
+        self.update_progress = 0
+        self.booted = time.monotonic()
+        self.client = None
+        self.online = False
+        self.provisioned = True
+        self._wake = asyncio.Event()
+        self._tasks = set()
+
+    # ── 狀態訊息 ────────────────────────────────────────────────
+
+    def _uptime(self):
+        return int(time.monotonic() - self.booted)
+
+    def status_doc(self, with_server=True):
+        doc = {
+            'device_id': self.device_id,
+            'status': 'updating' if self.is_updating else 'online',
+            'version': self.version,
+            'model': self.model,
+        }
+        if with_server:
+            doc['server'] = self.server_name
+        doc['timestamp'] = self._uptime()
+        doc['wifi'] = {
+            'connected': True,
+            'ssid': self.options.ssid,
+            'rssi': self.rssi + self.rng.randint(-3, 3),
+            'ip': self.ip,
+        }
+        doc['device'] = {'relay': self.relay}
+        if self.is_updating:
+            doc['device']['update_progress'] = self.update_progress
+        return doc
+
+    def will(self):
+        payload = json.dumps({'device_id': self.device_id, 'status': 'offline',
+                              'server': self.server_name, 'timestamp': self._uptime()},
+                             separators=(',', ':'))
+        return hoban_mqtt.Will(hoban_mqtt.status_topic(self.device_id), payload, 1, True)
+
+    async def _publish(self, payload):
+        if self.client and self.client.connected:
+            await self.client.publish(hoban_mqtt.status_topic(self.device_id), payload, retain=True)
+            self.stats.published += 1
+
+    async def publish_status(self, with_server=False):
+        doc = self.status_doc(with_server)
+        await self._publish(json.dumps(doc, separators=(',', ':')))
+        # BINARY_STATUS=1 的韌體另外發布二進位狀態；二進位格式固定帶伺服器代碼
+        if self.options.binary and self.client and self.client.connected:
+            doc['server'] = self.server_name
+            await self.client.publish(status_codec.binary_status_topic(self.device_id),
+                                      status_codec.encode(doc, self.device_id), retain=True)
+            self.stats.published += 1
+
+    # ── 連線 ───────────────────────────────────────────────────
+
+    async def connect(self):
+        """quickConnectDefault：設定遺囑、連線、訂閱 control、發布上線狀態與伺服器切換事件"""
+        self.client = hoban_mqtt.MQTTClient(self.host, self.port, client_id=self.device_id,
+                                            keepalive=MQTT_KEEPALIVE, will=self.will(),
+                                            on_message=self._on_message)
+        try:
+            await self.client.connect(timeout=self.options.connect_timeout)
+            await self.client.subscribe(hoban_mqtt.control_topic(self.device_id))
+        except (OSError, asyncio.TimeoutError, hoban_mqtt.MQTTError):
+            await self.client.abort()
+            return False
+        self.online = True
+        self.stats.connected += 1
+        await self.publish_status(with_server=True)
+        await self._publish(json.dumps({
+            'device_id': self.device_id, 'status': 'online', 'event': 'server_changed',
+            'switch_type': 'default', 'server': self.server_name, 'timestamp': self._uptime(),
+        }, separators=(',', ':')))
+        return True
+
+    def _offline(self):
+        if self.online:
+            self.online = False
+            self.stats.connected -= 1
+
+    async def _drop(self, clean):
+        self._offline()
+        if self.client and self.client.connected:
+            if clean:
+                await self.client.disconnect()
+            else:
+                await self.client.abort()
+
+    async def run(self):
+        """對應 loop()：維持連線並每 STATUS_INTERVAL 秒發布狀態"""
+        while True:
+            if not self.provisioned:
+                return
+            if not (self.client and self.client.connected):
+                self._offline()
+                if not await self.connect():
+                    await asyncio.sleep(RECONNECT_INTERVAL)
+                    continue
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.options.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            # OTA 進行中韌體卡在下載迴圈，不會發送定期狀態
+            if not self.is_updating and self.client and self.client.connected:
+                await self.publish_status(with_server=True)
+
+    async def stop(self):
+        """模擬斷電：不送 DISCONNECT，讓 broker 發布 offline 遺囑"""
+        for task in list(self._tasks):
+            task.cancel()
+        await self._drop(clean=False)
+
+    # ── 指令處理 ────────────────────────────────────────────────
+
+    def _on_message(self, message):
+        if message.topic != hoban_mqtt.control_topic(self.device_id):
+            return
+        text = message.payload.decode('utf-8', errors='replace')
+        task = asyncio.ensure_future(self.handle_command(text))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def publish_ack(self, command, command_id):
+        """publishCommandAck：非 retained，只送給當下的訂閱者"""
+        if not command_id or not (self.client and self.client.connected):
+            return
+        payload = json.dumps({
+            'device_id': self.device_id,
+            'status': 'updating' if self.is_updating else 'online',
+            'ack': command_id[:32], 'cmd': command, 'timestamp': self._uptime(),
+            'device': {'relay': self.relay},
+        }, separators=(',', ':'))
+        await self.client.publish(hoban_mqtt.status_topic(self.device_id), payload)
+        self.stats.published += 1
+
+    async def _reconnected(self, timeout=30):
+        while not (self.client and self.client.connected and self.online):
+            await asyncio.sleep(0.1)
+            timeout -= 0.1
+            if timeout <= 0:
+                return False
+        return True
+
+    async def handle_command(self, message):
+        message, command_id = hoban_mqtt.split_command(message)
+        if message == 'status':
+            self.stats.command('status')
+            await self.publish_status()
+            await self.publish_ack('status', command_id)
+        elif message == 'ON':
+            self.stats.command('ON')
+            self.relay = 1
+            await self.publish_status()
+            await self.publish_ack('ON', command_id)
+        elif message == 'OFF':
+            self.stats.command('OFF')
+            self.relay = 0
+            await self.publish_status()
+            await self.publish_ack('OFF', command_id)
+        elif message == 'reset':
+            self.stats.command('reset')
+            await self.publish_ack('reset', command_id)
+            await self.reset()
+        elif message == 'FIND_BEST_SERVER':
+            self.stats.command('FIND_BEST_SERVER')
+            await self._drop(clean=True)
+            await asyncio.sleep(FIND_SERVER_DELAY)
+            self._wake.set()
+            if await self._reconnected():
+                await self.publish_ack('FIND_BEST_SERVER', command_id)
+        elif message.startswith('update:'):
+            self.stats.command('update')
+            body = message[len('update:'):]
+            # 超過 StaticJsonDocument<200> 的指令在設備端會解析失敗而被忽略
+            if len(body) > UPDATE_DOC_CAPACITY:
+                return
+            try:
+                doc = json.loads(body)
+            except ValueError:
+                return
+            if isinstance(doc, dict) and doc.get('version') and doc.get('url'):
+                await self.firmware_update(doc['version'], doc['url'])
+        else:
+            self.stats.command('unknown')
+
+    async def reset(self):
+        """clearWiFiConfig：發布 reset 狀態後重新開機進入 AP 模式，不再連回 broker"""
+        await self._publish(json.dumps({'device_id': self.device_id, 'status': 'reset',
+                                        'server': self.server_name, 'timestamp': self._uptime()},
+                                       separators=(',', ':')))
+        await asyncio.sleep(RESET_DELAY)
+        self.provisioned = False
+        await self._drop(clean=False)
+        self._wake.set()
+
+    async def firmware_update(self, version, url):
+        """startFirmwareUpdate：最多重試 3 次（指數退避），成功後重新開機以新版本上線"""
+        if self.is_updating:
+            return
+        self.is_updating = True
+        self.update_progress = 0
+        await self._publish('updating')
+        try:
+            success = False
+            for attempt in range(OTA_MAX_RETRIES):
+                if attempt:
+                    await asyncio.sleep(OTA_BASE_DELAY * (1 << attempt) * self.options.time_scale)
+                if await self._download():
+                    success = True
+                    break
+            if not success:
+                self.stats.updates['failed'] += 1
+                self.is_updating = False
+                self.update_progress = 0
+                await self._publish('update_failed')
+                return
+            self.stats.updates['success'] += 1
+            await self._publish('update_success')
+            await asyncio.sleep(UPDATE_SUCCESS_DELAY * self.options.time_scale)
+        finally:
+            self.is_updating = False
+        # ESP.restart()：連線直接中斷（broker 發布遺囑），開機後以新版本重新連線
+        await self._drop(clean=False)
+        await asyncio.sleep(self.options.boot_seconds)
+        self.version = version
+        self.relay = 0
+        self.booted = time.monotonic()
+        self.update_progress = 0
+        self._wake.set()
+
+    async def _download(self):
+        """模擬一次下載嘗試；每秒回報一次進度，依 ota_fail_rate 在中途失敗"""
+        size = self.options.image_size
+        speed = size / max(self.options.ota_seconds, 0.001)
+        fail_at = None
+        if self.rng.random() < self.options.ota_fail_rate:
+            fail_at = self.rng.randint(0, 99)
+        written = 0
+        while written < size:
+            await asyncio.sleep(min(1.0, self.options.ota_seconds))
+            written = min(size, written + int(speed * min(1.0, self.options.ota_seconds)))
+            self.update_progress = written * 100 // size
+            if fail_at is not None and self.update_progress >= fail_at:
+                return False
+            if self.options.report_progress:
+                await self.publish_status()
+        return True
+
+class Simulator:
+    """依 ramp 速率逐步啟動虛擬設備，並定期列出統計"""
+
+    def __init__(self, host, port, options):
+        self.host = host
+        self.port = port
+        self.options = options
+        self.stats = SimStats()
+        self.devices = []
+
+    def build(self):
+        models = self.options.model
+        for i in range(self.options.count):
+            self.devices.append(VirtualDevice(
+                self.options.start + i, self.host, self.port, self.options.server_name,
+                models[i % len(models)], self.options.version, self.options, self.stats))
+        return self.devices
+
+    async def run(self):
+        self.build()
+        tasks = []
+        delay = 1 / self.options.ramp if self.options.ramp > 0 else 0
+        started = time.time()
+        reporter = asyncio.ensure_future(self._report())
+        try:
+            for device in self.devices:
+                tasks.append(asyncio.ensure_future(device.run()))
+                if delay:
+                    await asyncio.sleep(delay)
+            remaining = None
+            if self.options.duration > 0:
+                remaining = max(0, self.options.duration - (time.time() - started))
+            await asyncio.wait(tasks, timeout=remaining)
+        finally:
+            reporter.cancel()
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*(d.stop() for d in self.devices), return_exceptions=True)
+
+    async def _report(self):
+        last = 0
+        while True:
+            await asyncio.sleep(self.options.report)
+            rate = (self.stats.published - last) / self.options.report
+            last = self.stats.published
+            updating = sum(1 for d in self.devices if d.is_updating)
+            print(f"在線 {self.stats.connected}/{len(self.devices)}  發布 {rate:.0f} 則/秒  "
+                  f"更新中 {updating}  指令 {self.stats.commands}  OTA {self.stats.updates}")
+
+def raise_fd_limit(count):
+    """每台設備一條 TCP 連線，必要時提高檔案描述子上限"""
+    try:
+        import resource
+    except ImportError:
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    wanted = count * 2 + 256
+    if soft < wanted:
+        target = wanted if hard == resource.RLIM_INFINITY else min(wanted, hard)
+        resource.setrlimit(resource.RLIMIT_NOFILE, (target, hard))
+        if target < wanted:
+            print(f"⚠️ 檔案描述子上限 {target}，可能不足以模擬 {count} 台設備")
+
+async def run(args):
+    broker = None
+    if args.local_broker:
+        host, port = hoban_mqtt.parse_broker(args.broker or '127.0.0.1:0')
+        broker = await hoban_mqtt.Broker(host, port).start()
+        host, port = broker.host, broker.port
+        print(f"本機 MQTT broker 已啟動: {host}:{port}")
+    else:
+        host, port = hoban_mqtt.parse_broker(args.broker or '127.0.0.1')
+    args.server_name = args.server_name or host
+    print(f"啟動 {args.count} 台虛擬設備（{args.ramp:g} 台/秒）→ {host}:{port}")
+    try:
+        await Simulator(host, port, args).run()
+    finally:
+        if broker:
+            print(f"broker 共轉送 {broker.published} 則訊息")
+            await broker.stop()
+
+def main():
+    parser = argparse.ArgumentParser(description='hoRelay 設備模擬器')
+    parser.add_argument('--broker', help='MQTT broker（host 或 host:port，預設 127.0.0.1）')
+    parser.add_argument('--local-broker', action='store_true', help='在同一程序內啟動本機 broker')
+    parser.add_argument('--count', type=int, default=100, help='虛擬設備數量（預設 100）')
+    parser.add_argument('--start', type=int, default=0, help='設備編號起點，多個模擬器程序可分段')
+    parser.add_argument('--model', action='append', help='設備型號，可重複以輪流分配（預設 hoRelay2）')
+    parser.add_argument('--version', default='1.3.5', help='初始韌體版本（預設 1.3.5）')
+    parser.add_argument('--server-name', help='狀態中回報的伺服器名稱（預設為 broker 主機）')
+    parser.add_argument('--ssid', default='hoban-sim')
+    parser.add_argument('--interval', type=float, default=STATUS_INTERVAL,
+                        help=f'定期狀態間隔秒數（韌體為 {STATUS_INTERVAL}）')
+    parser.add_argument('--ramp', type=float, default=200, help='每秒啟動的設備數（預設 200，0 表示一次全部）')
+    parser.add_argument('--connect-timeout', type=float, default=5)
+    parser.add_argument('--image-size', type=int, default=DEFAULT_IMAGE_SIZE, help='模擬韌體大小 (bytes)')
+    parser.add_argument('--ota-seconds', type=float, default=30, help='單次下載所需秒數（預設 30）')
+    parser.add_argument('--ota-fail-rate', type=float, default=0.0, help='每次下載嘗試失敗的機率')
+    parser.add_argument('--boot-seconds', type=float, default=5, help='重新開機到重新連線的秒數（預設 5）')
+    parser.add_argument('--time-scale', type=float, default=1.0, help='縮放韌體內建等待時間（重試退避等）')
+    parser.add_argument('--binary', action='store_true', help='同時發布二進位狀態（對應 BINARY_STATUS=1 韌體）')
+    parser.add_argument('--report-progress', action='store_true',
+                        help='下載期間每秒發布 update_progress（韌體下載迴圈中不會發布）')
+    parser.add_argument('--duration', type=float, default=0, help='執行秒數，0 表示持續執行')
+    parser.add_argument('--report', type=float, default=5, help='統計輸出間隔秒數（預設 5）')
+    args = parser.parse_args()
+    args.model = args.model or ['hoRelay2']
+
+    raise_fd_limit(args.count * (2 if args.local_broker else 1))
+    try:
+        asyncio.run(run(args))
+    except OSError as e:
+        print(f"❌ 無法啟動: {e}")
+        sys.exit(1)
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
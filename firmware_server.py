@@ -0,0 +1,324 @@
+#!/usr/bin/env python3
+"""
+hoRelay 區網韌體檔案伺服器
+提供 publish.py 本機鏡像（HOCTRL_LOCAL_MIRROR）下的韌體檔案，支援 HTTP Range、ETag 與條件式請求，
+設備下載中斷後只需取回剩下的部分。檔案以 mmap 快取並計算一次 SHA-256，
+內容以 sendfile 直接從檔案送到 socket（不支援的平台改送 mmap 切片）
+
+用法:
+  python firmware_server.py --root /srv/hoctrl --port 8080
+  HOCTRL_LOCAL_MIRROR=/srv/hoctrl HOCTRL_LOCAL_MIRROR_URL=http://192.168.1.10:8080 \\
+      python publish.py 2 --mirrors github,local          # 發布時同時部署到這台伺服器
+
+續傳約定（設備端）:
+  1. 第一次 GET 不帶 Range，回應 200：Content-Length 為映像總大小，記下 ETag
+  2. 中斷後重試帶 Range: bytes={已寫入}- 與 If-Range: {ETag}
+  3. 回應 206 且 Content-Range 為 bytes {已寫入}-{總大小-1}/{總大小}：接續 Update.write
+  4. 回應 200：伺服器上的檔案已更換（ETag 不符）或不支援續傳，Update.abort() 後從頭開始
+  5. 回應 416：Range 超出檔案大小，從頭開始
+  所有回應帶 X-Firmware-SHA256（完整檔案的 SHA-256）供完成後比對
+"""
+
+import os
+import sys
+import mmap
+import time
+import asyncio
+import hashlib
+import argparse
+import collections
+import urllib.parse
+from email.utils import formatdate, parsedate_to_datetime
+
+DEFAULT_PORT = 8080
+DEFAULT_CACHE_ENTRIES = 64
+IDLE_TIMEOUT = 30
+# 無法 sendfile 時每次寫入的 mmap 切片大小
+CHUNK_SIZE = 64 * 1024
+
+REASONS = {200: 'OK', 206: 'Partial Content', 304: 'Not Modified', 400: 'Bad Request', 404: 'Not Found',
+           405: 'Method Not Allowed', 412: 'Precondition Failed', 416: 'Range Not Satisfiable'}
+
+# ── 檔案快取 ────────────────────────────────────────────────────────
+
+class Artifact:
+    """已開啟並 mmap 的檔案；ETag 取自內容的 SHA-256，檔案被置換（os.replace）後自動失效"""
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'rb')
+        stat = os.fstat(self.file.fileno())
+        self.identity = (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+        self.size = stat.st_size
+        self.mtime = stat.st_mtime
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if self.size else b''
+        self.sha256 = hashlib.sha256(self.map).hexdigest()
+        self.etag = f'"{self.sha256[:32]}"'
+        self.last_modified = formatdate(self.mtime, usegmt=True)
+
+    def stale(self):
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return True
+        return (stat.st_ino, stat.st_size, stat.st_mtime_ns) != self.identity
+
+class ArtifactCache:
+    """依 LRU 保留最近使用的檔案；被淘汰或失效的項目交由 GC 關閉，傳送中的連線不受影響"""
+
+    def __init__(self, root, max_entries=DEFAULT_CACHE_ENTRIES):
+        self.root = os.path.realpath(root)
+        self.max_entries = max_entries
+        self._entries = collections.OrderedDict()
+
+    def resolve(self, url_path):
+        """URL 路徑 → 根目錄下的檔案路徑；超出根目錄或不是檔案回傳 None"""
+        relative = urllib.parse.unquote(url_path).lstrip('/')
+        path = os.path.realpath(os.path.join(self.root, relative))
+        if os.path.commonpath([path, self.root]) != self.root or not os.path.isfile(path):
+            return None
+        return path
+
+    def get(self, path):
+        artifact = self._entries.get(path)
+        if artifact is not None and not artifact.stale():
+            self._entries.move_to_end(path)
+            return artifact
+        artifact = Artifact(path)
+        self._entries[path] = artifact
+        self._entries.move_to_end(path)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        return artifact
+
+# ── HTTP ────────────────────────────────────────────────────────────
+
+def parse_range(value, size):
+    """解析單一 bytes 範圍，回傳 (start, end)（含 end）；格式錯誤或多重範圍回傳 None，
+    範圍無法滿足時回傳 False（起點超過檔案大小時優先判定，即使 end 小於 start）
+
+    >>> parse_range('bytes=100-', 1000), parse_range('bytes=-100', 1000)
+    ((100, 999), (900, 999))
+    >>> parse_range('bytes=1000-', 1000), parse_range('bytes=5000-10', 1000)
+    (False, False)
+    >>> parse_range('bytes=500-10', 1000), parse_range('bytes=0-1,5-9', 1000)
+    (None, None)
+    """
+    unit, _, spec = value.partition('=')
+    if unit.strip().lower() != 'bytes' or ',' in spec:
+        return None
+    first, sep, last = spec.strip().partition('-')
+    if not sep:
+        return None
+    try:
+        if first == '':
+            length = int(last)
+            if length <= 0:
+                return False
+            return max(0, size - length), size - 1
+        start = int(first)
+        end = int(last) if last else size - 1
+    except ValueError:
+        return None
+    if start >= size:
+        return False
+    if start > end:
+        return None
+    return start, min(end, size - 1)
+
+def _etag_matches(header, etag):
+    candidates = [t.strip() for t in header.split(',')]
+    return '*' in candidates or etag in candidates or f'W/{etag}' in candidates
+
+def _not_modified_since(header, mtime):
+    try:
+        return int(mtime) <= parsedate_to_datetime(header).timestamp()
+    except (TypeError, ValueError):
+        return False
+
+def evaluate(method, headers, artifact):
+    """依條件式請求與 Range 決定回應，回傳 (status, start, end)；end 不含"""
+    if 'if-match' in headers and not _etag_matches(headers['if-match'], artifact.etag):
+        return 412, 0, 0
+    if 'if-unmodified-since' in headers and not _not_modified_since(headers['if-unmodified-since'], artifact.mtime):
+        return 412, 0, 0
+    if 'if-none-match' in headers:
+        if _etag_matches(headers['if-none-match'], artifact.etag):
+            return 304, 0, 0
+    elif 'if-modified-since' in headers and _not_modified_since(headers['if-modified-since'], artifact.mtime):
+        return 304, 0, 0
+
+    range_header = headers.get('range')
+    if range_header and method == 'GET':
+        if_range = headers.get('if-range')
+        # If-Range 不符代表設備手上的部分是舊檔案，改回傳完整的新檔案
+        if if_range is None or if_range == artifact.etag or (
+                not if_range.startswith(('"', 'W/')) and _not_modified_since(if_range, artifact.mtime)):
+            parsed = parse_range(range_header, artifact.size)
+            if parsed is False:
+                return 416, 0, 0
+            if parsed:
+                return 206, parsed[0], parsed[1] + 1
+    return 200, 0, artifact.size
+
+class Stats:
+    def __init__(self):
+        self.counts = collections.Counter()
+        self.bytes_sent = 0
+        self.resumed_bytes = 0
+        self.connections = 0
+
+    def line(self):
+        codes = ' '.join(f"{code}:{n}" for code, n in sorted(self.counts.items()))
+        return (f"連線 {self.connections}，回應 {codes or '-'}，送出 {self.bytes_sent / 1024 / 1024:.1f} MB，"
+                f"續傳省下 {self.resumed_bytes / 1024 / 1024:.1f} MB")
+
+class FirmwareServer:
+    def __init__(self, root, max_entries=DEFAULT_CACHE_ENTRIES, use_sendfile=True, log=True):
+        self.cache = ArtifactCache(root, max_entries)
+        self.use_sendfile = use_sendfile
+        self.log = log
+        self.stats = Stats()
+
+    async def handle(self, reader, writer):
+        self.stats.connections += 1
+        peer = writer.get_extra_info('peername')
+        try:
+            while True:
+                request = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), IDLE_TIMEOUT)
+                keep_alive = await self._respond(request, writer, peer)
+                if not keep_alive:
+                    break
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def _respond(self, request, writer, peer):
+        lines = request.decode('latin-1').split('\r\n')
+        parts = lines[0].split(' ')
+        if len(parts) != 3:
+            await self._send_head(writer, 400, {}, close=True)
+            return False
+        method, target, version = parts
+        headers = {}
+        for line in lines[1:]:
+            name, sep, value = line.partition(':')
+            if sep:
+                headers[name.strip().lower()] = value.strip()
+        connection = headers.get('connection', '').lower()
+        keep_alive = connection != 'close' if version == 'HTTP/1.1' else connection == 'keep-alive'
+
+        if method not in ('GET', 'HEAD'):
+            await self._send_head(writer, 405, {'Allow': 'GET, HEAD'}, keep_alive)
+            return keep_alive
+        path = self.cache.resolve(urllib.parse.urlsplit(target).path)
+        if path is None:
+            await self._send_head(writer, 404, {}, keep_alive)
+            return keep_alive
+        try:
+            artifact = self.cache.get(path)
+        except OSError:
+            await self._send_head(writer, 404, {}, keep_alive)
+            return keep_alive
+        status, start, end = evaluate(method, headers, artifact)
+        fields = {
+            'ETag': artifact.etag,
+            'Last-Modified': artifact.last_modified,
+            'Accept-Ranges': 'bytes',
+            'X-Firmware-SHA256': artifact.sha256,
+            'Cache-Control': 'no-cache',
+        }
+        if status == 206:
+            fields['Content-Range'] = f"bytes {start}-{end - 1}/{artifact.size}"
+            self.stats.resumed_bytes += start
+        elif status == 416:
+            fields['Content-Range'] = f"bytes */{artifact.size}"
+        if status in (200, 206):
+            fields['Content-Type'] = 'application/octet-stream'
+            fields['Content-Length'] = str(end - start)
+        await self._send_head(writer, status, fields, keep_alive)
+        if method == 'GET' and status in (200, 206) and end > start:
+            await self._send_body(writer, artifact, start, end - start)
+            self.stats.bytes_sent += end - start
+        if self.log:
+            print(f"{time.strftime('%H:%M:%S')} {peer[0] if peer else '-'} {method} {target} {status} "
+                  f"{fields.get('Content-Range', fields.get('Content-Length', ''))}")
+        return keep_alive
+
+    async def _send_head(self, writer, status, fields, keep_alive=False, close=False):
+        self.stats.counts[status] += 1
+        if status not in (200, 206, 304) and 'Content-Length' not in fields:
+            fields['Content-Length'] = '0'
+        fields['Date'] = formatdate(usegmt=True)
+        fields['Connection'] = 'keep-alive' if keep_alive and not close else 'close'
+        head = f"HTTP/1.1 {status} {REASONS[status]}\r\n"
+        head += ''.join(f"{k}: {v}\r\n" for k, v in fields.items()) + '\r\n'
+        writer.write(head.encode('latin-1'))
+        await writer.drain()
+
+    async def _send_body(self, writer, artifact, offset, count):
+        if self.use_sendfile:
+            try:
+                await asyncio.get_running_loop().sendfile(writer.transport, artifact.file, offset, count,
+                                                          fallback=False)
+                return
+            except (NotImplementedError, RuntimeError, asyncio.SendfileNotAvailableError):
+                self.use_sendfile = False
+        view = memoryview(artifact.map)
+        try:
+            for position in range(offset, offset + count, CHUNK_SIZE):
+                writer.write(view[position:min(position + CHUNK_SIZE, offset + count)])
+                await writer.drain()
+        finally:
+            view.release()
+
+    async def start(self, host, port):
+        self.server = await asyncio.start_server(self.handle, host, port, backlog=1024)
+        self.host, self.port = self.server.sockets[0].getsockname()[:2]
+        return self
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+# ── 命令列 ──────────────────────────────────────────────────────────
+
+async def run(args):
+    server = await FirmwareServer(args.root, args.cache_entries, not args.no_sendfile, not args.quiet).start(
+        args.bind, args.port)
+    print(f"韌體伺服器: http://{server.host}:{server.port}/  根目錄: {server.cache.root}")
+    print(f"publish.py 部署: HOCTRL_LOCAL_MIRROR={server.cache.root} "
+          f"HOCTRL_LOCAL_MIRROR_URL=http://<本機 IP>:{server.port}")
+    try:
+        while True:
+            await asyncio.sleep(args.stats_interval)
+            print(f"[{time.strftime('%H:%M:%S')}] {server.stats.line()}")
+    finally:
+        await server.stop()
+
+def main():
+    parser = argparse.ArgumentParser(description='hoRelay 區網韌體檔案伺服器')
+    parser.add_argument('--root', default=os.getenv('HOCTRL_LOCAL_MIRROR'),
+                        help='檔案根目錄（預設 HOCTRL_LOCAL_MIRROR）')
+    parser.add_argument('--bind', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT, help=f'連接埠（預設 {DEFAULT_PORT}）')
+    parser.add_argument('--cache-entries', type=int, default=DEFAULT_CACHE_ENTRIES, help='mmap 快取的檔案數上限')
+    parser.add_argument('--no-sendfile', action='store_true', help='不使用 sendfile，一律送出 mmap 切片')
+    parser.add_argument('--stats-interval', type=float, default=60, help='統計輸出間隔秒數（預設 60）')
+    parser.add_argument('--quiet', action='store_true', help='不輸出每筆請求')
+    args = parser.parse_args()
+
+    if not args.root or not os.path.isdir(args.root):
+        print(f"❌ 找不到根目錄: {args.root}（以 --root 或 HOCTRL_LOCAL_MIRROR 指定）")
+        sys.exit(1)
+    try:
+        asyncio.run(run(args))
+    except OSError as e:
+        print(f"❌ {e}")
+        sys.exit(1)
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
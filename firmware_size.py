@@ -0,0 +1,404 @@
+#!/usr/bin/env python3
+"""
+hoRelay 韌體大小與記憶體預算
+解析 arduino-cli 編譯結束時的大小摘要、.elf 的區段表與 .map 的連結明細，
+統計 flash / IRAM / DRAM 用量與各函式庫貢獻，附加到歷史檔，並檢查映像是否放得進 OTA 分區、
+是否超出預算或比上一個版本成長太多
+
+用法:
+  python firmware_size.py report ho_relay3/build                      # 顯示大小與前 15 名函式庫
+  python firmware_size.py check ho_relay2/build/hoRelay2 --model hoRelay2 --partitions ho_relay2/partitions.csv
+  python firmware_size.py history --model hoRelay2                     # 各版本大小趨勢
+  python firmware_size.py diff --model hoRelay2                        # 最近兩筆的函式庫差異
+
+歷史檔 (build/size_history.jsonl)，每行一筆:
+  {"timestamp":..,"model":"hoRelay2","version":"2.0.5","image":1843200,"slot":2031616,
+   "flash":..,"iram":..,"dram":..,"cli":{...},"libraries":{"libbt.a":{"flash":..,"iram":..,"dram":..}},
+   "passed":true,"failures":[]}
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import struct
+import argparse
+from pathlib import Path
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+HISTORY_FILE = os.path.join(SCRIPT_DIR, 'build', 'size_history.jsonl')
+
+# 沒有 partitions.csv 時 arduino-esp32 預設分區表 (default.csv) 的 app 分區大小
+DEFAULT_APP_SLOT = 0x140000
+# 預設預算：映像至少要在 OTA 分區內留 32 KB，單一版本成長不超過 64 KB
+DEFAULT_HEADROOM = 32 * 1024
+DEFAULT_MAX_GROWTH = 64 * 1024
+# 編譯輸出的大小摘要另存在 build 目錄，編譯快取命中時一併還原
+CLI_SUMMARY_SUFFIX = '.size.json'
+
+REGIONS = ('flash', 'iram', 'dram')
+
+class SizeError(Exception):
+    pass
+
+# ── 區段分類 ────────────────────────────────────────────────────────
+
+def region_of(section):
+    """輸出區段名稱 → flash / iram / dram，不佔設備記憶體的區段回傳 None
+
+    ESP32 與 ESP32-C3 的連結腳本都以 .flash.* 放在外部 flash 映射區、.iram0.* 放在 IRAM、
+    .dram0.* 放在 DRAM；C3 的 .dram0.dummy 只是為了與 IRAM 共用位址而保留的空白，不計入。
+    """
+    if 'dummy' in section:
+        return None
+    if section.startswith(('.flash', '.irom', '.drom')):
+        return 'flash'
+    if section.startswith('.iram'):
+        return 'iram'
+    if section.startswith(('.dram', '.noinit', '.ext_ram')):
+        return 'dram'
+    return None
+
+# ── arduino-cli 輸出 ────────────────────────────────────────────────
+
+_CLI_PROGRAM = re.compile(r'Sketch uses (\d+) bytes \((\d+)%\) of program storage space\. Maximum is (\d+) bytes')
+_CLI_GLOBALS = re.compile(r'Global variables use (\d+) bytes \((\d+)%\) of dynamic memory.*?Maximum is (\d+) bytes')
+
+def parse_cli_output(text):
+    """解析 arduino-cli compile 結尾的大小摘要，找不到時回傳空 dict"""
+    summary = {}
+    match = _CLI_PROGRAM.search(text or '')
+    if match:
+        summary['program'] = int(match.group(1))
+        summary['program_max'] = int(match.group(3))
+    match = _CLI_GLOBALS.search(text or '')
+    if match:
+        summary['globals'] = int(match.group(1))
+        summary['globals_max'] = int(match.group(3))
+    return summary
+
+def save_cli_summary(build_path, sketch_name, text):
+    """把編譯輸出中的大小摘要寫到 build 目錄，沒有摘要時不寫"""
+    summary = parse_cli_output(text)
+    if summary:
+        with open(os.path.join(build_path, sketch_name + CLI_SUMMARY_SUFFIX), 'w', encoding='utf-8') as f:
+            json.dump(summary, f)
+    return summary
+
+# ── ELF ─────────────────────────────────────────────────────────────
+
+SHF_ALLOC = 0x2
+SHT_NOBITS = 8
+
+def read_elf_sections(path):
+    """讀取 ELF32 little-endian 區段表，回傳 [(name, size, nobits)]，只含會載入的區段"""
+    with open(path, 'rb') as f:
+        data = f.read()
+    if data[:4] != b'\x7fELF' or data[4] != 1 or data[5] != 1:
+        raise SizeError(f"{path} 不是 ELF32 little-endian 檔案")
+    shoff, = struct.unpack_from('<I', data, 0x20)
+    shentsize, shnum, shstrndx = struct.unpack_from('<HHH', data, 0x2E)
+    headers = [struct.unpack_from('<IIIIIIIIII', data, shoff + i * shentsize) for i in range(shnum)]
+    strtab = headers[shstrndx][4]
+
+    def name_at(offset):
+        end = data.index(b'\0', strtab + offset)
+        return data[strtab + offset:end].decode('ascii', errors='replace')
+
+    sections = []
+    for name_off, sh_type, flags, _, _, size, *_ in headers:
+        if flags & SHF_ALLOC and size:
+            sections.append((name_at(name_off), size, sh_type == SHT_NOBITS))
+    return sections
+
+def elf_usage(path):
+    """依區段統計 flash / IRAM / DRAM 用量 (bytes)"""
+    usage = dict.fromkeys(REGIONS, 0)
+    for name, size, _ in read_elf_sections(path):
+        region = region_of(name)
+        if region:
+            usage[region] += size
+    return usage
+
+# ── 連結 map ────────────────────────────────────────────────────────
+
+_INPUT_SECTION = re.compile(r'^ (\S+)?\s+0x([0-9a-fA-F]+)\s+0x([0-9a-fA-F]+)\s+(\S.*)$')
+_INPUT_NAME_ONLY = re.compile(r'^ (\.\S+|COMMON)$')
+
+def library_of(path):
+    """輸入檔路徑 → 函式庫名稱：Arduino 函式庫取目錄名，預編譯的 .a 取檔名，草稿碼為 sketch"""
+    path = path.replace('\\', '/')
+    archive = re.search(r'([^/]+\.a)\(', path)
+    if archive:
+        name = archive.group(1)
+        return 'core' if name == 'core.a' else name
+    match = re.search(r'/libraries/([^/]+)/', path)
+    if match:
+        return match.group(1)
+    if '/sketch/' in path:
+        return 'sketch'
+    if '/core/' in path:
+        return 'core'
+    return os.path.basename(path)
+
+def parse_map(path):
+    """統計 .map 中每個函式庫在各記憶體區的位元組數，回傳 {函式庫: {region: bytes}}"""
+    libraries = {}
+    in_memory_map = False
+    region = None
+    pending_name = False
+    with open(path, 'r', encoding='utf-8', errors='replace') as f:
+        for line in f:
+            line = line.rstrip('\n')
+            if not in_memory_map:
+                in_memory_map = line.startswith('Linker script and memory map')
+                continue
+            if not line.strip():
+                continue
+            if not line[0].isspace():
+                # 頂格的行是輸出區段（.flash.text、.iram0.text ...）
+                region = region_of(line.split()[0])
+                pending_name = False
+                continue
+            if region is None:
+                continue
+            if _INPUT_NAME_ONLY.match(line):
+                # 輸入區段名稱太長時，位址與大小換到下一行
+                pending_name = True
+                continue
+            match = _INPUT_SECTION.match(line)
+            if not match:
+                pending_name = False
+                continue
+            name, size, source = match.group(1), int(match.group(3), 16), match.group(4)
+            if name == '*fill*' or not size or (name is None and not pending_name):
+                pending_name = False
+                continue
+            pending_name = False
+            usage = libraries.setdefault(library_of(source), dict.fromkeys(REGIONS, 0))
+            usage[region] += size
+    return libraries
+
+# ── 分區表 ──────────────────────────────────────────────────────────
+
+def ota_slot_size(partitions_csv=None):
+    """OTA 分區中最小的 app 分區大小；沒有 partitions.csv 時使用預設分區表"""
+    if not partitions_csv or not os.path.exists(partitions_csv):
+        return DEFAULT_APP_SLOT
+    sizes = []
+    with open(partitions_csv, 'r', encoding='utf-8') as f:
+        for line in f:
+            fields = [p.strip() for p in line.split('#')[0].split(',')]
+            if len(fields) >= 5 and fields[1] == 'app' and fields[4]:
+                sizes.append(_parse_size(fields[4]))
+    if not sizes:
+        raise SizeError(f"{partitions_csv} 沒有 app 分區")
+    return min(sizes)
+
+def _parse_size(value):
+    value = value.strip().upper()
+    if value.endswith('K'):
+        return int(value[:-1], 0) * 1024
+    if value.endswith('M'):
+        return int(value[:-1], 0) * 1024 * 1024
+    return int(value, 0)
+
+# ── 報告與預算 ──────────────────────────────────────────────────────
+
+def _find(build_dir, suffix):
+    found = sorted(Path(build_dir).glob(f'*{suffix}'))
+    return str(found[0]) if found else None
+
+def analyze(build_dir, model, version=None, partitions_csv=None):
+    """分析 build 目錄中的 .bin / .elf / .map，回傳大小報告 dict"""
+    # arduino-cli 會另外輸出 .bootloader.bin / .partitions.bin / .merged.bin，只取應用程式映像
+    candidates = [p for p in Path(build_dir).glob('*.bin')
+                  if not p.name.endswith(('.bootloader.bin', '.partitions.bin', '.merged.bin'))]
+    if not candidates:
+        raise SizeError(f"{build_dir} 中找不到 .bin")
+    bin_path = str(sorted(candidates)[0])
+    report = {
+        'timestamp': time.time(),
+        'model': model,
+        'version': version,
+        'image': os.path.getsize(bin_path),
+        'slot': ota_slot_size(partitions_csv),
+    }
+    elf_path = _find(build_dir, '.elf')
+    if elf_path:
+        report.update(elf_usage(elf_path))
+    map_path = _find(build_dir, '.map')
+    if map_path:
+        report['libraries'] = parse_map(map_path)
+    summary_path = _find(build_dir, CLI_SUMMARY_SUFFIX)
+    if summary_path:
+        with open(summary_path, 'r', encoding='utf-8') as f:
+            report['cli'] = json.load(f)
+    return report
+
+def check_budget(report, previous=None, budget=None):
+    """回傳未通過的項目說明 list；放不進 OTA 分區一律失敗，其餘依預算設定
+
+    budget 欄位（皆為 bytes，可省略）: image 映像上限、headroom 分區至少保留的空間、
+    growth 相對上一筆通過紀錄的成長上限、iram / dram 用量上限
+    """
+    budget = budget or {}
+    failures = []
+    image, slot = report['image'], report['slot']
+    if image > slot:
+        failures.append(f"映像 {image:,} bytes 超過 OTA 分區 {slot:,} bytes，設備將無法更新")
+    else:
+        headroom = budget.get('headroom', DEFAULT_HEADROOM)
+        if slot - image < headroom:
+            failures.append(f"OTA 分區只剩 {slot - image:,} bytes，低於保留空間 {headroom:,} bytes")
+    if budget.get('image') and image > budget['image']:
+        failures.append(f"映像 {image:,} bytes 超過預算 {budget['image']:,} bytes")
+    for region in ('iram', 'dram'):
+        if budget.get(region) and report.get(region, 0) > budget[region]:
+            failures.append(f"{region.upper()} {report[region]:,} bytes 超過預算 {budget[region]:,} bytes")
+    cli = report.get('cli', {})
+    if cli.get('globals_max') and cli.get('globals', 0) > cli['globals_max']:
+        failures.append(f"全域變數 {cli['globals']:,} bytes 超過可用記憶體 {cli['globals_max']:,} bytes")
+    if previous:
+        growth = image - previous['image']
+        limit = budget.get('growth', DEFAULT_MAX_GROWTH)
+        if growth > limit:
+            failures.append(f"映像比 v{previous.get('version')} 成長 {growth:,} bytes，超過上限 {limit:,} bytes")
+    return failures
+
+def library_diff(report, previous, limit=10):
+    """回傳變化最大的函式庫 [(名稱, 舊大小, 新大小)]，大小為三個記憶體區的合計"""
+    old = {k: sum(v.values()) for k, v in (previous.get('libraries') or {}).items()}
+    new = {k: sum(v.values()) for k, v in (report.get('libraries') or {}).items()}
+    changes = [(name, old.get(name, 0), new.get(name, 0)) for name in set(old) | set(new)
+               if old.get(name, 0) != new.get(name, 0)]
+    changes.sort(key=lambda c: abs(c[2] - c[1]), reverse=True)
+    return changes[:limit]
+
+# ── 歷史檔 ──────────────────────────────────────────────────────────
+
+def load_history(model=None, path=HISTORY_FILE):
+    entries = []
+    if not os.path.exists(path):
+        return entries
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            if model is None or entry.get('model') == model:
+                entries.append(entry)
+    return entries
+
+def last_passed(model, path=HISTORY_FILE):
+    """同型號最近一筆通過檢查的紀錄，作為成長比較的基準"""
+    for entry in reversed(load_history(model, path)):
+        if entry.get('passed'):
+            return entry
+    return None
+
+def append_history(report, path=HISTORY_FILE):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write(json.dumps(report, ensure_ascii=False, separators=(',', ':')) + '\n')
+
+def check_build(build_dir, model, version=None, partitions_csv=None, budget=None, record=True,
+                history=HISTORY_FILE):
+    """分析並檢查一個變體的編譯結果，寫入歷史檔，回傳 (report, previous, failures)"""
+    report = analyze(build_dir, model, version, partitions_csv)
+    previous = last_passed(model, history)
+    failures = check_budget(report, previous, budget)
+    report['passed'] = not failures
+    report['failures'] = failures
+    if record:
+        append_history(report, history)
+    return report, previous, failures
+
+# ── 命令列 ──────────────────────────────────────────────────────────
+
+def format_report(report, previous=None):
+    lines = []
+    slot = report['slot']
+    lines.append(f"映像   {report['image']:>10,} bytes  OTA 分區 {slot:,} bytes "
+                 f"({report['image'] * 100 / slot:.1f}%，剩 {slot - report['image']:,})")
+    for region in REGIONS:
+        if region in report:
+            delta = ''
+            if previous and region in previous:
+                delta = f"  {report[region] - previous[region]:+,}"
+            lines.append(f"{region.upper():<6} {report[region]:>10,} bytes{delta}")
+    cli = report.get('cli')
+    if cli and 'globals' in cli:
+        lines.append(f"全域變數 {cli['globals']:,} / {cli.get('globals_max', 0):,} bytes (arduino-cli)")
+    if previous:
+        lines.append(f"與 v{previous.get('version')} 相比: {report['image'] - previous['image']:+,} bytes")
+    return lines
+
+def print_libraries(report, limit):
+    libraries = sorted((report.get('libraries') or {}).items(), key=lambda item: -sum(item[1].values()))
+    if not libraries:
+        return
+    print(f"\n{'函式庫':<27} {'flash':>10} {'iram':>8} {'dram':>8}")
+    for name, usage in libraries[:limit]:
+        print(f"{name:<30} {usage['flash']:>10,} {usage['iram']:>8,} {usage['dram']:>8,}")
+
+def main():
+    parser = argparse.ArgumentParser(description='hoRelay 韌體大小與記憶體預算')
+    parser.add_argument('--history', default=HISTORY_FILE, help='歷史檔路徑')
+    sub = parser.add_subparsers(dest='command', required=True)
+    for name, help_text in (('report', '顯示編譯結果大小'), ('check', '檢查預算並寫入歷史檔')):
+        p = sub.add_parser(name, help=help_text)
+        p.add_argument('build_dir')
+        p.add_argument('--model', default='unknown')
+        p.add_argument('--version')
+        p.add_argument('--partitions', help='partitions.csv（預設使用 arduino-esp32 預設分區表）')
+        p.add_argument('--top', type=int, default=15, help='列出前幾名函式庫（預設 15）')
+        if name == 'check':
+            p.add_argument('--max-image', type=int, help='映像大小上限 (bytes)')
+            p.add_argument('--max-growth', type=int, default=DEFAULT_MAX_GROWTH, help='單一版本成長上限 (bytes)')
+            p.add_argument('--headroom', type=int, default=DEFAULT_HEADROOM, help='OTA 分區保留空間 (bytes)')
+    p = sub.add_parser('history', help='各版本大小趨勢')
+    p.add_argument('--model')
+    p = sub.add_parser('diff', help='最近兩筆紀錄的函式庫差異')
+    p.add_argument('--model', required=True)
+    args = parser.parse_args()
+
+    try:
+        if args.command == 'report':
+            report = analyze(args.build_dir, args.model, args.version, args.partitions)
+            print('\n'.join(format_report(report, last_passed(args.model, args.history))))
+            print_libraries(report, args.top)
+        elif args.command == 'check':
+            budget = {'image': args.max_image, 'growth': args.max_growth, 'headroom': args.headroom}
+            report, previous, failures = check_build(args.build_dir, args.model, args.version,
+                                                     args.partitions, budget, history=args.history)
+            print('\n'.join(format_report(report, previous)))
+            for failure in failures:
+                print(f"❌ {failure}")
+            if failures:
+                sys.exit(1)
+            print("✓ 大小檢查通過")
+        elif args.command == 'history':
+            for entry in load_history(args.model, args.history):
+                stamp = time.strftime('%Y-%m-%d %H:%M', time.localtime(entry['timestamp']))
+                mark = '✓' if entry.get('passed') else '❌'
+                print(f"{stamp}  {entry['model']:<11} v{entry.get('version') or '?':<8} "
+                      f"{entry['image']:>10,}  {entry['image'] * 100 / entry['slot']:5.1f}%  "
+                      f"IRAM {entry.get('iram', 0):>7,}  DRAM {entry.get('dram', 0):>7,}  {mark}")
+        elif args.command == 'diff':
+            entries = load_history(args.model, args.history)
+            if len(entries) < 2:
+                raise SizeError(f"{args.model} 的歷史紀錄不足兩筆")
+            previous, report = entries[-2], entries[-1]
+            print(f"v{previous.get('version')} → v{report.get('version')}: "
+                  f"{report['image'] - previous['image']:+,} bytes")
+            for name, old, new in library_diff(report, previous, limit=20):
+                print(f"  {name:<30} {old:>10,} → {new:>10,}  {new - old:+,}")
+    except (SizeError, OSError, ValueError) as e:
+        print(f"❌ {e}")
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,289 @@
+#!/usr/bin/env python3
+"""
+hoRelay 車隊批次指令
+依型號、版本或標籤選出一組設備，對每個 broker 只維持一條連線，以 token bucket 限速、
+QoS 1 管線化（不逐則等待 PUBACK）送出控制指令，並以設備下一則狀態訊息確認指令已生效；
+加上 --correlate 時指令附帶關聯 ID，改以設備回覆的 ack 確認（需支援的韌體）
+
+用法:
+  python fleet_command.py ON --broker mqttgo.io --tag north-traps            # 觸發一組陷阱
+  python fleet_command.py OFF --broker mqttgo.io --model hoRelay3 --version 1.3.5
+  python fleet_command.py status --broker mqttgo.io --broker broker.emqx.io --rate 200
+  python fleet_command.py ON --device hoban-a1b2c3d4e5f6 --dry-run
+
+標籤檔 (--tags，預設 device_tags.json):
+  {"hoban-a1b2c3d4e5f6": ["north-traps", "zone-3"], ...}
+"""
+
+import os
+import sys
+import json
+import time
+import secrets
+import asyncio
+import argparse
+
+import hoban_mqtt
+import broker_bench
+from fleet_status import FleetIndex
+
+COMMANDS = ('ON', 'OFF', 'status', 'FIND_BEST_SERVER')
+DEFAULT_TAGS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'device_tags.json')
+
+RESULT_ACKED = 'acked'
+RESULT_SENT = 'sent'          # 已收到 PUBACK，但時限內沒有確認狀態
+RESULT_FAILED = 'failed'      # 發布失敗
+
+# 點動型號：ON 吸合一下就自動放開，沒有 OFF 指令；點動結束後才發布狀態，此時 relay 已回到 0
+PULSE_MODELS = ('hoRelay1', 'hoRelay2', 'hoRelay2-1')
+
+def supports_command(model, command):
+    """型號是否實作此指令；型號未知時視為支援"""
+    return not (command == 'OFF' and model in PULSE_MODELS)
+
+def command_acknowledged(command, data, command_id=None, model=None):
+    """判斷一則狀態訊息是否代表指令已生效；有關聯 ID 時只接受相符的 ack"""
+    if command_id:
+        return data.get('ack') == command_id
+    if command == 'FIND_BEST_SERVER':
+        return data.get('event') == 'server_changed'
+    device = data.get('device')
+    if not isinstance(device, dict):
+        return False
+    if command == 'ON':
+        if model in PULSE_MODELS:
+            return 'version' in data
+        return device.get('relay') == 1
+    if command == 'OFF':
+        return device.get('relay') == 0
+    return 'version' in data
+
+class TokenBucket:
+    """每秒補充 rate 個 token，最多累積 burst 個"""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.capacity = max(1, burst)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+
+    async def acquire(self):
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+class AckTracker(FleetIndex):
+    """在設備索引上加入等待確認的機制，並記錄每台設備是在哪個 broker 上看到的"""
+
+    def __init__(self):
+        super().__init__()
+        self.routes = {}
+        self._pending = {}
+
+    def update(self, device_id, data, now=None):
+        record = super().update(device_id, data, now)
+        pending = self._pending.get(device_id)
+        if pending:
+            command, command_id, future = pending
+            if not future.done() and command_acknowledged(command, data, command_id, record.get('model')):
+                future.set_result(time.perf_counter())
+        return record
+
+    def listener(self, broker_name):
+        def on_message(message):
+            device_id = hoban_mqtt.device_id_from_topic(message.topic)
+            if device_id and message.payload:
+                self.routes[device_id] = broker_name
+            self.on_message(message)
+        return on_message
+
+    def expect(self, device_id, command, command_id=None):
+        future = asyncio.get_running_loop().create_future()
+        self._pending[device_id] = (command, command_id, future)
+        return future
+
+    def forget(self, device_id):
+        self._pending.pop(device_id, None)
+
+class CommandDispatcher:
+    """每個 broker 一條持久連線，訂閱狀態並分派控制指令"""
+
+    def __init__(self, brokers, rate=500, burst=100):
+        self.targets = {t['name']: t for t in (broker_bench.parse_target(b) for b in brokers)}
+        self.tracker = AckTracker()
+        self.bucket = TokenBucket(rate, burst)
+        self.clients = {}
+
+    async def start(self, discover=3):
+        async def open_one(name, target):
+            client = hoban_mqtt.MQTTClient(target['host'], target['port'],
+                                           client_id=f"hoctrl-cmd-{int(time.time())}-{len(self.clients)}",
+                                           username=target['username'], password=target['password'],
+                                           on_message=self.tracker.listener(name))
+            await client.connect()
+            await client.subscribe(hoban_mqtt.STATUS_WILDCARD)
+            self.clients[name] = client
+
+        await asyncio.gather(*(open_one(n, t) for n, t in self.targets.items()))
+        if discover:
+            await asyncio.sleep(discover)
+
+    async def close(self):
+        await asyncio.gather(*(c.disconnect() for c in self.clients.values()))
+
+    def select(self, model=None, version=None, status='online', tag=None, tags=None, device_ids=None):
+        """依條件選出設備；指定 device_ids 時只在其中篩選"""
+        if device_ids:
+            candidates = [self.tracker.records.get(d, {'device_id': d}) for d in device_ids]
+            candidates = [r for r in candidates
+                          if (model is None or r.get('model') == model)
+                          and (version is None or r.get('version') == version)]
+        else:
+            candidates = self.tracker.query(model=model, version=version, status=status)
+        if tag:
+            tagged = {d for d, device_tags in (tags or {}).items() if tag in device_tags}
+            candidates = [r for r in candidates if r['device_id'] in tagged]
+        return [r['device_id'] for r in candidates]
+
+    def unsupported(self, device_ids, command):
+        """回傳型號沒有實作此指令的設備"""
+        return [d for d in device_ids
+                if not supports_command(self.tracker.records.get(d, {}).get('model'), command)]
+
+    def _client_for(self, device_id):
+        name = self.tracker.routes.get(device_id) or next(iter(self.clients))
+        return name, self.clients[name]
+
+    async def send(self, device_ids, command, ack_timeout=5.0, wait_ack=True, correlate=False):
+        """送出指令並回傳每台設備的結果；各設備的 PUBACK 與狀態確認同時等待"""
+        results = []
+        waits = []
+        for device_id in device_ids:
+            await self.bucket.acquire()
+            name, client = self._client_for(device_id)
+            result = {'device_id': device_id, 'broker': name, 'result': RESULT_FAILED}
+            payload = command
+            if correlate:
+                result['id'] = secrets.token_hex(4)
+                payload = hoban_mqtt.tag_command(command, result['id'])
+            results.append(result)
+            ack = self.tracker.expect(device_id, command, result.get('id')) if wait_ack else None
+            sent = time.perf_counter()
+            try:
+                puback = await client.publish(hoban_mqtt.control_topic(device_id), payload, qos=1, wait=False)
+            except hoban_mqtt.MQTTError as e:
+                result['error'] = str(e)
+                self.tracker.forget(device_id)
+                continue
+            waits.append(asyncio.ensure_future(self._settle(result, puback, ack, sent, ack_timeout)))
+        await asyncio.gather(*waits)
+        return results
+
+    async def _settle(self, result, puback, ack, sent, ack_timeout):
+        try:
+            await asyncio.wait_for(puback, ack_timeout)
+            result['puback_ms'] = round((time.perf_counter() - sent) * 1000, 1)
+            result['result'] = RESULT_SENT
+            if ack is not None:
+                remaining = max(0.0, ack_timeout - (time.perf_counter() - sent))
+                acked = await asyncio.wait_for(asyncio.shield(ack), remaining)
+                result['ack_ms'] = round((acked - sent) * 1000, 1)
+                result['result'] = RESULT_ACKED
+        except asyncio.TimeoutError:
+            pass
+        except hoban_mqtt.MQTTError as e:
+            result['error'] = str(e)
+        finally:
+            self.tracker.forget(result['device_id'])
+
+def load_tags(path):
+    if not path or not os.path.exists(path):
+        return {}
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def print_summary(results, elapsed, wait_ack):
+    counts = {}
+    for r in results:
+        counts[r['result']] = counts.get(r['result'], 0) + 1
+    print(f"\n═══ 指令結果（{len(results)} 台，{elapsed:.2f} 秒）═══")
+    for key in (RESULT_ACKED, RESULT_SENT, RESULT_FAILED):
+        print(f"  {key:<7} {counts.get(key, 0)}")
+    latencies = sorted(r['ack_ms' if wait_ack else 'puback_ms'] for r in results
+                       if ('ack_ms' if wait_ack else 'puback_ms') in r)
+    if latencies:
+        label = '確認' if wait_ack else 'PUBACK'
+        print(f"  {label}延遲 p50 {broker_bench.percentile(latencies, 50):.0f} ms，"
+              f"p99 {broker_bench.percentile(latencies, 99):.0f} ms")
+
+async def run(args):
+    dispatcher = CommandDispatcher(args.broker or [hoban_mqtt.PUBLIC_BROKERS[0]], args.rate, args.burst)
+    await dispatcher.start(args.discover)
+    try:
+        device_ids = list(args.device or [])
+        if args.devices:
+            with open(args.devices, 'r', encoding='utf-8') as f:
+                device_ids += [line.strip() for line in f if line.strip() and not line.startswith('#')]
+        targets = dispatcher.select(model=args.model, version=args.version, tag=args.tag,
+                                    tags=load_tags(args.tags), device_ids=device_ids or None)
+        print(f"已知設備 {len(dispatcher.tracker)} 台，指令對象 {len(targets)} 台")
+        unsupported = dispatcher.unsupported(targets, args.command)
+        if unsupported:
+            for device_id in unsupported:
+                print(f"❌ {device_id} ({dispatcher.tracker.records[device_id]['model']}) 不支援 {args.command}")
+            return None
+        if args.dry_run or not targets:
+            for device_id in targets:
+                print(f"  {device_id}  ({dispatcher.tracker.routes.get(device_id, '?')})")
+            return []
+        started = time.perf_counter()
+        results = await dispatcher.send(targets, args.command, args.ack_timeout, not args.no_ack, args.correlate)
+        print_summary(results, time.perf_counter() - started, not args.no_ack)
+        return results
+    finally:
+        await dispatcher.close()
+
+def main():
+    parser = argparse.ArgumentParser(description='hoRelay 車隊批次指令')
+    parser.add_argument('command', choices=COMMANDS)
+    parser.add_argument('--broker', action='append', help='broker（可重複；每個 broker 維持一條連線，預設 mqttgo.io）')
+    parser.add_argument('--model')
+    parser.add_argument('--version')
+    parser.add_argument('--tag', help='只送給標籤檔中帶有此標籤的設備')
+    parser.add_argument('--tags', default=DEFAULT_TAGS_FILE, help='標籤檔路徑（預設 device_tags.json）')
+    parser.add_argument('--device', action='append', help='指定設備 ID（可重複）')
+    parser.add_argument('--devices', help='設備清單檔（每行一個 device_id）')
+    parser.add_argument('--discover', type=float, default=3, help='收集 retained 狀態的秒數（預設 3）')
+    parser.add_argument('--rate', type=float, default=500, help='每秒最多送出幾則指令（預設 500）')
+    parser.add_argument('--burst', type=int, default=100, help='可瞬間送出的指令數（預設 100）')
+    parser.add_argument('--ack-timeout', type=float, default=5, help='等待狀態確認的秒數（預設 5）')
+    parser.add_argument('--no-ack', action='store_true', help='只等待 PUBACK，不等待設備狀態')
+    parser.add_argument('--correlate', action='store_true', help='指令附帶關聯 ID，以設備的 ack 確認')
+    parser.add_argument('--dry-run', action='store_true', help='只列出指令對象')
+    parser.add_argument('--report', help='將每台設備的結果寫入 JSON 檔')
+    args = parser.parse_args()
+
+    try:
+        results = asyncio.run(run(args))
+    except (OSError, asyncio.TimeoutError, hoban_mqtt.MQTTError) as e:
+        print(f"❌ MQTT 連線失敗: {e}")
+        sys.exit(1)
+    except KeyboardInterrupt:
+        sys.exit(1)
+    if results is None:
+        sys.exit(1)
+
+    if args.report:
+        with open(args.report, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"報告已寫入: {args.report}")
+    if any(r['result'] == RESULT_FAILED for r in results):
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,353 @@
+#!/usr/bin/env python3
+"""
+hoRelay 車隊 OTA 分批推送工具
+透過 MQTT 對多台設備分批送出 update 指令，從 hoban/+/status 追蹤每台設備的進度與結果，
+失敗率超過門檻時自動停止後續批次
+
+用法:
+  # 從 retained 狀態找出所有 hoRelay2，每批 20 台、同時最多 5 台更新
+  python fleet_rollout.py --broker mqttgo.io --version 2.0.5 \\
+      --url https://github.com/maotou316/hoctrl-firmware/releases/download/v2.0.5/hoRelay2_v2.0.5.bin \\
+      --model hoRelay2 --wave-size 20 --concurrency 5
+
+  # 指定設備清單（每行一個 device_id），先預覽不送出
+  python fleet_rollout.py --broker mqttgo.io --version 2.0.5 --url ... --devices devices.txt --dry-run
+"""
+
+import sys
+import json
+import time
+import asyncio
+import argparse
+
+import hoban_mqtt
+
+# 設備端 StaticJsonDocument<200> 解析 update 指令，過長的 URL 會被截斷
+MAX_UPDATE_PAYLOAD = 200
+
+RESULT_SUCCESS = 'success'
+RESULT_FAILED = 'failed'
+RESULT_TIMEOUT = 'timeout'
+RESULT_SKIPPED = 'skipped'
+
+class FleetTracker:
+    """訂閱 hoban/+/status，保存每台設備最新狀態，並通知正在等待的推送工作"""
+
+    def __init__(self):
+        self.devices = {}
+        self._watchers = {}
+
+    def on_message(self, message):
+        device_id = hoban_mqtt.device_id_from_topic(message.topic)
+        if not device_id:
+            return
+        data = hoban_mqtt.parse_status(message.payload)
+        state = self.devices.setdefault(device_id, {})
+        state['status'] = data.get('status', state.get('status'))
+        for key in ('version', 'model', 'server'):
+            if key in data:
+                state[key] = data[key]
+        device = data.get('device') or {}
+        if 'update_progress' in device:
+            state['update_progress'] = device['update_progress']
+        state['last_seen'] = time.time()
+        if not message.retain:
+            state['live_seen'] = state['last_seen']
+        queue = self._watchers.get(device_id)
+        if queue:
+            queue.put_nowait(dict(state))
+
+    def watch(self, device_id):
+        queue = asyncio.Queue()
+        self._watchers[device_id] = queue
+        return queue
+
+    def unwatch(self, device_id):
+        self._watchers.pop(device_id, None)
+
+    def interrupt(self):
+        """以 None 喚醒所有等待中的推送工作（broker 無法重新連線時）"""
+        for queue in self._watchers.values():
+            queue.put_nowait(None)
+
+def update_command(version, url):
+    return 'update:' + json.dumps({'version': version, 'url': url}, separators=(',', ':'))
+
+class BrokerLost(Exception):
+    """broker 斷線且在時限內無法重新連線"""
+
+async def publish_update(client, device_id, version, url, ensure_connected=None):
+    """送出更新指令；指定 ensure_connected 時，發布失敗先等待重新連線再重送，無法重新連線時回傳 False"""
+    while True:
+        try:
+            await client.publish(hoban_mqtt.control_topic(device_id), update_command(version, url), qos=1)
+            return True
+        except (OSError, asyncio.TimeoutError, hoban_mqtt.MQTTError):
+            if ensure_connected is None:
+                raise
+            if not await ensure_connected():
+                return False
+
+async def update_device(client, tracker, device_id, version, url, timeout, ensure_connected=None):
+    """送出更新指令並等待結果，回傳結果 dict；broker 斷線而無法送出或等待時結果為 skipped，不計入設備失敗"""
+    queue = tracker.watch(device_id)
+    started = time.time()
+    result = {'device_id': device_id, 'result': RESULT_TIMEOUT, 'progress': None}
+    try:
+        if not await publish_update(client, device_id, version, url, ensure_connected):
+            raise BrokerLost()
+        print(f"→ {device_id}: 已送出更新指令")
+        deadline = started + timeout
+        last_progress = -10
+        while True:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            try:
+                state = await asyncio.wait_for(queue.get(), remaining)
+            except asyncio.TimeoutError:
+                break
+            if state is None:
+                raise BrokerLost()
+            status = state.get('status')
+            progress = state.get('update_progress')
+            if progress is not None and progress >= last_progress + 10:
+                last_progress = progress
+                result['progress'] = progress
+                print(f"  {device_id}: {progress}%")
+            if status == 'update_failed':
+                result['result'] = RESULT_FAILED
+                break
+            # 重新開機後以新版本上線才算完成
+            if status == 'online' and state.get('version') == version:
+                result['result'] = RESULT_SUCCESS
+                break
+    except BrokerLost:
+        result['result'] = RESULT_SKIPPED
+        result['error'] = 'broker 連線中斷'
+    except (OSError, asyncio.TimeoutError, hoban_mqtt.MQTTError) as e:
+        result['result'] = RESULT_FAILED
+        result['error'] = str(e)
+    finally:
+        tracker.unwatch(device_id)
+    result['seconds'] = round(time.time() - started, 1)
+    mark = '✓' if result['result'] == RESULT_SUCCESS else '❌'
+    print(f"{mark} {device_id}: {result['result']} ({result['seconds']} s)")
+    return result
+
+class Rollout:
+    """分批推送：每批內以 semaphore 限制同時更新數量，累計失敗率超過門檻即中止
+
+    與 broker 斷線時以退避重新連線並重新訂閱狀態，重連期間的發布會等待後重送，之後的設備
+    等它重新上線才推送；超過 reconnect_timeout 仍連不上時停止推送，尚未完成的設備記為 skipped。
+    """
+
+    def __init__(self, client, tracker, version, url, concurrency, timeout,
+                 max_failure_rate, min_sample, reconnect_timeout=300):
+        self.client = client
+        self.tracker = tracker
+        self.version = version
+        self.url = url
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.timeout = timeout
+        self.max_failure_rate = max_failure_rate
+        self.min_sample = min_sample
+        self.reconnect_timeout = reconnect_timeout
+        self.results = []
+        self.aborted = False
+        self.broker_lost = False
+        self.reconnected_at = None
+        self._reconnect_lock = asyncio.Lock()
+
+    def failure_rate(self):
+        done = [r for r in self.results if r['result'] != RESULT_SKIPPED]
+        if not done:
+            return 0.0
+        return sum(1 for r in done if r['result'] != RESULT_SUCCESS) / len(done)
+
+    async def ensure_connected(self):
+        """確保與 broker 連線；多個推送工作同時發現斷線時只重連一次"""
+        async with self._reconnect_lock:
+            if self.client.connected:
+                return True
+            if self.broker_lost:
+                return False
+            print("⚠ 與 broker 的連線中斷，重新連線中...")
+            # 重新訂閱後會再收到每台設備 retained 的最新狀態，斷線期間完成更新的設備也能確認
+            deadline = time.time() + self.reconnect_timeout
+            if await hoban_mqtt.reconnect(self.client, hoban_mqtt.STATUS_WILDCARD, deadline=deadline, log=print):
+                print(f"已重新連線 {self.client.host}:{self.client.port}")
+                self.reconnected_at = time.time()
+                return True
+            self.broker_lost = True
+            self.aborted = True
+            print(f"\n❌ {self.reconnect_timeout:.0f} 秒內無法重新連線 broker，停止推送")
+            self.tracker.interrupt()
+            return False
+
+    async def _keep_connected(self):
+        # 等待設備回報期間斷線時也要重連，否則只能等到逾時
+        while not self.broker_lost:
+            await asyncio.sleep(1)
+            if not self.client.connected:
+                await self.ensure_connected()
+
+    async def _wait_online(self, device_id):
+        """broker 重連後，設備也要重新連上並訂閱才收得到指令（clean session 不保留離線期間的指令）；
+        等到設備在重連後送出即時（非 retained）狀態才推送，逾時或 broker 無法連線時回傳 False"""
+        queue = self.tracker.watch(device_id)
+        deadline = time.time() + self.timeout
+        try:
+            while self.tracker.devices.get(device_id, {}).get('live_seen', 0) < self.reconnected_at:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return False
+                try:
+                    state = await asyncio.wait_for(queue.get(), remaining)
+                except asyncio.TimeoutError:
+                    return False
+                if state is None:
+                    return False
+            return True
+        finally:
+            self.tracker.unwatch(device_id)
+
+    async def _run_one(self, device_id):
+        async with self.semaphore:
+            if self.aborted:
+                result = {'device_id': device_id, 'result': RESULT_SKIPPED}
+            elif self.reconnected_at and not await self._wait_online(device_id):
+                if self.broker_lost:
+                    result = {'device_id': device_id, 'result': RESULT_SKIPPED, 'error': 'broker 連線中斷'}
+                else:
+                    result = {'device_id': device_id, 'result': RESULT_TIMEOUT,
+                              'error': 'broker 重新連線後設備沒有上線'}
+                    print(f"❌ {device_id}: broker 重新連線後設備沒有上線")
+            else:
+                result = await update_device(self.client, self.tracker, device_id,
+                                             self.version, self.url, self.timeout, self.ensure_connected)
+            self.results.append(result)
+            done = sum(1 for r in self.results if r['result'] != RESULT_SKIPPED)
+            if not self.aborted and done >= self.min_sample and self.failure_rate() > self.max_failure_rate:
+                self.aborted = True
+                print(f"\n❌ 失敗率 {self.failure_rate():.0%} 超過門檻 {self.max_failure_rate:.0%}，停止推送")
+
+    async def run(self, device_ids, wave_size):
+        waves = [device_ids[i:i + wave_size] for i in range(0, len(device_ids), wave_size)]
+        supervisor = asyncio.ensure_future(self._keep_connected())
+        try:
+            for index, wave in enumerate(waves, 1):
+                if self.aborted:
+                    self.results += [{'device_id': d, 'result': RESULT_SKIPPED} for d in wave]
+                    continue
+                print(f"\n═══ 第 {index}/{len(waves)} 批：{len(wave)} 台 ═══")
+                await asyncio.gather(*(self._run_one(d) for d in wave))
+                print(f"累計失敗率: {self.failure_rate():.0%}")
+        finally:
+            supervisor.cancel()
+        return self.results
+
+def load_device_list(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return [line.strip() for line in f if line.strip() and not line.startswith('#')]
+
+def select_targets(tracker, device_ids, model, version):
+    """決定推送對象：指定清單優先，否則使用 retained 狀態中在線的設備；略過已是目標版本者"""
+    if device_ids:
+        candidates = device_ids
+    else:
+        candidates = sorted(d for d, s in tracker.devices.items() if s.get('status') != 'offline')
+    targets = []
+    for device_id in candidates:
+        state = tracker.devices.get(device_id, {})
+        if model and state.get('model') not in (None, model):
+            continue
+        if state.get('version') == version:
+            print(f"  略過 {device_id}: 已是 v{version}")
+            continue
+        targets.append(device_id)
+    return targets
+
+async def run(args):
+    tracker = FleetTracker()
+    host, port = hoban_mqtt.parse_broker(args.broker)
+    client = hoban_mqtt.MQTTClient(host, port, client_id=f"hoctrl-rollout-{int(time.time())}",
+                                   username=args.username, password=args.password,
+                                   on_message=tracker.on_message)
+    await client.connect()
+    await client.subscribe(hoban_mqtt.STATUS_WILDCARD, qos=1)
+    print(f"已連線 {host}:{port}，收集 retained 狀態 {args.discover} 秒...")
+    await asyncio.sleep(args.discover)
+    print(f"目前已知設備: {len(tracker.devices)} 台")
+
+    device_ids = list(args.device or [])
+    if args.devices:
+        device_ids += load_device_list(args.devices)
+    targets = select_targets(tracker, device_ids, args.model, args.version)
+    print(f"推送對象: {len(targets)} 台")
+
+    results = []
+    if targets and not args.dry_run:
+        rollout = Rollout(client, tracker, args.version, args.url, args.concurrency, args.timeout,
+                          args.max_failure_rate, args.min_sample, args.reconnect_timeout)
+        results = await rollout.run(targets, args.wave_size)
+    elif args.dry_run:
+        for device_id in targets:
+            state = tracker.devices.get(device_id, {})
+            print(f"  {device_id}  {state.get('model', '?')}  v{state.get('version', '?')}")
+    await client.disconnect()
+    return results
+
+def print_summary(results):
+    counts = {}
+    for r in results:
+        counts[r['result']] = counts.get(r['result'], 0) + 1
+    print("\n═══ 推送結果 ═══")
+    for key in (RESULT_SUCCESS, RESULT_FAILED, RESULT_TIMEOUT, RESULT_SKIPPED):
+        print(f"  {key:<8} {counts.get(key, 0)}")
+
+def main():
+    parser = argparse.ArgumentParser(description='hoRelay 車隊 OTA 分批推送工具')
+    parser.add_argument('--broker', default='mqttgo.io', help='MQTT broker（host 或 host:port）')
+    parser.add_argument('--username')
+    parser.add_argument('--password')
+    parser.add_argument('--version', required=True, help='目標韌體版本')
+    parser.add_argument('--url', required=True, help='韌體下載 URL')
+    parser.add_argument('--device', action='append', help='指定設備 ID（可重複）')
+    parser.add_argument('--devices', help='設備清單檔（每行一個 device_id）')
+    parser.add_argument('--model', help='只推送指定型號')
+    parser.add_argument('--discover', type=float, default=3, help='收集 retained 狀態的秒數（預設 3）')
+    parser.add_argument('--wave-size', type=int, default=20, help='每批設備數（預設 20）')
+    parser.add_argument('--concurrency', type=int, default=5, help='同時更新的設備數上限（預設 5）')
+    parser.add_argument('--timeout', type=float, default=600, help='單台設備完成更新的時限秒數（預設 600）')
+    parser.add_argument('--max-failure-rate', type=float, default=0.2, help='累計失敗率門檻（預設 0.2）')
+    parser.add_argument('--min-sample', type=int, default=3, help='至少完成幾台後才判斷失敗率（預設 3）')
+    parser.add_argument('--reconnect-timeout', type=float, default=300,
+                        help='與 broker 斷線後持續重連的秒數，超過即停止推送（預設 300）')
+    parser.add_argument('--dry-run', action='store_true', help='只列出推送對象，不送出指令')
+    parser.add_argument('--report', help='將每台設備的結果寫入 JSON 檔')
+    args = parser.parse_args()
+
+    if len(update_command(args.version, args.url)) - len('update:') > MAX_UPDATE_PAYLOAD:
+        print(f"❌ update 指令 JSON 超過設備可解析的 {MAX_UPDATE_PAYLOAD} bytes，請縮短 URL")
+        sys.exit(1)
+
+    try:
+        results = asyncio.run(run(args))
+    except (OSError, asyncio.TimeoutError, hoban_mqtt.MQTTError) as e:
+        print(f"❌ MQTT 連線失敗: {e}")
+        sys.exit(1)
+    except KeyboardInterrupt:
+        sys.exit(0)
+
+    if results:
+        print_summary(results)
+    if args.report:
+        with open(args.report, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"報告已寫入: {args.report}")
+    if any(r['result'] != RESULT_SUCCESS for r in results):
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+"""
+hoRelay 車隊狀態收集器
+訂閱 hoban/+/status，在記憶體中維護每台設備的最新狀態，並依型號、版本、伺服器、
+連線狀態與 RSSI 等級建立索引，可即時查詢並定期匯出快照
+
+用法:
+  python fleet_status.py --broker mqttgo.io --duration 10              # 收集 10 秒後列出摘要
+  python fleet_status.py --broker mqttgo.io --duration 10 --model hoRelay2 --rssi poor
+  python fleet_status.py --broker mqttgo.io --snapshot fleet.json --interval 60   # 常駐並每分鐘匯出
+"""
+
+import os
+import sys
+import csv
+import json
+import time
+import asyncio
+import argparse
+
+import hoban_mqtt
+import status_codec
+
+INDEXED_FIELDS = ('model', 'version', 'server', 'status', 'rssi_bucket')
+SNAPSHOT_FIELDS = ('device_id', 'status', 'model', 'version', 'server', 'rssi', 'rssi_bucket',
+                   'relay', 'ip', 'ssid', 'uptime', 'last_seen')
+
+# RSSI 等級門檻 (dBm)，由強到弱
+RSSI_BUCKETS = (
+    (-55, 'excellent'),
+    (-67, 'good'),
+    (-75, 'fair'),
+)
+
+def rssi_bucket(rssi):
+    if rssi is None:
+        return None
+    for threshold, name in RSSI_BUCKETS:
+        if rssi >= threshold:
+            return name
+    return 'poor'
+
+class FleetIndex:
+    """設備狀態表與次要索引
+
+    records 保存每台設備的最新欄位；_index[field][value] 是擁有該值的 device_id 集合，
+    查詢時取各條件集合的交集，不必掃描整個車隊。
+    """
+
+    def __init__(self):
+        self.records = {}
+        self._index = {field: {} for field in INDEXED_FIELDS}
+        self.messages = 0
+
+    def __len__(self):
+        return len(self.records)
+
+    def _reindex(self, device_id, old, new):
+        for field in INDEXED_FIELDS:
+            before, after = old.get(field), new.get(field)
+            if before == after:
+                continue
+            if before is not None:
+                members = self._index[field].get(before)
+                if members:
+                    members.discard(device_id)
+                    if not members:
+                        del self._index[field][before]
+            if after is not None:
+                self._index[field].setdefault(after, set()).add(device_id)
+
+    def update(self, device_id, data, now=None):
+        """套用一則狀態訊息（parse_status 的結果）"""
+        self.messages += 1
+        old = self.records.get(device_id)
+        record = dict(old) if old else {'device_id': device_id}
+        if 'status' in data:
+            record['status'] = data['status']
+        for key in ('version', 'model', 'server'):
+            if key in data:
+                record[key] = data[key]
+        if 'timestamp' in data:
+            record['uptime'] = data['timestamp']
+        wifi = data.get('wifi')
+        if isinstance(wifi, dict):
+            if 'rssi' in wifi:
+                record['rssi'] = wifi['rssi']
+                record['rssi_bucket'] = rssi_bucket(wifi['rssi'])
+            for key in ('ip', 'ssid'):
+                if key in wifi:
+                    record[key] = wifi[key]
+        device = data.get('device')
+        if isinstance(device, dict) and 'relay' in device:
+            record['relay'] = device['relay']
+        record['last_seen'] = now if now is not None else time.time()
+        self._reindex(device_id, old or {}, record)
+        self.records[device_id] = record
+        return record
+
+    def remove(self, device_id):
+        old = self.records.pop(device_id, None)
+        if old:
+            self._reindex(device_id, old, {})
+
+    def on_message(self, message):
+        device_id = hoban_mqtt.device_id_from_topic(message.topic)
+        if not device_id:
+            return
+        if message.topic.endswith(status_codec.BINARY_SUFFIX):
+            if message.payload:
+                try:
+                    self.update(device_id, status_codec.decode(message.payload))
+                except status_codec.CodecError:
+                    pass
+            return
+        if not message.topic.endswith('/status'):
+            return
+        # 空的 retained 訊息代表該設備的狀態已被清除
+        if not message.payload:
+            self.remove(device_id)
+            return
+        self.update(device_id, hoban_mqtt.parse_status(message.payload))
+
+    def query(self, **conditions):
+        """依索引欄位查詢，例如 query(model='hoRelay2', rssi_bucket='poor')"""
+        ids = None
+        for field, value in conditions.items():
+            if value is None:
+                continue
+            if field not in self._index:
+                raise ValueError(f"欄位 {field} 沒有索引")
+            members = self._index[field].get(value, set())
+            ids = set(members) if ids is None else ids & members
+        if ids is None:
+            ids = self.records.keys()
+        return [self.records[d] for d in sorted(ids)]
+
+    def counts(self, field):
+        """某個索引欄位各值的設備數"""
+        return {value: len(ids) for value, ids in sorted(self._index[field].items(), key=lambda kv: str(kv[0]))}
+
+    def snapshot(self):
+        return [dict(self.records[d]) for d in sorted(self.records)]
+
+def export_snapshot(records, path):
+    """依副檔名匯出 JSON 或 CSV，先寫暫存檔再改名"""
+    tmp = path + '.tmp'
+    if path.endswith('.csv'):
+        with open(tmp, 'w', encoding='utf-8', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=SNAPSHOT_FIELDS, extrasaction='ignore')
+            writer.writeheader()
+            writer.writerows(records)
+    else:
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump({'exported': time.time(), 'devices': records}, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, path)
+
+def print_summary(index):
+    print(f"\n設備數: {len(index)}，已處理訊息: {index.messages}")
+    for field in INDEXED_FIELDS:
+        counts = index.counts(field)
+        if counts:
+            print(f"\n[{field}]")
+            for value, count in counts.items():
+                print(f"  {str(value):<28} {count}")
+
+async def collect(args, index):
+    host, port = hoban_mqtt.parse_broker(args.broker)
+    client = hoban_mqtt.MQTTClient(host, port, client_id=f"hoctrl-status-{int(time.time())}",
+                                   username=args.username, password=args.password,
+                                   on_message=index.on_message)
+    await client.connect()
+    topic = status_codec.BINARY_WILDCARD if args.binary else hoban_mqtt.STATUS_WILDCARD
+    await client.subscribe(topic)
+    print(f"已連線 {host}:{port}，訂閱 {topic}")
+
+    started = time.time()
+    deadline = started + args.duration if args.duration > 0 else None
+    last_export = started
+    last_count = 0
+    try:
+        while deadline is None or time.time() < deadline:
+            await asyncio.sleep(1)
+            if not client.connected:
+                # 常駐收集時以退避重連並重新訂閱；索引保留，重新訂閱會再收到 retained 狀態
+                print("⚠ 與 broker 的連線中斷，重新連線中...")
+                if not await hoban_mqtt.reconnect(client, topic, deadline=deadline, log=print):
+                    break
+                print(f"已重新連線 {host}:{port}，訂閱 {topic}")
+            if args.snapshot and time.time() - last_export >= args.interval:
+                export_snapshot(index.snapshot(), args.snapshot)
+                rate = (index.messages - last_count) / (time.time() - last_export)
+                print(f"已匯出 {len(index)} 台設備（{rate:.0f} 則/秒）")
+                last_export = time.time()
+                last_count = index.messages
+    finally:
+        await client.disconnect()
+
+def main():
+    parser = argparse.ArgumentParser(description='hoRelay 車隊狀態收集器')
+    parser.add_argument('--broker', default='mqttgo.io', help='MQTT broker（host 或 host:port）')
+    parser.add_argument('--username')
+    parser.add_argument('--password')
+    parser.add_argument('--duration', type=float, default=0, help='收集秒數，0 表示持續執行')
+    parser.add_argument('--snapshot', help='快照檔路徑（.json 或 .csv）')
+    parser.add_argument('--interval', type=float, default=60, help='匯出快照間隔秒數（預設 60）')
+    parser.add_argument('--binary', action='store_true', help='改訂閱二進位狀態 hoban/+/status/bin')
+    parser.add_argument('--model')
+    parser.add_argument('--version')
+    parser.add_argument('--server')
+    parser.add_argument('--status')
+    parser.add_argument('--rssi', choices=[name for _, name in RSSI_BUCKETS] + ['poor'], help='RSSI 等級')
+    args = parser.parse_args()
+
+    index = FleetIndex()
+    try:
+        asyncio.run(collect(args, index))
+    except (OSError, asyncio.TimeoutError, hoban_mqtt.MQTTError) as e:
+        print(f"❌ MQTT 連線失敗: {e}")
+        sys.exit(1)
+    except KeyboardInterrupt:
+        pass
+
+    if args.snapshot:
+        export_snapshot(index.snapshot(), args.snapshot)
+        print(f"快照已寫入: {args.snapshot}")
+    print_summary(index)
+
+    conditions = dict(model=args.model, version=args.version, server=args.server,
+                      status=args.status, rssi_bucket=args.rssi)
+    if any(v is not None for v in conditions.values()):
+        matches = index.query(**conditions)
+        print(f"\n符合條件的設備: {len(matches)} 台")
+        for r in matches:
+            print(f"  {r['device_id']:<20} {r.get('model', '?'):<12} v{r.get('version', '?'):<8} "
+                  f"{r.get('status', '?'):<8} {r.get('rssi', '?')} dBm  {r.get('server', '')}")
+
+if __name__ == '__main__':
+    main()
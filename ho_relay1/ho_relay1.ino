@@ -223,8 +223,10 @@ const char* getDeviceId() {
   return deviceIdString.c_str();
 }
 
-void pulseRelay() {
+// commandId 不為空時，在繼電器吸合後立即送出確認，不等點動結束
+void pulseRelay(String commandId) {
   digitalWrite(relayPin, HIGH);
+  publishCommandAck("ON", commandId);
   delay(1000);
   digitalWrite(relayPin, LOW);
   
@@ -245,10 +247,21 @@ void mqttCallback(char* topic, byte* payload, unsigned int length) {
   Serial.println(message);
 
   if (String(topic) == String("hoban/" + deviceId + "/control")) {
+    // 指令可附帶關聯 ID（例如 ON@a1b2c3），執行後以相同 ID 發送確認
+    String commandId = "";
+    if (!message.startsWith("update:")) {
+      int separator = message.lastIndexOf('@');
+      if (separator > 0) {
+        commandId = message.substring(separator + 1);
+        message = message.substring(0, separator);
+      }
+    }
+
     if (message == "status") {
       publishStatus();  // 使用 JSON 格式發布狀態
+      publishCommandAck("status", commandId);
     } else if (message == "ON") {
-      pulseRelay();
+      pulseRelay(commandId);
     } else if (message.startsWith("update:")) {
       // 解析更新命令
       StaticJsonDocument<200> doc;
@@ -423,7 +436,7 @@ void handleSetWiFi()
 void handleRelayOn()
 {
   relayState = true;
-  pulseRelay(); // 使用統一的控制函數
+  pulseRelay(""); // 使用統一的控制函數
 
   String html = "<html><body>";
   html += "<h1>已經關門</h1>";
@@ -711,6 +724,32 @@ void publishStatus() {
   Serial.println(buffer);
 }
 
+// 發布指令確認：不使用 retained，避免覆蓋 status 主題上的完整狀態
+void publishCommandAck(const char* command, String commandId) {
+  if (commandId.length() == 0 || !mqttClient.connected()) return;
+  if (commandId.length() > 32) {
+    commandId = commandId.substring(0, 32);
+  }
+
+  const char* deviceId = getDeviceId();
+  String statusTopic = String("hoban/") + deviceId + "/status";
+
+  StaticJsonDocument<256> doc;
+  doc["device_id"] = deviceId;
+  doc["status"] = isUpdating ? "updating" : "online";
+  doc["ack"] = commandId;
+  doc["cmd"] = command;
+  doc["timestamp"] = millis() / 1000;
+  JsonObject device = doc.createNestedObject("device");
+  device["relay"] = digitalRead(relayPin);
+
+  char buffer[256];
+  serializeJson(doc, buffer);
+  mqttClient.publish(statusTopic.c_str(), buffer, false);
+
+  Serial.printf("已發送指令確認: %s (%s)\n", command, commandId.c_str());
+}
+
 void connectToMQTT() {
   if (failedAttempts >= 5) {
     mqttStatus = "已達重試上限";
@@ -787,7 +826,8 @@ void handleFirmwareUpload() {
       Serial.println("已發送更新狀態到 MQTT");
     }
     
-    if (!Update.begin(upload.totalSize)) {
+    // UPLOAD_FILE_START 時 upload.totalSize 仍是 0，大小未知時由 Update.end(true) 確認
+    if (!Update.begin(UPDATE_SIZE_UNKNOWN)) {
       Serial.println("更新初始化失敗！");
       Serial.printf("錯誤: %s\n", Update.errorString());
       Update.printError(Serial);
@@ -919,6 +959,12 @@ void startFirmwareUpdate(const char* downloadUrl) {
   bool downloadSuccess = false;
   String finalUrl = downloadUrl;
   
+  // 續傳狀態跨重試保留：連線中斷後以 Range 從已寫入的位置接續，不必重新下載整個映像
+  size_t written = 0;
+  int totalSize = 0;
+  String etag;
+  const char* collectHeaderKeys[] = {"ETag", "Content-Range"};
+  
   while (retryCount < maxRetries && !downloadSuccess) {
     if (retryCount > 0) {
       int delayTime = baseDelay * (1 << retryCount); // 指數退避
@@ -935,27 +981,62 @@ void startFirmwareUpdate(const char* downloadUrl) {
       // 添加請求標頭
       http.addHeader("User-Agent", "ESP32-FirmwareUpdate/1.0");
       http.addHeader("Accept", "*/*");
+      if (written > 0 && etag.length() > 0) {
+        // 檔案若已更換，伺服器會依 If-Range 改回完整的 200
+        http.addHeader("Range", "bytes=" + String(written) + "-");
+        http.addHeader("If-Range", etag);
+        Serial.printf("從 %u bytes 處續傳\n", written);
+      }
+      http.collectHeaders(collectHeaderKeys, 2);
       
       Serial.println("發送 GET 請求下載檔案...");
       int httpCode = http.GET();
       
-      if (httpCode == HTTP_CODE_OK) {
-        int contentLength = http.getSize();
-        Serial.printf("檔案大小: %d bytes\n", contentLength);
-        
-        // 檢查空間是否足夠
-        if (contentLength > ESP.getFreeSketchSpace()) {
-          Serial.println("錯誤：空間不足");
-          break;
+      bool resumed = false;
+      if (httpCode == HTTP_CODE_PARTIAL_CONTENT || httpCode == HTTP_CODE_RANGE_NOT_SATISFIABLE) {
+        // Content-Range: bytes {起點}-{終點}/{總大小}，起點與總大小需與已寫入的部分一致
+        String contentRange = http.header("Content-Range");
+        long rangeStart = contentRange.substring(contentRange.indexOf(' ') + 1).toInt();
+        long rangeTotal = contentRange.substring(contentRange.indexOf('/') + 1).toInt();
+        if (httpCode == HTTP_CODE_PARTIAL_CONTENT && Update.isRunning() &&
+            rangeStart == (long)written && rangeTotal == totalSize) {
+          resumed = true;
+          Serial.printf("續傳剩餘：%d bytes\n", http.getSize());
+        } else {
+          Serial.printf("續傳範圍不符（%s），下次從頭下載\n", contentRange.c_str());
+          Update.abort();
+          written = 0;
+          etag = "";
         }
-        
-        if (!Update.begin(contentLength)) {
-          Serial.printf("錯誤：無法開始更新，錯誤碼：%d\n", Update.getError());
-          break;
+      }
+      
+      if (httpCode == HTTP_CODE_OK || resumed) {
+        if (!resumed) {
+          int contentLength = http.getSize();
+          Serial.printf("檔案大小: %d bytes\n", contentLength);
+          
+          if (written > 0) {
+            // 伺服器不支援續傳或檔案已更換，捨棄已寫入的部分
+            Serial.println("伺服器回傳完整檔案，從頭開始寫入");
+            Update.abort();
+            written = 0;
+          }
+          
+          // 檢查空間是否足夠
+          if (contentLength > ESP.getFreeSketchSpace()) {
+            Serial.println("錯誤：空間不足");
+            break;
+          }
+          
+          if (!Update.begin(contentLength)) {
+            Serial.printf("錯誤：無法開始更新，錯誤碼：%d\n", Update.getError());
+            break;
+          }
+          totalSize = contentLength;
+          etag = http.header("ETag");
         }
         
         WiFiClient* stream = http.getStreamPtr();
-        size_t written = 0;
         uint8_t buff[1024] = { 0 };
         
         // 下載超時設定
@@ -963,17 +1044,17 @@ void startFirmwareUpdate(const char* downloadUrl) {
         unsigned long startTime = millis();
         unsigned long lastProgressTime = startTime;
         
-        while (http.connected() && (written < contentLength)) {
+        while (http.connected() && (written < totalSize)) {
           size_t available = stream->available();
           if (available) {
             size_t bytesRead = stream->readBytes(buff, min(available, sizeof(buff)));
             size_t bytesWritten = Update.write(buff, bytesRead);
             if (bytesWritten > 0) {
               written += bytesWritten;
-              updateProgress = (written * 100) / contentLength;
+              updateProgress = (written * 100) / totalSize;
               
               if (millis() - lastProgressTime >= 1000) {
-                Serial.printf("下載進度：%d%%（%u/%d bytes）\n", updateProgress, written, contentLength);
+                Serial.printf("下載進度：%d%%（%u/%d bytes）\n", updateProgress, written, totalSize);
                 lastProgressTime = millis();
               }
             }
@@ -988,7 +1069,7 @@ void startFirmwareUpdate(const char* downloadUrl) {
           delay(1); // 避免看門狗重置
         }
         
-        if (written == contentLength && Update.end(true)) {
+        if (written == totalSize && Update.end(true)) {
           Serial.println("更新成功！準備重新啟動...");
           downloadSuccess = true;
           
@@ -1002,6 +1083,12 @@ void startFirmwareUpdate(const char* downloadUrl) {
           ESP.restart();
           return;
         }
+        
+        if (!Update.isRunning()) {
+          // 驗證失敗後更新已中止，下次重試從頭下載
+          written = 0;
+          etag = "";
+        }
       } else if (httpCode == HTTP_CODE_FOUND || httpCode == HTTP_CODE_MOVED_PERMANENTLY) {
         // 處理重定向
         String newUrl = http.getLocation();
@@ -1040,6 +1127,9 @@ void startFirmwareUpdate(const char* downloadUrl) {
   }
   
   // 更新失敗處理
+  if (Update.isRunning()) {
+    Update.abort();
+  }
   isUpdating = false;
   digitalWrite(ledPin, LOW);
   
@@ -34,6 +34,11 @@ bool deviceConnected = false;
 const char* firmwareVersion = "1.3.5"; // 當前韌體版本
 const char* deviceModel = "hoRelay2"; // 設備型號
 
+// 編譯時加 -DBINARY_STATUS=1，除 JSON 外另發布精簡二進位狀態（格式見 status_codec.py）
+#ifndef BINARY_STATUS
+#define BINARY_STATUS 0
+#endif
+
 // ESP32-C3 GPIO 定義
 const int bootButton = 9;     // BOOT 按鈕在 GPIO 9
 const int resetButton = 1;        // 
@@ -471,17 +476,31 @@ void mqttCallback(char* topic, byte* payload, unsigned int length) {
   if (String(topic) == expectedTopic) {
     Serial.println("✓ 主題匹配，處理指令...");
 
+    // 指令可附帶關聯 ID（例如 ON@a1b2c3），執行完成後以相同 ID 發送確認
+    String commandId = "";
+    if (!message.startsWith("update:")) {
+      int separator = message.lastIndexOf('@');
+      if (separator > 0) {
+        commandId = message.substring(separator + 1);
+        message = message.substring(0, separator);
+      }
+    }
+
     if (message == "status") {
       Serial.println("→ 執行：發布狀態");
       publishStatus();  // 使用 JSON 格式發布狀態
+      publishCommandAck("status", commandId);
     } else if (message == "ON") {
       Serial.println("→ 執行：打開繼電器（長亮）");
       relayOn();
+      publishCommandAck("ON", commandId);
     } else if (message == "OFF") {
       Serial.println("→ 執行：關閉繼電器");
       relayOff();
+      publishCommandAck("OFF", commandId);
     } else if (message == "reset") {
       Serial.println("收到重置命令，執行重置...");
+      publishCommandAck("reset", commandId);  // 重置後會重新開機，先送出確認
       clearWiFiConfig();  // 清除 WiFi 設定並重啟
     } else if (message == "FIND_BEST_SERVER") {
       // 重新測試所有伺服器並選擇最快的
@@ -489,6 +508,7 @@ void mqttCallback(char* topic, byte* payload, unsigned int length) {
       mqttClient.disconnect();
       delay(1000);
       smartConnect();
+      publishCommandAck("FIND_BEST_SERVER", commandId);  // 在新連線上確認
     } else if (message.startsWith("update:")) {
       // 解析更新命令
       StaticJsonDocument<200> doc;
@@ -958,6 +978,69 @@ void connectToWiFi() {
   }
 }
 
+#if BINARY_STATUS
+// 精簡二進位狀態 schema 1：欄位順序與大小必須與 status_codec.py 的 RECORD 一致
+struct __attribute__((packed)) BinaryStatus {
+  uint8_t schema;
+  uint8_t flags;         // bit0 WiFi 已連線、bit1 繼電器開啟
+  uint8_t status;        // 0 online、1 updating
+  uint8_t progress;
+  uint32_t uptime;
+  uint8_t versionMajor;
+  uint8_t versionMinor;
+  uint16_t versionPatch;
+  int8_t rssi;
+  uint8_t model;         // status_codec.MODEL_CODES 的索引
+  uint8_t server;        // 0 自訂伺服器、1 mqttgo.io
+  uint8_t ip[4];
+  uint8_t mac[6];
+};
+
+uint8_t binaryModelCode() {
+  static const char* const models[] = {"hoRelay1", "hoRelay2", "hoRelay2-1", "hoRelay3"};
+  for (uint8_t i = 0; i < 4; i++) {
+    if (strcmp(deviceModel, models[i]) == 0) return i + 1;
+  }
+  return 0;
+}
+
+// 發布二進位狀態到 hoban/{id}/status/bin（25 bytes，不經過 ArduinoJson）
+void publishBinaryStatus() {
+  if (!mqttClient.connected()) return;
+
+  BinaryStatus s;
+  memset(&s, 0, sizeof(s));
+  s.schema = 1;
+  s.flags = (WiFi.status() == WL_CONNECTED ? 0x01 : 0) | (digitalRead(relayButton) ? 0x02 : 0);
+  s.status = isUpdating ? 1 : 0;
+  s.progress = isUpdating ? updateProgress : 0;
+  s.uptime = millis() / 1000;
+
+  unsigned int major = 0, minor = 0, patch = 0;
+  sscanf(firmwareVersion, "%u.%u.%u", &major, &minor, &patch);
+  s.versionMajor = major;
+  s.versionMinor = minor;
+  s.versionPatch = patch;
+
+  s.rssi = WiFi.RSSI();
+  s.model = binaryModelCode();
+  s.server = (useCustomServer && strlen(mqttServer) > 0) ? 0 : 1;
+
+  IPAddress ip = WiFi.localIP();
+  for (int i = 0; i < 4; i++) {
+    s.ip[i] = ip[i];
+  }
+  uint64_t chipId = ESP.getEfuseMac();
+  uint8_t* chipIdBytes = (uint8_t*)&chipId;
+  for (int i = 0; i < 6; i++) {
+    s.mac[i] = chipIdBytes[5 - i];  // 與 getDeviceId() 相同順序
+  }
+
+  String topic = String("hoban/") + getDeviceId() + "/status/bin";
+  mqttClient.publish(topic.c_str(), (const uint8_t*)&s, sizeof(s), true);
+}
+#endif
+
 void publishStatus() {
   if (!mqttClient.connected()) return;
 
@@ -1020,6 +1103,36 @@ void publishStatus() {
     Serial.println("3. 訊息太大 (目前大小: " + String(jsonSize) + " bytes)");
     Serial.println("4. 連接已斷開");
   }
+
+#if BINARY_STATUS
+  publishBinaryStatus();
+#endif
+}
+
+// 發布指令確認：不使用 retained，避免覆蓋 status 主題上的完整狀態
+void publishCommandAck(const char* command, String commandId) {
+  if (commandId.length() == 0 || !mqttClient.connected()) return;
+  if (commandId.length() > 32) {
+    commandId = commandId.substring(0, 32);
+  }
+
+  const char* deviceId = getDeviceId();
+  String statusTopic = String("hoban/") + deviceId + "/status";
+
+  StaticJsonDocument<256> doc;
+  doc["device_id"] = deviceId;
+  doc["status"] = isUpdating ? "updating" : "online";
+  doc["ack"] = commandId;
+  doc["cmd"] = command;
+  doc["timestamp"] = millis() / 1000;
+  JsonObject device = doc.createNestedObject("device");
+  device["relay"] = digitalRead(relayButton);
+
+  char buffer[256];
+  serializeJson(doc, buffer);
+  mqttClient.publish(statusTopic.c_str(), buffer, false);
+
+  Serial.printf("已發送指令確認: %s (%s)\n", command, commandId.c_str());
 }
 
 // 發布帶有伺服器資訊的狀態
@@ -1057,6 +1170,10 @@ void publishStatusWithServer(const char* server) {
   mqttClient.publish(statusTopic.c_str(), buffer, true);
 
   Serial.printf("已發布狀態 (伺服器: %s)\n", server);
+
+#if BINARY_STATUS
+  publishBinaryStatus();
+#endif
 }
 
 // 發布伺服器切換事件
@@ -1293,6 +1410,12 @@ void startFirmwareUpdate(const char* downloadUrl) {
   bool downloadSuccess = false;
   String finalUrl = downloadUrl;
   
+  // 續傳狀態跨重試保留：連線中斷後以 Range 從已寫入的位置接續，不必重新下載整個映像
+  size_t written = 0;
+  int totalSize = 0;
+  String etag;
+  const char* collectHeaderKeys[] = {"ETag", "Content-Range"};
+  
   while (retryCount < maxRetries && !downloadSuccess) {
     if (retryCount > 0) {
       int delayTime = baseDelay * (1 << retryCount); // 指數退避
@@ -1309,27 +1432,62 @@ void startFirmwareUpdate(const char* downloadUrl) {
       // 添加請求標頭
       http.addHeader("User-Agent", "ESP32-FirmwareUpdate/1.0");
       http.addHeader("Accept", "*/*");
+      if (written > 0 && etag.length() > 0) {
+        // 檔案若已更換，伺服器會依 If-Range 改回完整的 200
+        http.addHeader("Range", "bytes=" + String(written) + "-");
+        http.addHeader("If-Range", etag);
+        Serial.printf("從 %u bytes 處續傳\n", written);
+      }
+      http.collectHeaders(collectHeaderKeys, 2);
       
       Serial.println("發送 GET 請求下載檔案...");
       int httpCode = http.GET();
       
-      if (httpCode == HTTP_CODE_OK) {
-        int contentLength = http.getSize();
-        Serial.printf("檔案大小: %d bytes\n", contentLength);
-        
-        // 檢查空間是否足夠
-        if (contentLength > ESP.getFreeSketchSpace()) {
-          Serial.println("錯誤：空間不足");
-          break;
+      bool resumed = false;
+      if (httpCode == HTTP_CODE_PARTIAL_CONTENT || httpCode == HTTP_CODE_RANGE_NOT_SATISFIABLE) {
+        // Content-Range: bytes {起點}-{終點}/{總大小}，起點與總大小需與已寫入的部分一致
+        String contentRange = http.header("Content-Range");
+        long rangeStart = contentRange.substring(contentRange.indexOf(' ') + 1).toInt();
+        long rangeTotal = contentRange.substring(contentRange.indexOf('/') + 1).toInt();
+        if (httpCode == HTTP_CODE_PARTIAL_CONTENT && Update.isRunning() &&
+            rangeStart == (long)written && rangeTotal == totalSize) {
+          resumed = true;
+          Serial.printf("續傳剩餘：%d bytes\n", http.getSize());
+        } else {
+          Serial.printf("續傳範圍不符（%s），下次從頭下載\n", contentRange.c_str());
+          Update.abort();
+          written = 0;
+          etag = "";
         }
-        
-        if (!Update.begin(contentLength)) {
-          Serial.printf("錯誤：無法開始更新，錯誤碼：%d\n", Update.getError());
-          break;
+      }
+      
+      if (httpCode == HTTP_CODE_OK || resumed) {
+        if (!resumed) {
+          int contentLength = http.getSize();
+          Serial.printf("檔案大小: %d bytes\n", contentLength);
+          
+          if (written > 0) {
+            // 伺服器不支援續傳或檔案已更換，捨棄已寫入的部分
+            Serial.println("伺服器回傳完整檔案，從頭開始寫入");
+            Update.abort();
+            written = 0;
+          }
+          
+          // 檢查空間是否足夠
+          if (contentLength > ESP.getFreeSketchSpace()) {
+            Serial.println("錯誤：空間不足");
+            break;
+          }
+          
+          if (!Update.begin(contentLength)) {
+            Serial.printf("錯誤：無法開始更新，錯誤碼：%d\n", Update.getError());
+            break;
+          }
+          totalSize = contentLength;
+          etag = http.header("ETag");
         }
         
         WiFiClient* stream = http.getStreamPtr();
-        size_t written = 0;
         uint8_t buff[1024] = { 0 };
 
         // 下載超時設定
@@ -1339,17 +1497,17 @@ void startFirmwareUpdate(const char* downloadUrl) {
         unsigned long lastBlinkTime = startTime;
         bool ledBlinkState = false;
 
-        while (http.connected() && (written < contentLength)) {
+        while (http.connected() && (written < totalSize)) {
           size_t available = stream->available();
           if (available) {
             size_t bytesRead = stream->readBytes(buff, min(available, sizeof(buff)));
             size_t bytesWritten = Update.write(buff, bytesRead);
             if (bytesWritten > 0) {
               written += bytesWritten;
-              updateProgress = (written * 100) / contentLength;
+              updateProgress = (written * 100) / totalSize;
 
               if (millis() - lastProgressTime >= 1000) {
-                Serial.printf("下載進度：%d%%（%u/%d bytes）\n", updateProgress, written, contentLength);
+                Serial.printf("下載進度：%d%%（%u/%d bytes）\n", updateProgress, written, totalSize);
                 lastProgressTime = millis();
               }
             }
@@ -1372,7 +1530,7 @@ void startFirmwareUpdate(const char* downloadUrl) {
           delay(1); // 避免看門狗重置
         }
         
-        if (written == contentLength && Update.end(true)) {
+        if (written == totalSize && Update.end(true)) {
           Serial.println("更新成功！準備重新啟動...");
           downloadSuccess = true;
           
@@ -1386,6 +1544,12 @@ void startFirmwareUpdate(const char* downloadUrl) {
           ESP.restart();
           return;
         }
+        
+        if (!Update.isRunning()) {
+          // 驗證失敗後更新已中止，下次重試從頭下載
+          written = 0;
+          etag = "";
+        }
       } else if (httpCode == HTTP_CODE_FOUND || httpCode == HTTP_CODE_MOVED_PERMANENTLY) {
         // 處理重定向
         String newUrl = http.getLocation();
@@ -1424,6 +1588,9 @@ void startFirmwareUpdate(const char* downloadUrl) {
   }
   
   // 更新失敗處理
+  if (Update.isRunning()) {
+    Update.abort();
+  }
   isUpdating = false;
   digitalWrite(ledOnFace, LOW);
   digitalWrite(ledOnBoard, LOW);
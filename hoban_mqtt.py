@@ -0,0 +1,584 @@
+#!/usr/bin/env python3
+"""
+hoRelay MQTT 共用模組：精簡的 asyncio MQTT 3.1.1 客戶端、本機測試用 broker 與主題協定
+只依賴 Python 標準函式庫，讓車隊工具在沒有 paho-mqtt 或真實 broker 的環境也能執行
+
+主題協定（與韌體相同）:
+  hoban/{device_id}/status   設備發布的 retained 狀態（JSON，OTA 期間也可能是純文字）
+  hoban/{device_id}/control  設備訂閱的控制指令
+
+用法:
+  python hoban_mqtt.py broker                 # 在 127.0.0.1:1883 啟動本機 broker
+  python hoban_mqtt.py broker --port 11883    # 指定埠號
+"""
+
+import sys
+import json
+import time
+import random
+import struct
+import asyncio
+import argparse
+import itertools
+from collections import namedtuple
+
+DEFAULT_PORT = 1883
+
+STATUS_TOPIC = 'hoban/{}/status'
+CONTROL_TOPIC = 'hoban/{}/control'
+STATUS_WILDCARD = 'hoban/+/status'
+
+# readme「多伺服器策略」列出的預設伺服器
+PUBLIC_BROKERS = ('mqttgo.io', 'broker.hoban.tw', 'mqtt.eclipseprojects.io',
+                  'broker.emqx.io', 'broker.hivemq.com')
+# quickConnectDefault / quickConnectCustom 接受連線的時限（秒）
+CONNECT_CUTOFF = 1.0
+# 常駐工具斷線重連的退避秒數：從 RECONNECT_MIN 起每次加倍，上限 RECONNECT_MAX
+RECONNECT_MIN = 1.0
+RECONNECT_MAX = 60.0
+
+# 封包類型
+CONNECT = 1
+CONNACK = 2
+PUBLISH = 3
+PUBACK = 4
+SUBSCRIBE = 8
+SUBACK = 9
+UNSUBSCRIBE = 10
+UNSUBACK = 11
+PINGREQ = 12
+PINGRESP = 13
+DISCONNECT = 14
+
+Message = namedtuple('Message', 'topic payload qos retain')
+Will = namedtuple('Will', 'topic payload qos retain')
+
+class MQTTError(Exception):
+    pass
+
+# ── 主題協定 ────────────────────────────────────────────────────────
+
+def status_topic(device_id):
+    return STATUS_TOPIC.format(device_id)
+
+def control_topic(device_id):
+    return CONTROL_TOPIC.format(device_id)
+
+def device_id_from_topic(topic):
+    """hoban/{device_id}/status → device_id，格式不符回傳 None"""
+    parts = topic.split('/')
+    if len(parts) >= 3 and parts[0] == 'hoban':
+        return parts[1]
+    return None
+
+def tag_command(command, command_id):
+    """附帶關聯 ID 的控制指令：ON@a1b2c3，設備執行後在 status 主題回覆 {"ack": "a1b2c3", ...}"""
+    return f"{command}@{command_id}"
+
+def split_command(message):
+    """與韌體 mqttCallback 相同的解析：update: 指令不拆，其餘以最後一個 @ 分出關聯 ID"""
+    if not message.startswith('update:'):
+        command, sep, command_id = message.rpartition('@')
+        if sep and command:
+            return command, command_id
+    return message, ''
+
+def parse_status(payload):
+    """解析狀態訊息；JSON 回傳 dict，韌體 OTA 時送出的純文字（updating 等）轉成 {'status': ...}"""
+    if isinstance(payload, (bytes, bytearray)):
+        payload = payload.decode('utf-8', errors='replace')
+    payload = payload.strip()
+    if payload.startswith('{'):
+        try:
+            data = json.loads(payload)
+            if isinstance(data, dict):
+                return data
+        except ValueError:
+            pass
+    return {'status': payload}
+
+def parse_broker(value, default_port=DEFAULT_PORT):
+    """'host' 或 'host:port' → (host, port)"""
+    host, sep, port = value.rpartition(':')
+    if sep and port.isdigit():
+        return host, int(port)
+    return value, default_port
+
+def topic_matches(topic_filter, topic):
+    """MQTT 主題萬用字元比對（+ 單層、# 多層）"""
+    filter_parts = topic_filter.split('/')
+    topic_parts = topic.split('/')
+    for i, part in enumerate(filter_parts):
+        if part == '#':
+            return True
+        if i >= len(topic_parts):
+            return False
+        if part != '+' and part != topic_parts[i]:
+            return False
+    return len(filter_parts) == len(topic_parts)
+
+# ── 封包編解碼 ──────────────────────────────────────────────────────
+
+def _encode_length(length):
+    out = bytearray()
+    while True:
+        byte = length % 128
+        length //= 128
+        if length:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+def _encode_str(value):
+    if isinstance(value, str):
+        value = value.encode('utf-8')
+    return struct.pack('!H', len(value)) + value
+
+def _packet(first_byte, body=b''):
+    return bytes([first_byte]) + _encode_length(len(body)) + body
+
+def _to_bytes(payload):
+    if payload is None:
+        return b''
+    if isinstance(payload, str):
+        return payload.encode('utf-8')
+    return bytes(payload)
+
+def encode_publish(topic, payload, qos=0, retain=False, packet_id=None, dup=False):
+    flags = (qos << 1) | (1 if retain else 0) | (0x08 if dup else 0)
+    body = _encode_str(topic)
+    if qos:
+        body += struct.pack('!H', packet_id)
+    return _packet((PUBLISH << 4) | flags, body + _to_bytes(payload))
+
+def decode_publish(flags, body):
+    """回傳 (Message, packet_id)"""
+    qos = (flags >> 1) & 0x03
+    retain = bool(flags & 0x01)
+    topic_len = struct.unpack_from('!H', body)[0]
+    topic = body[2:2 + topic_len].decode('utf-8')
+    pos = 2 + topic_len
+    packet_id = None
+    if qos:
+        packet_id = struct.unpack_from('!H', body, pos)[0]
+        pos += 2
+    return Message(topic, bytes(body[pos:]), qos, retain), packet_id
+
+async def read_packet(reader):
+    """讀取一個封包，回傳 (type, flags, body)；連線關閉時拋出 asyncio.IncompleteReadError"""
+    first = (await reader.readexactly(1))[0]
+    length = 0
+    multiplier = 1
+    while True:
+        byte = (await reader.readexactly(1))[0]
+        length += (byte & 0x7F) * multiplier
+        if not byte & 0x80:
+            break
+        multiplier *= 128
+        if multiplier > 128 ** 3:
+            raise MQTTError("封包長度格式錯誤")
+    body = await reader.readexactly(length) if length else b''
+    return first >> 4, first & 0x0F, body
+
+# ── 客戶端 ──────────────────────────────────────────────────────────
+
+class MQTTClient:
+    """精簡的 asyncio MQTT 3.1.1 客戶端
+
+    收到的訊息預設放進 self.messages（asyncio.Queue）；指定 on_message 時改為直接呼叫回呼，
+    適合每秒上千則訊息的收集器。publish(qos=1, wait=False) 會回傳等待 PUBACK 的 future，
+    可連續送出多則再一起等待（pipelining）。
+    """
+
+    def __init__(self, host, port=DEFAULT_PORT, client_id='', username=None, password=None,
+                 keepalive=30, will=None, clean_session=True, on_message=None):
+        self.host = host
+        self.port = port
+        self.client_id = client_id
+        self.username = username
+        self.password = password
+        self.keepalive = keepalive
+        self.will = will
+        self.clean_session = clean_session
+        self.on_message = on_message
+        self.messages = asyncio.Queue()
+        self._reader = None
+        self._writer = None
+        self._tasks = []
+        self._packet_ids = itertools.cycle(range(1, 65536))
+        self._pending = {}
+        self._connack = None
+        self.connected = False
+
+    async def connect(self, timeout=5):
+        self._reader, self._writer = await asyncio.wait_for(
+            asyncio.open_connection(self.host, self.port), timeout)
+        flags = 0x02 if self.clean_session else 0
+        payload = _encode_str(self.client_id)
+        if self.will:
+            flags |= 0x04 | (self.will.qos << 3) | (0x20 if self.will.retain else 0)
+            payload += _encode_str(self.will.topic) + _encode_str(_to_bytes(self.will.payload))
+        if self.username is not None:
+            flags |= 0x80
+            payload += _encode_str(self.username)
+        if self.password is not None:
+            flags |= 0x40
+            payload += _encode_str(self.password)
+        body = _encode_str('MQTT') + bytes([4, flags]) + struct.pack('!H', self.keepalive) + payload
+        loop = asyncio.get_running_loop()
+        self._connack = loop.create_future()
+        self._writer.write(_packet(CONNECT << 4, body))
+        self._tasks.append(asyncio.ensure_future(self._read_loop()))
+        try:
+            code = await asyncio.wait_for(self._connack, timeout)
+        except BaseException:
+            await self._close()
+            raise
+        if code != 0:
+            await self._close()
+            raise MQTTError(f"broker 拒絕連線，回傳碼 {code}")
+        self.connected = True
+        if self.keepalive:
+            self._tasks.append(asyncio.ensure_future(self._ping_loop()))
+        return self
+
+    def _new_request(self):
+        packet_id = next(self._packet_ids)
+        future = asyncio.get_running_loop().create_future()
+        self._pending[packet_id] = future
+        return packet_id, future
+
+    async def subscribe(self, *topic_filters, qos=0, timeout=10):
+        packet_id, future = self._new_request()
+        body = struct.pack('!H', packet_id)
+        for topic_filter in topic_filters:
+            body += _encode_str(topic_filter) + bytes([qos])
+        self._writer.write(_packet((SUBSCRIBE << 4) | 0x02, body))
+        codes = await asyncio.wait_for(future, timeout)
+        if any(code == 0x80 for code in codes):
+            raise MQTTError(f"訂閱失敗: {topic_filters}")
+        return codes
+
+    async def unsubscribe(self, *topic_filters, timeout=10):
+        packet_id, future = self._new_request()
+        body = struct.pack('!H', packet_id) + b''.join(_encode_str(t) for t in topic_filters)
+        self._writer.write(_packet((UNSUBSCRIBE << 4) | 0x02, body))
+        await asyncio.wait_for(future, timeout)
+
+    async def publish(self, topic, payload, qos=0, retain=False, wait=True, timeout=10):
+        """發布訊息；qos=1 且 wait=False 時回傳 PUBACK future，不等待確認"""
+        if not self.connected:
+            raise MQTTError("尚未連線")
+        if qos == 0:
+            self._writer.write(encode_publish(topic, payload, 0, retain))
+            if self._writer.transport.get_write_buffer_size() > 256 * 1024:
+                await self._writer.drain()
+            return None
+        packet_id, future = self._new_request()
+        self._writer.write(encode_publish(topic, payload, qos, retain, packet_id))
+        if not wait:
+            return future
+        await self._writer.drain()
+        await asyncio.wait_for(future, timeout)
+        return None
+
+    async def drain(self):
+        """等待已送出的 QoS 1 訊息全部收到 PUBACK"""
+        if self._writer:
+            await self._writer.drain()
+        pending = [f for f in self._pending.values() if not f.done()]
+        if pending:
+            await asyncio.gather(*pending)
+
+    async def disconnect(self):
+        if self._writer and self.connected:
+            try:
+                self._writer.write(_packet(DISCONNECT << 4))
+                await self._writer.drain()
+            except (ConnectionError, OSError):
+                pass
+        await self._close()
+
+    async def abort(self):
+        """不送 DISCONNECT 直接斷線（模擬斷電或重新開機），broker 會發布遺囑"""
+        await self._close()
+
+    async def _close(self):
+        self.connected = False
+        for task in self._tasks:
+            if task is not asyncio.current_task():
+                task.cancel()
+        self._tasks = []
+        if self._writer:
+            self._writer.close()
+            try:
+                await self._writer.wait_closed()
+            except (ConnectionError, OSError):
+                pass
+            self._writer = None
+        for future in self._pending.values():
+            if not future.done():
+                future.set_exception(MQTTError("連線已關閉"))
+        self._pending.clear()
+
+    async def _ping_loop(self):
+        try:
+            while True:
+                await asyncio.sleep(self.keepalive / 2)
+                self._writer.write(_packet(PINGREQ << 4))
+        except (ConnectionError, OSError, AttributeError):
+            pass
+
+    async def _read_loop(self):
+        try:
+            while True:
+                ptype, flags, body = await read_packet(self._reader)
+                if ptype == PUBLISH:
+                    message, packet_id = decode_publish(flags, body)
+                    if message.qos == 1:
+                        self._writer.write(_packet(PUBACK << 4, struct.pack('!H', packet_id)))
+                    if self.on_message:
+                        self.on_message(message)
+                    else:
+                        self.messages.put_nowait(message)
+                elif ptype == CONNACK:
+                    if self._connack and not self._connack.done():
+                        self._connack.set_result(body[1])
+                elif ptype in (PUBACK, UNSUBACK):
+                    future = self._pending.pop(struct.unpack_from('!H', body)[0], None)
+                    if future and not future.done():
+                        future.set_result(None)
+                elif ptype == SUBACK:
+                    future = self._pending.pop(struct.unpack_from('!H', body)[0], None)
+                    if future and not future.done():
+                        future.set_result(list(body[2:]))
+        except (asyncio.IncompleteReadError, ConnectionError, OSError):
+            pass
+        finally:
+            was_connected = self.connected
+            self.connected = False
+            if self._connack and not self._connack.done():
+                self._connack.set_exception(MQTTError("連線在 CONNACK 前中斷"))
+            for future in self._pending.values():
+                if not future.done():
+                    future.set_exception(MQTTError("連線中斷"))
+            self._pending.clear()
+            if was_connected:
+                # 以 None 通知佇列的讀取端連線已結束
+                self.messages.put_nowait(None)
+
+async def reconnect(client, *topic_filters, deadline=None, log=None):
+    """斷線後以指數退避（含隨機抖動）重新連線並重新訂閱 topic_filters
+
+    成功回傳 True；指定 deadline（time.time() 秒）且在此之前仍未連上時回傳 False。
+    log 為每次失敗時呼叫的函式（如 print）。
+    """
+    await client._close()
+    delay = RECONNECT_MIN
+    while True:
+        try:
+            await client.connect()
+            if topic_filters:
+                await client.subscribe(*topic_filters)
+            return True
+        except (OSError, asyncio.TimeoutError, MQTTError) as e:
+            await client._close()
+            wait = delay * random.uniform(0.5, 1.0)
+            if deadline is not None and time.time() + wait >= deadline:
+                return False
+            if log:
+                log(f"⚠ 重新連線 {client.host}:{client.port} 失敗: {e}，{wait:.0f} 秒後重試")
+            await asyncio.sleep(wait)
+            delay = min(delay * 2, RECONNECT_MAX)
+
+# ── 本機 broker ────────────────────────────────────────────────────
+
+class _Session:
+    def __init__(self, writer):
+        self.writer = writer
+        self.client_id = ''
+        self.subscriptions = {}
+        self.will = None
+
+class Broker:
+    """本機測試用的最小 MQTT broker
+
+    支援 CONNECT/遺囑、SUBSCRIBE（+ / # 萬用字元）、retained 訊息、QoS 0/1 發布與 PING；
+    轉發給訂閱者一律以 QoS 0 送出。不做認證與持久化，僅供模擬器、基準測試與離線驗證。
+    訂閱依主題建立索引：精確主題直接查表，只有萬用字元訂閱需要逐一比對，
+    上千台模擬設備各自訂閱 control 主題時轉發成本不會隨連線數成長。
+    """
+
+    def __init__(self, host='127.0.0.1', port=DEFAULT_PORT):
+        self.host = host
+        self.port = port
+        self.retained = {}
+        self.sessions = {}
+        self.published = 0
+        self._exact = {}
+        self._wildcards = {}
+        self._server = None
+        self._handlers = set()
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, self.host, self.port, backlog=1024)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self):
+        if self._server:
+            self._server.close()
+        # 關閉連線讓每個 handler 自行結束，避免關閉事件迴圈時被取消
+        for session in list(self.sessions.values()):
+            session.writer.close()
+        if self._handlers:
+            await asyncio.wait(self._handlers, timeout=2)
+        if self._server:
+            await self._server.wait_closed()
+        self.sessions.clear()
+
+    async def __aenter__(self):
+        return await self.start()
+
+    async def __aexit__(self, *exc):
+        await self.stop()
+
+    def _route(self, topic, payload, retain):
+        self.published += 1
+        if retain:
+            if payload:
+                self.retained[topic] = payload
+            else:
+                self.retained.pop(topic, None)
+        targets = set(self._exact.get(topic, ()))
+        for topic_filter, sessions in self._wildcards.items():
+            if topic_matches(topic_filter, topic):
+                targets |= sessions
+        if targets:
+            packet = encode_publish(topic, payload)
+            for session in targets:
+                session.writer.write(packet)
+
+    def _subscribe(self, session, topic_filter):
+        session.subscriptions[topic_filter] = 0
+        table = self._wildcards if '+' in topic_filter or '#' in topic_filter else self._exact
+        table.setdefault(topic_filter, set()).add(session)
+
+    def _unsubscribe(self, session, topic_filter):
+        session.subscriptions.pop(topic_filter, None)
+        table = self._wildcards if '+' in topic_filter or '#' in topic_filter else self._exact
+        sessions = table.get(topic_filter)
+        if sessions:
+            sessions.discard(session)
+            if not sessions:
+                del table[topic_filter]
+
+    async def _handle(self, reader, writer):
+        session = _Session(writer)
+        clean_exit = False
+        task = asyncio.current_task()
+        self._handlers.add(task)
+        try:
+            ptype, _, body = await read_packet(reader)
+            if ptype != CONNECT:
+                return
+            session.client_id, session.will = self._parse_connect(body)
+            old = self.sessions.get(session.client_id) if session.client_id else None
+            if old:
+                old.writer.close()
+            key = session.client_id or id(session)
+            self.sessions[key] = session
+            writer.write(_packet(CONNACK << 4, b'\x00\x00'))
+
+            while True:
+                ptype, flags, body = await read_packet(reader)
+                if ptype == PUBLISH:
+                    message, packet_id = decode_publish(flags, body)
+                    if message.qos == 1:
+                        writer.write(_packet(PUBACK << 4, struct.pack('!H', packet_id)))
+                    self._route(message.topic, message.payload, message.retain)
+                elif ptype == SUBSCRIBE:
+                    packet_id = struct.unpack_from('!H', body)[0]
+                    pos = 2
+                    filters = []
+                    while pos < len(body):
+                        length = struct.unpack_from('!H', body, pos)[0]
+                        filters.append(body[pos + 2:pos + 2 + length].decode('utf-8'))
+                        pos += 2 + length + 1
+                    for topic_filter in filters:
+                        self._subscribe(session, topic_filter)
+                    writer.write(_packet(SUBACK << 4, struct.pack('!H', packet_id) + bytes(len(filters))))
+                    for topic, payload in list(self.retained.items()):
+                        if any(topic_matches(f, topic) for f in filters):
+                            writer.write(encode_publish(topic, payload, retain=True))
+                elif ptype == UNSUBSCRIBE:
+                    packet_id = struct.unpack_from('!H', body)[0]
+                    pos = 2
+                    while pos < len(body):
+                        length = struct.unpack_from('!H', body, pos)[0]
+                        self._unsubscribe(session, body[pos + 2:pos + 2 + length].decode('utf-8'))
+                        pos += 2 + length
+                    writer.write(_packet(UNSUBACK << 4, struct.pack('!H', packet_id)))
+                elif ptype == PINGREQ:
+                    writer.write(_packet(PINGRESP << 4))
+                elif ptype == DISCONNECT:
+                    clean_exit = True
+                    return
+                if writer.transport.get_write_buffer_size() > 1024 * 1024:
+                    await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError, OSError, MQTTError):
+            pass
+        finally:
+            key = session.client_id or id(session)
+            if self.sessions.get(key) is session:
+                del self.sessions[key]
+            for topic_filter in list(session.subscriptions):
+                self._unsubscribe(session, topic_filter)
+            if session.will and not clean_exit:
+                self._route(session.will.topic, session.will.payload, session.will.retain)
+            writer.close()
+            self._handlers.discard(task)
+
+    @staticmethod
+    def _parse_connect(body):
+        pos = 2 + struct.unpack_from('!H', body)[0]
+        flags = body[pos + 1]
+        pos += 4
+        fields = []
+        while pos < len(body):
+            length = struct.unpack_from('!H', body, pos)[0]
+            fields.append(bytes(body[pos + 2:pos + 2 + length]))
+            pos += 2 + length
+        client_id = fields[0].decode('utf-8') if fields else ''
+        will = None
+        if flags & 0x04 and len(fields) >= 3:
+            will = Will(fields[1].decode('utf-8'), fields[2], (flags >> 3) & 0x03, bool(flags & 0x20))
+        return client_id, will
+
+# ── 命令列 ──────────────────────────────────────────────────────────
+
+async def _run_broker(host, port):
+    broker = await Broker(host, port).start()
+    print(f"本機 MQTT broker 已啟動: {host}:{broker.port}")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await broker.stop()
+
+def main():
+    parser = argparse.ArgumentParser(description='hoRelay MQTT 共用工具')
+    sub = parser.add_subparsers(dest='command', required=True)
+    p = sub.add_parser('broker', help='啟動本機測試用 broker')
+    p.add_argument('--host', default='127.0.0.1')
+    p.add_argument('--port', type=int, default=DEFAULT_PORT)
+    args = parser.parse_args()
+
+    if args.command == 'broker':
+        try:
+            asyncio.run(_run_broker(args.host, args.port))
+        except KeyboardInterrupt:
+            sys.exit(0)
+
+if __name__ == '__main__':
+    main()
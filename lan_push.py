@@ -0,0 +1,306 @@
+#!/usr/bin/env python3
+"""
+hoRelay1 區網韌體推送工具
+同時探測子網內每個位址的 HTTP /，從首頁辨識 hoRelay1（設備 ID 與韌體版本），
+再把 .bin 以串流方式同時上傳到多台設備的 /update，等待重新開機後確認版本，
+回報每台設備的上傳速率與結果。不經過雲端，適合網路品質差的現場
+
+用法:
+  python lan_push.py --subnet 192.168.1.0/24 --dry-run                  # 只列出找到的設備
+  python lan_push.py --subnet 192.168.1.0/24                            # 推送 build/releases 中最新的 hoRelay1
+  python lan_push.py --subnet 10.0.0.0/22 --bin hoRelay1_v1.0.6.bin --parallel 16 --report push.json
+  python lan_push.py --host 192.168.4.1 --bin hoRelay1_v1.0.6.bin       # AP 模式下的單台設備
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import asyncio
+import secrets
+import argparse
+import ipaddress
+
+import fleet_rollout
+
+MODEL = 'hoRelay1'
+HTTP_PORT = 80
+RELEASES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'build', 'releases')
+
+PROBE_TIMEOUT = 1.5
+PROBE_CONCURRENCY = 128
+MAX_PAGE_SIZE = 64 * 1024
+# 每次寫入的大小；寫入緩衝上限設為同樣大小，上傳速度會反映設備寫入 flash 的速度
+CHUNK_SIZE = 4096
+REBOOT_POLL_INTERVAL = 2
+
+# handleRoot 的頁面內容
+TITLE_PATTERN = re.compile(r'齁控.*?v([0-9][0-9A-Za-z.\-]*)</h1>', re.S)
+DEVICE_ID_PATTERN = re.compile(r'設備 ID：</strong>(hoban-[0-9a-f]{12})')
+
+RESULT_SUCCESS = fleet_rollout.RESULT_SUCCESS
+RESULT_FAILED = fleet_rollout.RESULT_FAILED
+RESULT_TIMEOUT = fleet_rollout.RESULT_TIMEOUT
+RESULT_SKIPPED = fleet_rollout.RESULT_SKIPPED
+
+def version_key(version):
+    return tuple(int(p) if p.isdigit() else 0 for p in version.split('.'))
+
+def latest_release(model=MODEL):
+    """build/releases/{model}/ 中版本最新的 .bin，回傳 (version, path)；沒有時回傳 (None, None)"""
+    model_dir = os.path.join(RELEASES_DIR, model)
+    pattern = re.compile(rf'^{re.escape(model)}_v(.+)\.bin$')
+    found = []
+    if os.path.isdir(model_dir):
+        for name in os.listdir(model_dir):
+            match = pattern.match(name)
+            if match:
+                found.append((match.group(1), os.path.join(model_dir, name)))
+    if not found:
+        return None, None
+    return max(found, key=lambda item: version_key(item[0]))
+
+def version_from_filename(path):
+    match = re.search(r'_v([0-9][0-9A-Za-z.\-]*?)\.bin$', os.path.basename(path))
+    return match.group(1) if match else None
+
+def expand_targets(subnets, hosts):
+    """--subnet 與 --host → 不重複的位址清單（依出現順序）"""
+    addresses = list(hosts or [])
+    for subnet in subnets or []:
+        network = ipaddress.ip_network(subnet, strict=False)
+        addresses += [str(ip) for ip in (network.hosts() if network.num_addresses > 1 else [network.network_address])]
+    return list(dict.fromkeys(addresses))
+
+# ── HTTP ────────────────────────────────────────────────────────────
+
+async def _read_response(reader, limit):
+    """讀取 Connection: close 的回應，回傳 (狀態碼, 內容)"""
+    head = await reader.readuntil(b'\r\n\r\n')
+    status = int(head.split(b' ', 2)[1])
+    length = re.search(rb'(?im)^content-length:\s*(\d+)', head)
+    if length:
+        body = await reader.readexactly(min(int(length.group(1)), limit))
+    else:
+        body = await reader.read(limit)
+    return status, body
+
+async def http_get(host, path, timeout, port=HTTP_PORT):
+    reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+    try:
+        writer.write(f"GET {path} HTTP/1.1\r\nHost: {host}\r\nConnection: close\r\n\r\n".encode('latin-1'))
+        return await asyncio.wait_for(_read_response(reader, MAX_PAGE_SIZE), timeout)
+    finally:
+        writer.close()
+
+async def probe(host, timeout=PROBE_TIMEOUT, port=HTTP_PORT):
+    """GET / 並辨識 hoRelay1 首頁，回傳 {'host', 'port', 'device_id', 'version'}；不是 hoRelay1 或沒有回應時回傳 None"""
+    try:
+        status, body = await http_get(host, '/', timeout, port)
+    except (OSError, ValueError, IndexError, asyncio.TimeoutError, asyncio.IncompleteReadError,
+            asyncio.LimitOverrunError):
+        return None
+    page = body.decode('utf-8', errors='replace')
+    title = TITLE_PATTERN.search(page)
+    device = DEVICE_ID_PATTERN.search(page)
+    if status != 200 or not title or not device:
+        return None
+    return {'host': host, 'port': port, 'device_id': device.group(1), 'version': title.group(1)}
+
+async def discover(addresses, concurrency=PROBE_CONCURRENCY, timeout=PROBE_TIMEOUT, port=HTTP_PORT):
+    limit = asyncio.Semaphore(concurrency)
+
+    async def one(host):
+        async with limit:
+            return await probe(host, timeout, port)
+
+    found = await asyncio.gather(*(one(a) for a in addresses))
+    # 同一台設備可能同時有 STA 與 AP 位址，依設備 ID 去重
+    devices = {}
+    for device in filter(None, found):
+        devices.setdefault(device['device_id'], device)
+    return sorted(devices.values(), key=lambda d: _address_key(d['host']))
+
+def _address_key(host):
+    try:
+        return 0, int(ipaddress.ip_address(host))
+    except ValueError:
+        return 1, host
+
+# ── 推送 ────────────────────────────────────────────────────────────
+
+async def upload(device, image, filename, timeout):
+    """以 multipart/form-data 串流上傳到 /update，回傳 (結果說明, 上傳秒數)。
+    設備在 UPLOAD_FILE_END 寫入成功後直接 ESP.restart()，通常不會送出回應，連線關閉即視為已送達"""
+    boundary = f"hoctrl{secrets.token_hex(8)}"
+    head = (f"--{boundary}\r\nContent-Disposition: form-data; name=\"update\"; filename=\"{filename}\"\r\n"
+            f"Content-Type: application/octet-stream\r\n\r\n").encode('utf-8')
+    tail = f"\r\n--{boundary}--\r\n".encode('latin-1')
+    request = (f"POST /update HTTP/1.1\r\nHost: {device['host']}\r\nConnection: close\r\n"
+               f"Content-Type: multipart/form-data; boundary={boundary}\r\n"
+               f"Content-Length: {len(head) + len(image) + len(tail)}\r\n\r\n").encode('latin-1')
+
+    reader, writer = await asyncio.wait_for(asyncio.open_connection(device['host'], device['port']), timeout)
+    writer.transport.set_write_buffer_limits(high=CHUNK_SIZE)
+    started = time.monotonic()
+    try:
+        writer.write(request + head)
+        view = memoryview(image)
+        for offset in range(0, len(image), CHUNK_SIZE):
+            writer.write(view[offset:offset + CHUNK_SIZE])
+            await asyncio.wait_for(writer.drain(), timeout)
+        writer.write(tail)
+        await asyncio.wait_for(writer.drain(), timeout)
+        try:
+            status, body = await asyncio.wait_for(_read_response(reader, MAX_PAGE_SIZE), timeout)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            return 'restarting', time.monotonic() - started
+        text = body.decode('utf-8', errors='replace').strip()
+        if status != 200 or '失敗' in text:
+            raise RuntimeError(f"設備回應 {status}: {text or '(空白)'}")
+        return text, time.monotonic() - started
+    finally:
+        writer.close()
+
+async def wait_reboot(device, version, timeout):
+    """等待設備重新開機並回報目標版本；version 為 None 時只確認設備回來"""
+    deadline = time.monotonic() + timeout
+    await asyncio.sleep(REBOOT_POLL_INTERVAL)
+    while time.monotonic() < deadline:
+        state = await probe(device['host'], PROBE_TIMEOUT, device['port'])
+        if state and state['device_id'] == device['device_id'] and (version is None or state['version'] == version):
+            return state
+        await asyncio.sleep(REBOOT_POLL_INTERVAL)
+    return None
+
+async def push_one(device, image, filename, version, args, limit):
+    result = {'device_id': device['device_id'], 'host': device['host'], 'from_version': device['version'],
+              'size': len(image)}
+    async with limit:
+        print(f"  ▶ {device['device_id']} ({device['host']}) v{device['version']} 上傳中...")
+        try:
+            reply, seconds = await upload(device, image, filename, args.timeout)
+        except (OSError, RuntimeError, ValueError, IndexError, asyncio.TimeoutError) as e:
+            result.update(result=RESULT_FAILED, error=str(e) or type(e).__name__)
+            print(f"  ❌ {device['device_id']}: 上傳失敗 - {result['error']}")
+            return result
+    # 等待重新開機不佔用上傳名額
+    result['upload_seconds'] = round(seconds, 2)
+    result['kbps'] = round(len(image) / seconds / 1024, 1) if seconds else None
+    result['reply'] = reply
+    state = await wait_reboot(device, version, args.reboot_timeout)
+    if state:
+        result.update(result=RESULT_SUCCESS, version=state['version'])
+        print(f"  ✅ {device['device_id']}: {result['kbps']} KB/s，已重新開機 v{state['version']}")
+    else:
+        result['result'] = RESULT_TIMEOUT
+        print(f"  ⚠️ {device['device_id']}: 上傳完成（{result['kbps']} KB/s），"
+              f"{args.reboot_timeout:g} 秒內未回報{f' v{version}' if version else ''}")
+    return result
+
+async def run(args, image, filename, version):
+    addresses = expand_targets(args.subnet, args.host)
+    print(f"探測 {len(addresses)} 個位址...")
+    started = time.monotonic()
+    devices = await discover(addresses, args.probe_concurrency, args.probe_timeout, args.port)
+    print(f"找到 {len(devices)} 台 {MODEL}（{time.monotonic() - started:.1f} 秒）")
+
+    wanted = set(args.device or [])
+    if args.devices:
+        wanted.update(fleet_rollout.load_device_list(args.devices))
+    targets, results = [], []
+    for device in devices:
+        if wanted and device['device_id'] not in wanted:
+            continue
+        if version and device['version'] == version and not args.force:
+            print(f"  略過 {device['device_id']}: 已是 v{version}")
+            results.append({'device_id': device['device_id'], 'host': device['host'],
+                            'from_version': device['version'], 'result': RESULT_SKIPPED})
+            continue
+        targets.append(device)
+
+    if args.dry_run or not targets:
+        for device in targets:
+            print(f"  {device['device_id']}  {device['host']:<15}  v{device['version']}")
+        return results
+
+    print(f"\n推送 {filename}（{len(image) / 1024:.1f} KB）到 {len(targets)} 台，同時最多 {args.parallel} 台")
+    limit = asyncio.Semaphore(args.parallel)
+    started = time.monotonic()
+    results += await asyncio.gather(*(push_one(d, image, filename, version, args, limit) for d in targets))
+    print(f"總耗時 {time.monotonic() - started:.1f} 秒")
+    return results
+
+def print_summary(results):
+    counts = {}
+    for r in results:
+        counts[r['result']] = counts.get(r['result'], 0) + 1
+    print("\n═══ 推送結果 ═══")
+    for key in (RESULT_SUCCESS, RESULT_FAILED, RESULT_TIMEOUT, RESULT_SKIPPED):
+        print(f"  {key:<8} {counts.get(key, 0)}")
+    rates = sorted(r['kbps'] for r in results if r.get('kbps'))
+    if rates:
+        print(f"  上傳速率 KB/s: 最低 {rates[0]}、中位數 {rates[len(rates) // 2]}、最高 {rates[-1]}")
+
+# ── 命令列 ──────────────────────────────────────────────────────────
+
+def main():
+    parser = argparse.ArgumentParser(description='hoRelay1 區網韌體推送工具')
+    parser.add_argument('--subnet', action='append', help='要探測的子網（如 192.168.1.0/24，可重複）')
+    parser.add_argument('--host', action='append', help='指定設備位址（可重複）')
+    parser.add_argument('--port', type=int, default=HTTP_PORT, help=f'設備 HTTP 連接埠（預設 {HTTP_PORT}）')
+    parser.add_argument('--bin', help=f'韌體檔（預設為 build/releases/{MODEL}/ 中最新的版本）')
+    parser.add_argument('--version', help='目標版本（預設取自檔名 _v{版本}.bin），用於略過與確認')
+    parser.add_argument('--device', action='append', help='只推送指定設備 ID（可重複）')
+    parser.add_argument('--devices', help='設備清單檔（每行一個 device_id）')
+    parser.add_argument('--force', action='store_true', help='已是目標版本的設備也推送')
+    parser.add_argument('--parallel', type=int, default=8, help='同時上傳的設備數上限（預設 8）')
+    parser.add_argument('--probe-concurrency', type=int, default=PROBE_CONCURRENCY,
+                        help=f'同時探測的位址數（預設 {PROBE_CONCURRENCY}）')
+    parser.add_argument('--probe-timeout', type=float, default=PROBE_TIMEOUT,
+                        help=f'探測逾時秒數（預設 {PROBE_TIMEOUT}）')
+    parser.add_argument('--timeout', type=float, default=30, help='上傳時單次讀寫逾時秒數（預設 30）')
+    parser.add_argument('--reboot-timeout', type=float, default=60, help='等待重新開機的秒數（預設 60）')
+    parser.add_argument('--dry-run', action='store_true', help='只列出找到的設備，不推送')
+    parser.add_argument('--report', help='將每台設備的結果寫入 JSON 檔')
+    args = parser.parse_args()
+
+    if not args.subnet and not args.host:
+        print("❌ 請以 --subnet 或 --host 指定探測範圍")
+        sys.exit(1)
+    bin_path = args.bin
+    version = args.version
+    if not bin_path:
+        latest_version, bin_path = latest_release()
+        if not bin_path:
+            print(f"❌ build/releases/{MODEL}/ 沒有已發布的韌體，請以 --bin 指定")
+            sys.exit(1)
+        version = version or latest_version
+    version = version or version_from_filename(bin_path)
+    try:
+        with open(bin_path, 'rb') as f:
+            image = f.read()
+    except OSError as e:
+        print(f"❌ 無法讀取韌體: {e}")
+        sys.exit(1)
+
+    try:
+        results = asyncio.run(run(args, image, os.path.basename(bin_path), version))
+    except ValueError as e:
+        print(f"❌ {e}")
+        sys.exit(1)
+    except KeyboardInterrupt:
+        sys.exit(1)
+
+    if results:
+        print_summary(results)
+    if args.report:
+        with open(args.report, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"報告已寫入: {args.report}")
+    if any(r['result'] not in (RESULT_SUCCESS, RESULT_SKIPPED) for r in results):
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,477 @@
+#!/usr/bin/env python3
+"""
+hoRelay OTA 下載基準測試
+以 firmware_server.py 提供韌體映像，經過可設定頻寬、延遲、遺失率與中途斷線的模擬鏈路，
+重播 startFirmwareUpdate 的讀取／寫入／重試流程（1024 bytes 緩衝、30 秒 HTTP 逾時、
+5 分鐘 downloadTimeout、每次迴圈 delay(1)、Update.write 每滿 4 KB 寫入一次 flash），
+比較不同緩衝大小與逾時設定下的吞吐量、完成率與完成時間
+
+用法:
+  python ota_bench.py                                           # 預設鏈路 lan / wifi / weak，各 5 次
+  python ota_bench.py --buffer 512,1024,4096 --trials 10        # 比較緩衝大小
+  python ota_bench.py --link stall --download-timeout 30,300 --time-scale 10
+  python ota_bench.py --link "cafe:bw=80k,rtt=120,loss=0.02,drop=400k" --resume both --csv ota.csv
+  python ota_bench.py --image build/releases/hoRelay2_v2.0.5.bin --json ota.json
+
+鏈路參數（--link 名稱:鍵=值,...）:
+  bw    頻寬 bytes/秒（可加 k / m，0 = 不限）       rtt   往返延遲毫秒
+  loss  每個封包的遺失機率（以重傳延遲 rtt + 200 ms 模擬）
+  drop  平均每傳送多少 bytes 斷線一次（指數分布，0 = 不斷線）
+  mode  斷線方式：reset（連線關閉）或 stall（連線仍在但不再有資料，韌體要等到 downloadTimeout）
+"""
+
+import os
+import sys
+import csv
+import json
+import random
+import asyncio
+import argparse
+import tempfile
+import itertools
+import collections
+from datetime import datetime
+
+import broker_bench
+import firmware_server
+
+# 與韌體相同的參數
+BUFFER_SIZE = 1024            # uint8_t buff[1024]
+HTTP_TIMEOUT = 30             # http.setTimeout(30000)
+DOWNLOAD_TIMEOUT = 300        # downloadTimeout = 300000
+LOOP_DELAY = 0.001            # delay(1)
+MAX_RETRIES = 3               # maxRetries
+BASE_DELAY = 5                # baseDelay = 5000，等待 baseDelay * (1 << retryCount)
+SECTOR_SIZE = 4096            # Update.write 緩衝滿一個 sector 才寫入 flash
+
+# 鏈路模型
+MSS = 1460
+DEFAULT_WINDOW = 5744         # arduino-esp32 lwIP 預設 TCP 接收視窗（4 個 MSS）
+DEFAULT_SECTOR_MS = 25        # 抹除並寫入一個 4 KB sector 的時間（毫秒），依實機量測調整
+RTO_MIN = 0.2
+DEFAULT_IMAGE_SIZE = 512 * 1024
+DEFAULT_LINKS = ('lan', 'wifi', 'weak')
+
+PRESETS = {
+    'lan': 'bw=1m,rtt=5',
+    'wifi': 'bw=200k,rtt=40,loss=0.005',
+    'weak': 'bw=40k,rtt=150,loss=0.03,drop=300k',
+    'stall': 'bw=100k,rtt=80,drop=200k,mode=stall',
+}
+
+# HTTPClient 的錯誤碼
+HTTPC_ERROR_CONNECTION_LOST = -5
+HTTPC_ERROR_READ_TIMEOUT = -11
+
+def parse_size(text):
+    """'64k'、'1.5m'、'4096' → bytes"""
+    text = text.strip().lower()
+    scale = {'k': 1024, 'm': 1024 * 1024}.get(text[-1:], 1)
+    return int(float(text[:-1] if scale > 1 else text) * scale)
+
+def parse_link(spec):
+    """'名稱' 或 '名稱:bw=..,rtt=..' → 鏈路設定 dict；名稱為預設組合時其餘參數覆寫預設值"""
+    name, _, params = spec.partition(':')
+    name = name.strip()
+    if not params and name not in PRESETS:
+        raise ValueError(f"未知的鏈路: {name}（可用 {', '.join(PRESETS)} 或 名稱:鍵=值）")
+    link = {'name': name, 'bw': 0, 'rtt': 0.0, 'loss': 0.0, 'drop': 0, 'mode': 'reset'}
+    for item in filter(None, (PRESETS.get(name, '') + ',' + params).split(',')):
+        key, sep, value = item.partition('=')
+        key = key.strip()
+        if not sep or key not in link or key == 'name':
+            raise ValueError(f"無效的鏈路參數: {item}")
+        if key in ('bw', 'drop'):
+            link[key] = parse_size(value)
+        elif key == 'rtt':
+            link[key] = float(value) / 1000
+        elif key == 'loss':
+            link[key] = float(value)
+        elif value not in ('reset', 'stall'):
+            raise ValueError(f"mode 只能是 reset 或 stall: {value}")
+        else:
+            link[key] = value
+    return link
+
+def parse_list(text, convert=float):
+    return [convert(v) for v in text.split(',') if v.strip()]
+
+class Clock:
+    """設備端時間；time_scale > 1 時以加速方式執行，所有時間仍以設備的秒數表示"""
+
+    def __init__(self, time_scale=1.0):
+        self.scale = time_scale
+        self.loop = asyncio.get_running_loop()
+        self.origin = self.loop.time()
+
+    def now(self):
+        return (self.loop.time() - self.origin) * self.scale
+
+    async def sleep(self, seconds):
+        await asyncio.sleep(max(0.0, seconds) / self.scale)
+
+    def call_later(self, seconds, callback, *args):
+        return self.loop.call_later(max(0.0, seconds) / self.scale, callback, *args)
+
+    async def wait(self, event, seconds):
+        """等待 event 最多 seconds 秒，回傳是否等到"""
+        try:
+            await asyncio.wait_for(event.wait(), max(0.0, seconds) / self.scale)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+# ── 模擬鏈路 ────────────────────────────────────────────────────────
+
+class ShapedLink:
+    """設備到伺服器的單一 TCP 連線。伺服器端是真的 socket，設備端以 available() / read()
+    取資料：下行資料依頻寬排隊、經單程延遲送達，在途資料受接收視窗限制（設備讀走後才回 ACK），
+    遺失的封包以重傳延遲表示，並在抽到的位置斷線"""
+
+    def __init__(self, profile, clock, rng, window):
+        self.profile = profile
+        self.clock = clock
+        self.rng = rng
+        self.window = window
+        self.latency = profile['rtt'] / 2
+        self.cut_at = int(rng.expovariate(1 / profile['drop'])) if profile['drop'] else None
+        self.buffer = bytearray()
+        self.closed = False
+        self.sent = 0
+        self.acked = 0
+        self.arrived = asyncio.Event()
+        self.acked_event = asyncio.Event()
+        self.writer = None
+        self.pump = None
+
+    async def connect(self, host, port, request):
+        await self.clock.sleep(self.profile['rtt'])        # TCP 握手
+        reader, self.writer = await asyncio.open_connection(host, port)
+        await self.clock.sleep(self.latency)                # 請求送達伺服器
+        self.writer.write(request)
+        self.pump = asyncio.create_task(self._pump(reader))
+
+    async def _pump(self, reader):
+        clock, profile = self.clock, self.profile
+        next_free = clock.now()
+        try:
+            while True:
+                segment = await reader.read(MSS)
+                if not segment:
+                    break
+                while self.sent - self.acked + len(segment) > self.window:
+                    self.acked_event.clear()
+                    await self.acked_event.wait()
+                depart = max(clock.now(), next_free)
+                if profile['bw']:
+                    depart += len(segment) / profile['bw']
+                if profile['loss'] and self.rng.random() < profile['loss']:
+                    depart += profile['rtt'] + RTO_MIN
+                next_free = depart
+                if self.cut_at is not None and self.sent + len(segment) >= self.cut_at:
+                    segment = segment[:self.cut_at - self.sent]
+                    self.sent += len(segment)
+                    clock.call_later(depart + self.latency - clock.now(), self._deliver, segment,
+                                     profile['mode'] == 'reset')
+                    return
+                self.sent += len(segment)
+                clock.call_later(depart + self.latency - clock.now(), self._deliver, segment, False)
+            clock.call_later(next_free + self.latency - clock.now(), self._deliver, b'', True)
+        finally:
+            self.writer.close()
+
+    def _deliver(self, segment, close):
+        self.buffer += segment
+        self.closed = self.closed or close
+        self.arrived.set()
+
+    def _ack(self, count):
+        self.acked += count
+        self.acked_event.set()
+
+    def available(self):
+        return len(self.buffer)
+
+    def connected(self):
+        """與 HTTPClient::connected() 相同：連線還在或仍有未讀資料"""
+        return not self.closed or bool(self.buffer)
+
+    def read(self, size):
+        data = bytes(self.buffer[:size])
+        del self.buffer[:size]
+        self.clock.call_later(self.latency, self._ack, len(data))
+        if not self.buffer:
+            self.arrived.clear()
+        return data
+
+    async def wait_data(self, seconds):
+        if not self.buffer and not self.closed:
+            await self.clock.wait(self.arrived, seconds)
+
+    async def read_head(self, timeout):
+        """讀取回應標頭，回傳 (HTTP 狀態碼或 HTTPClient 錯誤碼, 標頭 dict)"""
+        deadline = self.clock.now() + timeout
+        while b'\r\n\r\n' not in self.buffer:
+            if self.closed:
+                return HTTPC_ERROR_CONNECTION_LOST, {}
+            remaining = deadline - self.clock.now()
+            if remaining <= 0:
+                return HTTPC_ERROR_READ_TIMEOUT, {}
+            await self.wait_data(remaining)
+        head = self.read(self.buffer.index(b'\r\n\r\n') + 4).decode('latin-1').split('\r\n')
+        headers = {}
+        for line in head[1:]:
+            name, sep, value = line.partition(':')
+            if sep:
+                headers[name.strip().lower()] = value.strip()
+        return int(head[0].split(' ')[1]), headers
+
+    def close(self):
+        if self.pump:
+            self.pump.cancel()
+        elif self.writer:
+            self.writer.close()
+        self.closed = True
+
+# ── 設備流程重播 ────────────────────────────────────────────────────
+
+async def replay(server, path, size, profile, settings, clock, rng, window, sector_ms):
+    """依 startFirmwareUpdate 的流程下載一次映像，回傳結果 dict（時間為設備秒數）"""
+    result = {'completed': False, 'attempts': 0, 'received': 0, 'discarded': 0,
+              'stream_time': 0.0, 'errors': []}
+    written = total = 0
+    etag = None
+    running = False
+    started = clock.now()
+
+    for retry in range(settings['retries']):
+        if retry:
+            await clock.sleep(settings['base_delay'] * (1 << retry))
+        result['attempts'] += 1
+        request = (f"GET {path} HTTP/1.1\r\nHost: {server.host}:{server.port}\r\n"
+                   f"User-Agent: ESP32-FirmwareUpdate/1.0\r\nAccept: */*\r\nConnection: close\r\n")
+        if settings['resume'] and written and etag:
+            request += f"Range: bytes={written}-\r\nIf-Range: {etag}\r\n"
+        link = ShapedLink(profile, clock, rng, window)
+        try:
+            await link.connect(server.host, server.port, (request + '\r\n').encode('latin-1'))
+            code, headers = await link.read_head(settings['http_timeout'])
+
+            resumed = False
+            if code in (206, 416):
+                content_range = headers.get('content-range', '')
+                start = content_range.partition(' ')[2].partition('-')[0]
+                whole = content_range.rpartition('/')[2]
+                if code == 206 and running and start == str(written) and whole == str(total):
+                    resumed = True
+                else:
+                    running = False
+                    result['discarded'] += written
+                    written, etag = 0, None
+
+            if code != 200 and not resumed:
+                result['errors'].append(str(code))
+                continue
+            if not resumed:
+                result['discarded'] += written
+                written = 0
+                total = int(headers['content-length'])
+                etag = headers.get('etag') if settings['resume'] else None
+                running = True
+
+            loop_started = clock.now()
+            while link.connected() and written < total:
+                cost = LOOP_DELAY
+                if link.available():
+                    chunk = link.read(min(link.available(), settings['buffer']))
+                    sectors = (written + len(chunk)) // SECTOR_SIZE - written // SECTOR_SIZE
+                    written += len(chunk)
+                    result['received'] += len(chunk)
+                    cost += sectors * sector_ms / 1000
+                else:
+                    # 沒有資料時韌體每 1 ms 輪詢一次，這裡直接等到資料到達或逾時
+                    await link.wait_data(settings['download_timeout'] - (clock.now() - loop_started))
+                if clock.now() - loop_started > settings['download_timeout']:
+                    result['errors'].append('download_timeout')
+                    break
+                await clock.sleep(cost)
+            result['stream_time'] += clock.now() - loop_started
+
+            if written == total:
+                result['completed'] = True
+                break
+            if not link.connected():
+                result['errors'].append('disconnected')
+            if not settings['resume']:
+                running = False
+        except (OSError, asyncio.IncompleteReadError) as e:
+            result['errors'].append(type(e).__name__)
+        finally:
+            link.close()
+
+    result['elapsed'] = clock.now() - started
+    return result
+
+def summarize(key, size, results):
+    completed = [r for r in results if r['completed']]
+    times = sorted(r['elapsed'] for r in completed)
+    streamed = sum(r['stream_time'] for r in results)
+    errors = collections.Counter(e for r in results for e in r['errors'])
+    return {
+        **key,
+        'trials': len(results),
+        'completed': len(completed),
+        'completion_rate': round(len(completed) / len(results), 3) if results else 0.0,
+        # 有效吞吐量含重試等待；串流速率只計下載迴圈內的時間
+        'throughput_kbps': round(size / broker_bench.percentile(times, 50) / 1024, 1) if times else None,
+        'stream_kbps': round(sum(r['received'] for r in results) / streamed / 1024, 1) if streamed else None,
+        'ttc_p50': round(broker_bench.percentile(times, 50), 2) if times else None,
+        'ttc_p90': round(broker_bench.percentile(times, 90), 2) if times else None,
+        'attempts': round(sum(r['attempts'] for r in results) / len(results), 2) if results else 0,
+        'discarded_kb': round(sum(r['discarded'] for r in results) / len(results) / 1024, 1) if results else 0,
+        'errors': dict(errors.most_common()),
+    }
+
+async def run(args, image, links, matrix):
+    root = tempfile.mkdtemp(prefix='hoctrl-ota-bench-')
+    path = '/firmware/bench/bench.bin'
+    os.makedirs(os.path.join(root, 'firmware', 'bench'))
+    with open(os.path.join(root, path.lstrip('/')), 'wb') as f:
+        f.write(image)
+
+    server = await firmware_server.FirmwareServer(root, log=False).start('127.0.0.1', 0)
+    clock = Clock(args.time_scale)
+    limit = asyncio.Semaphore(args.parallel)
+
+    async def trial(profile, settings, index):
+        rng = random.Random(f"{args.seed}:{profile['name']}:{index}")
+        async with limit:
+            return await replay(server, path, len(image), profile, settings, clock, rng,
+                                args.window, args.sector_ms)
+
+    try:
+        groups = []
+        for profile, settings in itertools.product(links, matrix):
+            key = {'link': profile['name'], **settings}
+            groups.append((key, [trial(profile, settings, i) for i in range(args.trials)]))
+        print(f"映像 {len(image) / 1024:.0f} KB，{len(groups)} 組設定 × {args.trials} 次試驗"
+              f"（時間倍率 {args.time_scale:g}）...")
+        gathered = await asyncio.gather(*(asyncio.gather(*trials) for _, trials in groups))
+        return [summarize(key, len(image), results) for (key, _), results in zip(groups, gathered)]
+    finally:
+        await server.stop()
+        os.remove(os.path.join(root, path.lstrip('/')))
+        os.removedirs(os.path.join(root, 'firmware', 'bench'))
+
+def _fmt(value, spec='.1f'):
+    return '-' if value is None else format(value, spec)
+
+def print_report(results):
+    # 中文字元顯示寬度為 2，欄寬相應縮減
+    print(f"\n{'鏈路':<8} {'緩衝':>4} {'HTTP':>5} {'下載':>3} {'續傳':>2} {'完成':>5} "
+          f"{'KB/s':>7} {'串流':>5} {'p50 秒':>7} {'p90 秒':>7} {'嘗試':>3} {'捨棄KB':>5}")
+    for r in results:
+        print(f"{r['link']:<10} {r['buffer']:>6} {r['http_timeout']:>5g} {r['download_timeout']:>5g} "
+              f"{'是' if r['resume'] else '否':>3} {r['completed']:>3}/{r['trials']:<3} "
+              f"{_fmt(r['throughput_kbps']):>7} {_fmt(r['stream_kbps']):>7} "
+              f"{_fmt(r['ttc_p50']):>8} {_fmt(r['ttc_p90']):>8} {r['attempts']:>5.2f} {r['discarded_kb']:>7.1f}")
+        if r['errors']:
+            print(f"    {', '.join(f'{e}×{n}' for e, n in r['errors'].items())}")
+
+    # 同一條鏈路上完成率最高、再依 p50 / p90 最短的設定
+    print("\n各鏈路最佳設定:")
+    for link, rows in itertools.groupby(results, key=lambda r: r['link']):
+        best = min(rows, key=lambda r: (-r['completion_rate'], r['ttc_p50'] or float('inf'),
+                                      r['ttc_p90'] or float('inf'), r['discarded_kb']))
+        print(f"  {link}: 緩衝 {best['buffer']}、HTTP 逾時 {best['http_timeout']:g} 秒、"
+              f"downloadTimeout {best['download_timeout']:g} 秒、續傳{'開' if best['resume'] else '關'}"
+              f"（完成 {best['completion_rate']:.0%}，p50 {_fmt(best['ttc_p50'])} 秒）")
+
+def write_csv(path, results, timestamp):
+    """附加到既有 CSV，同一個檔案可累積多次量測"""
+    rows = [{'timestamp': timestamp, **{k: v for k, v in r.items() if k != 'errors'},
+             'errors': ' '.join(f'{e}:{n}' for e, n in r['errors'].items())} for r in results]
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            exists = bool(f.readline())
+    except FileNotFoundError:
+        exists = False
+    with open(path, 'a', encoding='utf-8', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=list(rows[0].keys()))
+        if not exists:
+            writer.writeheader()
+        writer.writerows(rows)
+
+# ── 命令列 ──────────────────────────────────────────────────────────
+
+def main():
+    parser = argparse.ArgumentParser(description='hoRelay OTA 下載基準測試')
+    parser.add_argument('--link', action='append',
+                        help=f"鏈路（{' / '.join(PRESETS)} 或 名稱:bw=..,rtt=..,loss=..,drop=..,mode=..，可重複；"
+                             f"預設 {' / '.join(DEFAULT_LINKS)}）")
+    parser.add_argument('--image', help='使用實際的韌體映像（預設為隨機資料）')
+    parser.add_argument('--size', default=str(DEFAULT_IMAGE_SIZE), help='隨機映像大小（預設 512k）')
+    parser.add_argument('--buffer', default=str(BUFFER_SIZE), help=f'讀取緩衝大小，逗號分隔（預設 {BUFFER_SIZE}）')
+    parser.add_argument('--http-timeout', default=str(HTTP_TIMEOUT),
+                        help=f'HTTP 逾時秒數，逗號分隔（預設 {HTTP_TIMEOUT}）')
+    parser.add_argument('--download-timeout', default=str(DOWNLOAD_TIMEOUT),
+                        help=f'downloadTimeout 秒數，逗號分隔（預設 {DOWNLOAD_TIMEOUT}）')
+    parser.add_argument('--resume', choices=('on', 'off', 'both'), default='on',
+                        help='重試時以 Range 續傳（off 為舊版韌體的行為，預設 on）')
+    parser.add_argument('--retries', type=int, default=MAX_RETRIES, help=f'maxRetries（預設 {MAX_RETRIES}）')
+    parser.add_argument('--base-delay', type=float, default=BASE_DELAY, help=f'重試基礎延遲秒數（預設 {BASE_DELAY}）')
+    parser.add_argument('--window', type=int, default=DEFAULT_WINDOW, help=f'TCP 接收視窗（預設 {DEFAULT_WINDOW}）')
+    parser.add_argument('--sector-ms', type=float, default=DEFAULT_SECTOR_MS,
+                        help=f'寫入一個 4 KB sector 的毫秒數（預設 {DEFAULT_SECTOR_MS}）')
+    parser.add_argument('--trials', type=int, default=5, help='每組設定的試驗次數（預設 5）')
+    parser.add_argument('--parallel', type=int, default=32, help='同時進行的試驗數（預設 32）')
+    parser.add_argument('--time-scale', type=float, default=1.0,
+                        help='加速倍率（預設 1 = 實際時間；倍率高時 1 ms 級的延遲較不準確）')
+    parser.add_argument('--seed', default='hoctrl', help='隨機種子（相同種子的遺失與斷線位置相同）')
+    parser.add_argument('--json', help='完整結果寫入 JSON 檔')
+    parser.add_argument('--csv', help='摘要附加到 CSV 檔')
+    args = parser.parse_args()
+
+    try:
+        links = [parse_link(spec) for spec in (args.link or DEFAULT_LINKS)]
+        buffers = parse_list(args.buffer, int)
+        http_timeouts = parse_list(args.http_timeout)
+        download_timeouts = parse_list(args.download_timeout)
+        size = parse_size(args.size)
+    except ValueError as e:
+        print(f"❌ {e}")
+        sys.exit(1)
+    if args.image:
+        try:
+            with open(args.image, 'rb') as f:
+                image = f.read()
+        except OSError as e:
+            print(f"❌ 無法讀取映像: {e}")
+            sys.exit(1)
+    else:
+        image = random.Random(args.seed).randbytes(size)
+
+    resume = {'on': (True,), 'off': (False,), 'both': (True, False)}[args.resume]
+    matrix = [{'buffer': b, 'http_timeout': h, 'download_timeout': d, 'resume': r,
+               'retries': args.retries, 'base_delay': args.base_delay}
+              for b, h, d, r in itertools.product(buffers, http_timeouts, download_timeouts, resume)]
+
+    try:
+        results = asyncio.run(run(args, image, links, matrix))
+    except KeyboardInterrupt:
+        sys.exit(1)
+
+    timestamp = datetime.now().isoformat(timespec='seconds')
+    print_report(results)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'timestamp': timestamp, 'image_size': len(image), 'window': args.window,
+                       'sector_ms': args.sector_ms, 'links': links, 'results': results},
+                      f, ensure_ascii=False, indent=2)
+        print(f"\nJSON 已寫入: {args.json}")
+    if args.csv:
+        write_csv(args.csv, results, timestamp)
+        print(f"CSV 已附加: {args.csv}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+"""
+hoRelay 壓縮 OTA 映像 (HOZ) 格式與串流解壓參考實作
+設備端每次只從網路讀取固定大小的緩衝區，解壓後直接交給 Update.write，
+因此解碼器必須能以「輸入、輸出都不超過緩衝區大小」的方式逐段處理
+
+用法:
+  python ota_compress.py compress firmware.bin firmware.bin.hoz
+  python ota_compress.py verify   firmware.bin.hoz --chunk 1024
+  python ota_compress.py decompress firmware.bin.hoz firmware.bin
+
+檔案格式 (所有整數皆為 little-endian，標頭 20 bytes):
+  magic        4 bytes  b'HOZ1'
+  algorithm    u8       1 = raw deflate
+  window_bits  u8       deflate 視窗大小 (2^window_bits bytes)，設備依此配置字典
+  reserved     u16      0
+  raw_size     u32      解壓後大小（即 Update.begin 的大小）
+  packed_size  u32      標頭之後的壓縮資料大小
+  raw_crc32    u32      解壓後資料的 CRC-32（與 esp_rom_crc32_le 相容）
+"""
+
+import sys
+import zlib
+import struct
+import argparse
+
+MAGIC = b'HOZ1'
+ALGO_DEFLATE = 1
+HEADER = struct.Struct('<4sBBHIII')
+# 預設 4 KB 視窗：ESP32-C3 在 OTA 期間還要保留 WiFi/BLE/MQTT 的 heap
+DEFAULT_WINDOW_BITS = 12
+# 與 startFirmwareUpdate 的 uint8_t buff[1024] 相同
+DEFAULT_CHUNK = 1024
+
+class CompressError(Exception):
+    pass
+
+def compress(data, window_bits=DEFAULT_WINDOW_BITS, level=9):
+    """把完整映像壓縮成 HOZ 格式"""
+    if not 9 <= window_bits <= 15:
+        raise CompressError("window_bits 必須介於 9 到 15")
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -window_bits, 9)
+    packed = compressor.compress(data) + compressor.flush()
+    header = HEADER.pack(MAGIC, ALGO_DEFLATE, window_bits, 0,
+                         len(data), len(packed), zlib.crc32(data) & 0xFFFFFFFF)
+    return header + packed
+
+def read_header(data):
+    if len(data) < HEADER.size:
+        raise CompressError("資料太短，無法讀取標頭")
+    magic, algo, window_bits, _, raw_size, packed_size, crc = HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise CompressError("不是 HOZ 壓縮映像")
+    if algo != ALGO_DEFLATE:
+        raise CompressError(f"不支援的壓縮演算法: {algo}")
+    return {
+        'window_bits': window_bits,
+        'raw_size': raw_size,
+        'packed_size': packed_size,
+        'crc32': crc,
+    }
+
+class StreamDecoder:
+    """逐段解壓 HOZ 串流，行為對應設備端的下載迴圈
+
+    每次 feed() 的輸入不得超過 chunk_size，回傳的每段輸出也不超過 chunk_size；
+    尚未處理的輸入會暫存，peak_pending 記錄暫存量的最大值，用來驗證記憶體上限。
+    """
+
+    def __init__(self, chunk_size=DEFAULT_CHUNK):
+        self.chunk_size = chunk_size
+        self.header = None
+        self._header_buf = b''
+        self._inflater = None
+        self._packed_read = 0
+        self.written = 0
+        self.crc = 0
+        self.peak_pending = 0
+
+    def feed(self, data):
+        """送入一段下載資料，回傳可寫入 Update 的輸出段落 list"""
+        if len(data) > self.chunk_size:
+            raise CompressError(f"單次輸入 {len(data)} bytes 超過緩衝區 {self.chunk_size} bytes")
+        if self.header is None:
+            self._header_buf += data
+            if len(self._header_buf) < HEADER.size:
+                return []
+            self.header = read_header(self._header_buf)
+            data = self._header_buf[HEADER.size:]
+            self._header_buf = b''
+            self._inflater = zlib.decompressobj(-self.header['window_bits'])
+
+        self._packed_read += len(data)
+        if self._packed_read > self.header['packed_size']:
+            raise CompressError("壓縮資料超過標頭記錄的大小")
+
+        return self._drain(data)
+
+    def _drain(self, pending):
+        # 每次最多取出 chunk_size bytes；輸出剛好填滿時解壓器內可能還有資料，要再取一次
+        outputs = []
+        while True:
+            out = self._inflater.decompress(pending, self.chunk_size)
+            pending = self._inflater.unconsumed_tail
+            self.peak_pending = max(self.peak_pending, len(pending))
+            if out:
+                self._accept(out)
+                outputs.append(out)
+            if self._inflater.eof and (pending or self._inflater.unused_data):
+                raise CompressError("deflate 串流結束後還有多餘的資料")
+            if len(out) < self.chunk_size and not pending:
+                return outputs
+            if not out and pending:
+                raise CompressError("解壓器無法繼續處理輸入")
+
+    def _accept(self, out):
+        self.written += len(out)
+        if self.written > self.header['raw_size']:
+            raise CompressError("解壓後資料超過標頭記錄的大小")
+        self.crc = zlib.crc32(out, self.crc)
+
+    def finish(self):
+        """所有輸入送完後呼叫，驗證大小與 CRC，回傳剩餘輸出段落"""
+        if self.header is None:
+            raise CompressError("尚未收到完整標頭")
+        outputs = self._drain(b'')
+        if self._packed_read != self.header['packed_size']:
+            raise CompressError(f"壓縮資料大小不符: {self._packed_read} != {self.header['packed_size']}")
+        if not self._inflater.eof:
+            raise CompressError("壓縮資料不完整")
+        # deflate 串流在 packed_size 之前就結束，表示其後是多餘的資料
+        consumed = self._packed_read - len(self._inflater.unused_data)
+        if consumed != self.header['packed_size']:
+            raise CompressError(f"壓縮資料結尾有 {self.header['packed_size'] - consumed} bytes 多餘的資料")
+        if self.written != self.header['raw_size']:
+            raise CompressError(f"解壓大小不符: {self.written} != {self.header['raw_size']}")
+        if (self.crc & 0xFFFFFFFF) != self.header['crc32']:
+            raise CompressError("CRC-32 驗證失敗")
+        return outputs
+
+def decode_stream(stream, chunk_size=DEFAULT_CHUNK):
+    """從檔案物件逐段讀取並解壓，回傳 (完整映像, decoder)"""
+    decoder = StreamDecoder(chunk_size)
+    out = bytearray()
+    while True:
+        data = stream.read(chunk_size)
+        if not data:
+            break
+        for piece in decoder.feed(data):
+            out += piece
+    for piece in decoder.finish():
+        out += piece
+    return bytes(out), decoder
+
+# ── 命令列 ──────────────────────────────────────────────────────────
+
+def main():
+    parser = argparse.ArgumentParser(description='hoRelay 壓縮 OTA 映像工具')
+    sub = parser.add_subparsers(dest='command', required=True)
+    p = sub.add_parser('compress', help='壓縮韌體映像')
+    p.add_argument('input')
+    p.add_argument('output')
+    p.add_argument('--window-bits', type=int, default=DEFAULT_WINDOW_BITS)
+    p = sub.add_parser('decompress', help='以串流方式解壓')
+    p.add_argument('input')
+    p.add_argument('output')
+    p.add_argument('--chunk', type=int, default=DEFAULT_CHUNK)
+    p = sub.add_parser('verify', help='以設備緩衝區大小串流解壓並驗證')
+    p.add_argument('input')
+    p.add_argument('--chunk', type=int, default=DEFAULT_CHUNK)
+    args = parser.parse_args()
+
+    try:
+        if args.command == 'compress':
+            with open(args.input, 'rb') as f:
+                raw = f.read()
+            packed = compress(raw, args.window_bits)
+            with open(args.output, 'wb') as f:
+                f.write(packed)
+            print(f"原始大小: {len(raw)} bytes")
+            print(f"壓縮大小: {len(packed)} bytes ({len(packed) * 100 / max(len(raw), 1):.1f}%)")
+        else:
+            with open(args.input, 'rb') as f:
+                raw, decoder = decode_stream(f, args.chunk)
+            if args.command == 'decompress':
+                with open(args.output, 'wb') as f:
+                    f.write(raw)
+            print(f"✓ 解壓 {len(raw)} bytes，CRC-32 驗證通過")
+            print(f"緩衝區: {args.chunk} bytes，暫存輸入峰值: {decoder.peak_pending} bytes，"
+                  f"字典: {1 << decoder.header['window_bits']} bytes")
+    except CompressError as e:
+        print(f"❌ {e}")
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,264 @@
+#!/usr/bin/env python3
+"""
+hoRelay OTA 差分檔 (HODF) 產生與還原
+發布時對舊版本韌體產生差分檔，設備只需下載差異即可重建新版本完整映像
+
+用法:
+  python ota_delta.py diff  old.bin new.bin out.hodf   # 產生差分檔
+  python ota_delta.py patch old.bin in.hodf out.bin    # 以參考實作還原完整映像
+  python ota_delta.py info  in.hodf                    # 顯示差分檔標頭
+
+檔案格式 (所有整數皆為 little-endian):
+  magic       4 bytes  b'HODF'
+  version     u8       目前為 1
+  flags       u8       bit0 = 指令區以 zlib 壓縮
+  old_size    u32      舊映像大小
+  new_size    u32      新映像大小
+  old_sha256  32 bytes 舊映像雜湊（套用前必須比對，避免套在錯的版本上）
+  new_sha256  32 bytes 新映像雜湊（套用後驗證）
+  指令區      依序排列的指令，數值皆為 unsigned LEB128 varint：
+    0x01 COPY  offset, length        從舊映像 offset 複製 length bytes
+    0x02 ADD   length, data          直接寫入 length bytes
+    0x03 DIFF  offset, length, data  寫入 (data[i] + old[offset+i]) & 0xFF，
+                                     用於位址平移後「幾乎相同」的程式碼區段
+"""
+
+import sys
+import zlib
+import struct
+import hashlib
+import argparse
+
+MAGIC = b'HODF'
+FORMAT_VERSION = 1
+FLAG_ZLIB = 0x01
+HEADER = struct.Struct('<4sBBII32s32s')
+
+OP_COPY = 0x01
+OP_ADD = 0x02
+OP_DIFF = 0x03
+
+# 比對參數：以 16 bytes 為比對視窗，每 4 bytes 建一次索引，至少 24 bytes 相同才值得 COPY
+WINDOW = 16
+INDEX_STEP = 4
+MIN_MATCH = 24
+
+class DeltaError(Exception):
+    pass
+
+# ── varint ──────────────────────────────────────────────────────────
+
+def _put_varint(out, value):
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return
+
+def _get_varint(data, pos):
+    value = 0
+    shift = 0
+    while True:
+        if pos >= len(data):
+            raise DeltaError("指令區意外結束")
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return value, pos
+        shift += 7
+
+# ── 產生差分 ────────────────────────────────────────────────────────
+
+def _match_length(old, old_pos, new, new_pos):
+    """計算 old[old_pos:] 與 new[new_pos:] 由前往後相同的長度"""
+    length = 0
+    max_len = min(len(old) - old_pos, len(new) - new_pos)
+    # 先以 64 bytes 為單位比較，再逐 byte 比較
+    while length + 64 <= max_len and old[old_pos + length:old_pos + length + 64] == new[new_pos + length:new_pos + length + 64]:
+        length += 64
+    while length < max_len and old[old_pos + length] == new[new_pos + length]:
+        length += 1
+    return length
+
+def _emit_literal(ops, old, new, start, end, old_hint):
+    """輸出 new[start:end]；若與舊映像對應位置大多相同則用 DIFF，否則 ADD"""
+    if start >= end:
+        return
+    length = end - start
+    if 0 <= old_hint and old_hint + length <= len(old):
+        diff = bytes((n - o) & 0xFF for n, o in zip(new[start:end], old[old_hint:old_hint + length]))
+        if diff.count(0) * 2 >= length:
+            ops.append(OP_DIFF)
+            _put_varint(ops, old_hint)
+            _put_varint(ops, length)
+            ops += diff
+            return
+    ops.append(OP_ADD)
+    _put_varint(ops, length)
+    ops += new[start:end]
+
+def make_delta(old, new, compress=True):
+    """產生由 old 轉換到 new 的 HODF 差分檔"""
+    old = bytes(old)
+    new = bytes(new)
+
+    index = {}
+    for pos in range(0, len(old) - WINDOW + 1, INDEX_STEP):
+        index.setdefault(old[pos:pos + WINDOW], pos)
+
+    ops = bytearray()
+    literal_start = 0
+    old_cursor = 0  # 上一段 COPY 結束時在舊映像的位置，用來預測下一段對應位置
+    pos = 0
+    end = len(new) - WINDOW
+    while pos <= end:
+        key = new[pos:pos + WINDOW]
+        expected = old_cursor + (pos - literal_start)
+        if old[expected:expected + WINDOW] == key:
+            candidate = expected
+        else:
+            candidate = index.get(key)
+        if candidate is None:
+            pos += 1
+            continue
+
+        length = _match_length(old, candidate, new, pos)
+        # 往回延伸到尚未輸出的 literal 區段
+        back = 0
+        while (pos - back > literal_start and candidate - back > 0
+               and old[candidate - back - 1] == new[pos - back - 1]):
+            back += 1
+        if length + back < MIN_MATCH:
+            pos += 1
+            continue
+
+        copy_start = pos - back
+        copy_old = candidate - back
+        _emit_literal(ops, old, new, literal_start, copy_start, old_cursor)
+        ops.append(OP_COPY)
+        _put_varint(ops, copy_old)
+        _put_varint(ops, length + back)
+        pos = copy_start + length + back
+        literal_start = pos
+        old_cursor = copy_old + length + back
+
+    _emit_literal(ops, old, new, literal_start, len(new), old_cursor)
+
+    flags = 0
+    body = bytes(ops)
+    if compress:
+        body = zlib.compress(body, 9)
+        flags |= FLAG_ZLIB
+    header = HEADER.pack(MAGIC, FORMAT_VERSION, flags, len(old), len(new),
+                         hashlib.sha256(old).digest(), hashlib.sha256(new).digest())
+    return header + body
+
+# ── 套用差分（參考實作）─────────────────────────────────────────────
+
+def read_header(patch):
+    if len(patch) < HEADER.size:
+        raise DeltaError("差分檔太短")
+    magic, version, flags, old_size, new_size, old_hash, new_hash = HEADER.unpack_from(patch)
+    if magic != MAGIC:
+        raise DeltaError("不是 HODF 差分檔")
+    if version != FORMAT_VERSION:
+        raise DeltaError(f"不支援的差分檔版本: {version}")
+    return {
+        'flags': flags,
+        'old_size': old_size,
+        'new_size': new_size,
+        'old_sha256': old_hash.hex(),
+        'new_sha256': new_hash.hex(),
+    }
+
+def apply_delta(old, patch):
+    """以 old 套用差分檔，回傳新映像；大小或雜湊不符時拋出 DeltaError"""
+    header = read_header(patch)
+    old = bytes(old)
+    if len(old) != header['old_size'] or hashlib.sha256(old).hexdigest() != header['old_sha256']:
+        raise DeltaError("舊映像與差分檔不符")
+
+    body = patch[HEADER.size:]
+    if header['flags'] & FLAG_ZLIB:
+        body = zlib.decompress(body)
+
+    out = bytearray()
+    pos = 0
+    while pos < len(body):
+        op = body[pos]
+        pos += 1
+        if op == OP_COPY:
+            offset, pos = _get_varint(body, pos)
+            length, pos = _get_varint(body, pos)
+            if offset + length > len(old):
+                raise DeltaError("COPY 超出舊映像範圍")
+            out += old[offset:offset + length]
+        elif op == OP_ADD:
+            length, pos = _get_varint(body, pos)
+            if pos + length > len(body):
+                raise DeltaError("ADD 資料不完整")
+            out += body[pos:pos + length]
+            pos += length
+        elif op == OP_DIFF:
+            offset, pos = _get_varint(body, pos)
+            length, pos = _get_varint(body, pos)
+            if offset + length > len(old) or pos + length > len(body):
+                raise DeltaError("DIFF 超出範圍")
+            out += bytes((d + o) & 0xFF for d, o in zip(body[pos:pos + length], old[offset:offset + length]))
+            pos += length
+        else:
+            raise DeltaError(f"未知的指令: 0x{op:02x}")
+        if len(out) > header['new_size']:
+            raise DeltaError("輸出超過新映像大小")
+
+    if len(out) != header['new_size'] or hashlib.sha256(out).hexdigest() != header['new_sha256']:
+        raise DeltaError("還原後的映像雜湊不符")
+    return bytes(out)
+
+# ── 命令列 ──────────────────────────────────────────────────────────
+
+def _read(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+def main():
+    parser = argparse.ArgumentParser(description='hoRelay OTA 差分檔工具')
+    sub = parser.add_subparsers(dest='command', required=True)
+    p = sub.add_parser('diff', help='產生差分檔')
+    p.add_argument('old')
+    p.add_argument('new')
+    p.add_argument('out')
+    p = sub.add_parser('patch', help='套用差分檔還原完整映像')
+    p.add_argument('old')
+    p.add_argument('patch')
+    p.add_argument('out')
+    p = sub.add_parser('info', help='顯示差分檔標頭')
+    p.add_argument('patch')
+    args = parser.parse_args()
+
+    try:
+        if args.command == 'diff':
+            old, new = _read(args.old), _read(args.new)
+            patch = make_delta(old, new)
+            with open(args.out, 'wb') as f:
+                f.write(patch)
+            print(f"完整映像: {len(new)} bytes")
+            print(f"差分檔:   {len(patch)} bytes ({len(patch) * 100 / max(len(new), 1):.1f}%)")
+        elif args.command == 'patch':
+            new = apply_delta(_read(args.old), _read(args.patch))
+            with open(args.out, 'wb') as f:
+                f.write(new)
+            print(f"✓ 已還原 {len(new)} bytes，雜湊驗證通過")
+        elif args.command == 'info':
+            for key, value in read_header(_read(args.patch)).items():
+                print(f"{key}: {value}")
+    except DeltaError as e:
+        print(f"❌ {e}")
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
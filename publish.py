@@ -7,18 +7,36 @@ hoRelay 韌體發布自動化腳本（支援 hoRelay1～3）
   python publish.py 2                     # 發布 hoRelay2
   python publish.py 3 -c "修正 WiFi 問題"  # 發布 hoRelay3 並附更新說明
   python publish.py 1 -y                   # 發布 hoRelay1 並跳過確認
+  python publish.py 2 --resume             # 上次發布中途失敗時，沿用同一版本從中斷處繼續
+  python publish.py all                    # 依序發布全部型號（編譯下一個型號時同時上傳上一個）
+  python publish.py 1,3 -c "修正排程"       # 只發布 hoRelay1 與 hoRelay3
 """
 
 import os
 import sys
 import subprocess
+import io
 import json
 import re
 import argparse
 from pathlib import Path
 from datetime import datetime
 import shutil
-import platform
+import tempfile
+import time
+import threading
+import urllib.request
+import hashlib
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import build_cache
+import cloud_clients
+import firmware_size
+import ota_compress
+import ota_delta
+import release_journal
+import stack_usage
+import toolchain
 
 # ── 每個型號的硬體設定 ──────────────────────────────────────────────
 
@@ -39,15 +57,24 @@ MODEL_CONFIGS = {
             {'model': 'hoRelay2',   'relay_pin': 4},  # 舊版
             {'model': 'hoRelay2-1', 'relay_pin': 7},  # 新版
         ],
+        # 大小預算（bytes，見 firmware_size.check_budget）：C3 同時啟用 BLE 與 WiFi，
+        # 映像已接近 0x1F0000 的 OTA 分區，單一版本成長上限比預設的 64 KB 更嚴
+        'size_budget': {'growth': 32 * 1024},
     },
     3: {
         'dir': 'ho_relay3',
         'ino': 'ho_relay3.ino',
         'fqbn': 'esp32:esp32:esp32c3:CDCOnBoot=cdc,CPUFreq=160,DebugLevel=error,EraseFlash=all,FlashFreq=80,FlashMode=dio,FlashSize=4M,JTAGAdapter=default,PartitionScheme=custom,UploadSpeed=921600,ZigbeeMode=default',
         'label': 'hoRelay v3.0 齁斑自製電路板',
+        'size_budget': {'growth': 32 * 1024},
     },
 }
 
+STACK_USAGE_FLAG = '-fstack-usage'
+
+# 保留的 arduino-cli build path，增量編譯時另有核心快取（每個型號/FQBN/變體各一份）
+INCREMENTAL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'build', 'work')
+
 # ── 終端顏色 ────────────────────────────────────────────────────────
 
 class Colors:
@@ -74,35 +101,15 @@ def print_header(title):
 # ── 工具檢查 ────────────────────────────────────────────────────────
 
 def get_arduino_cli_path():
-    if platform.system() == 'Windows':
-        common_paths = [
-            r'C:\Program Files\Arduino CLI\arduino-cli.exe',
-            r'C:\Program Files (x86)\Arduino CLI\arduino-cli.exe',
-            os.path.expandvars(r'%LOCALAPPDATA%\Arduino15\arduino-cli.exe'),
-            os.path.expandvars(r'%USERPROFILE%\AppData\Local\Programs\Arduino CLI\arduino-cli.exe'),
-        ]
-        for path in common_paths:
-            if os.path.exists(path):
-                return path
-    return 'arduino-cli'
+    return toolchain.which('arduino-cli') or 'arduino-cli'
 
 def check_command(command):
-    if command == 'arduino-cli':
-        path = get_arduino_cli_path()
-        if platform.system() == 'Windows' and path.endswith('.exe'):
-            return os.path.exists(path)
-    if command == 'gh' and platform.system() == 'Windows':
-        gh_path = r'C:\Program Files\GitHub CLI\gh.exe'
-        if os.path.exists(gh_path):
-            return True
-    return shutil.which(command) is not None
+    """工具是否存在；位置記錄在 build/toolchain.json，執行檔未變動時不重新搜尋"""
+    return toolchain.which(command) is not None
 
 def check_requirements():
     print_header("檢查必要工具")
-    requirements = {
-        'arduino-cli': 'https://arduino.github.io/arduino-cli/',
-        'firebase': 'npm install -g firebase-tools'
-    }
+    requirements = {name: spec['install'] for name, spec in toolchain.TOOLS.items() if spec['required']}
     all_installed = True
     for cmd, install_guide in requirements.items():
         if check_command(cmd):
@@ -187,8 +194,24 @@ def get_firmware_info(project_dir, ino_file, cfg=None):
 
 # ── 編譯韌體 ────────────────────────────────────────────────────────
 
-def build_firmware(project_dir, fqbn, model, variant=None):
-    print_header(f"編譯韌體: {model}")
+def _log(log, message, color=Colors.WHITE):
+    """log 為 list 時先暫存訊息（平行編譯時依變體分組輸出），否則直接印出"""
+    if log is None:
+        print_color(message, color)
+    else:
+        log.append((message, color))
+
+def incremental_paths(project_dir, fqbn, model):
+    """回傳 (build_path, core_cache_path)，同一組型號/FQBN/變體每次都對應同一個目錄"""
+    fqbn_hash = hashlib.sha256(fqbn.encode('utf-8')).hexdigest()[:10]
+    name = f"{os.path.basename(os.path.normpath(project_dir))}-{model}_{fqbn_hash}"
+    base = os.path.join(INCREMENTAL_DIR, name)
+    return os.path.join(base, 'sketch'), os.path.join(base, 'core-cache')
+
+def build_firmware(project_dir, fqbn, model, variant=None, work_dir=None, log=None,
+                   use_cache=True, incremental=False):
+    if log is None:
+        print_header(f"編譯韌體: {model}")
     build_path = os.path.join(project_dir, 'build', model) if variant else os.path.join(project_dir, 'build')
 
     # 清空並重建 build 目錄，避免殘留舊的 .bin 檔案
@@ -196,43 +219,204 @@ def build_firmware(project_dir, fqbn, model, variant=None):
         shutil.rmtree(build_path)
     os.makedirs(build_path)
 
-    print_color(f"FQBN: {fqbn}", Colors.GRAY)
+    _log(log, f"FQBN: {fqbn}", Colors.GRAY)
+
+    # 如果有變體定義，透過編譯旗標指定 GPIO（型號由 .ino 根據 RELAY_PIN 自動決定）
+    # -fstack-usage 讓 gcc 為每個物件檔輸出 .su，供 stack_usage 分析堆疊深度（不影響產出的程式碼）
+    extra_flags = [STACK_USAGE_FLAG]
+    if variant:
+        extra_flags.insert(0, f'-DRELAY_PIN={variant["relay_pin"]}')
+    extra_flag = ' '.join(extra_flags)
+    build_properties = [
+        f'compiler.cpp.extra_flags={extra_flag}',
+        f'compiler.c.extra_flags={extra_flag}',
+    ]
+    _log(log, f"編譯旗標: {extra_flag}", Colors.GRAY)
 
-    # 組合編譯指令
     cli = get_arduino_cli_path()
+
+    # 原始碼、FQBN、編譯屬性與工具鏈版本都相同時，直接重用快取的 .bin
+    cache_key = None
+    if use_cache:
+        tool_version = build_cache.toolchain_version(cli, fqbn)
+        cache_key = build_cache.compute_key(project_dir, fqbn, build_properties, tool_version)
+        cached_bin = build_cache.lookup(cache_key, build_path)
+        if cached_bin:
+            file_size = os.path.getsize(cached_bin) / 1024
+            _log(log, f"✓ {model} 使用編譯快取 ({cache_key[:12]}): {os.path.basename(cached_bin)}", Colors.GREEN)
+            _log(log, f"檔案大小: {file_size:.2f} KB", Colors.WHITE)
+            return cached_bin
+
+    # 組合編譯指令
     cmd = [cli, 'compile', '--fqbn', fqbn, '--output-dir', build_path]
 
-    # 如果有變體定義，透過編譯旗標指定 GPIO（型號由 .ino 根據 RELAY_PIN 自動決定）
-    if variant:
-        extra_flag = f'-DRELAY_PIN={variant["relay_pin"]}'
-        cmd += [
-            '--build-property', f'compiler.cpp.extra_flags={extra_flag}',
-            '--build-property', f'compiler.c.extra_flags={extra_flag}',
-        ]
-        print_color(f"編譯旗標: {extra_flag}", Colors.GRAY)
+    # 增量編譯：沿用固定的 build path 與核心快取，只重編有變動的物件檔，
+    # 最終產物仍由 --output-dir 複製到清空過的 build 目錄
+    env = None
+    if incremental:
+        work_dir, core_cache = incremental_paths(project_dir, fqbn, model)
+        os.makedirs(work_dir, exist_ok=True)
+        os.makedirs(core_cache, exist_ok=True)
+        env = dict(os.environ, ARDUINO_BUILD_CACHE_PATH=core_cache)
+        # 草稿碼的物件檔每次都重編（很快），改名或刪除的原始檔不會留下舊的 .su；
+        # 核心與函式庫仍沿用
+        shutil.rmtree(os.path.join(work_dir, 'sketch'), ignore_errors=True)
+        _log(log, f"增量編譯目錄: {work_dir}", Colors.GRAY)
+
+    # 指定 build path 編譯後才找得到 .su；非增量編譯用一次性的暫存目錄，
+    # 只會收集到這次編譯產生的 .su（平行編譯時由呼叫端傳入各變體自己的暫存目錄）
+    temp_work_dir = None
+    if not work_dir:
+        work_dir = temp_work_dir = tempfile.mkdtemp(prefix=f"hoctrl-{model}-")
+    cmd += ['--build-path', work_dir]
+
+    for prop in build_properties:
+        cmd += ['--build-property', prop]
 
     cmd.append(project_dir)
-    print_color("正在編譯...", Colors.YELLOW)
+    _log(log, "正在編譯...", Colors.YELLOW)
 
     try:
-        res = subprocess.run(cmd, encoding='utf-8', errors='ignore')
+        if log is None:
+            # 邊編譯邊印出，同時保留輸出以擷取結尾的大小摘要
+            proc = subprocess.Popen(cmd, encoding='utf-8', errors='ignore', env=env,
+                                    stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+            output = []
+            for line in proc.stdout:
+                print(line, end='')
+                output.append(line)
+            res = subprocess.CompletedProcess(cmd, proc.wait(), ''.join(output))
+        else:
+            res = subprocess.run(cmd, encoding='utf-8', errors='ignore', env=env,
+                                 stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+            for line in (res.stdout or '').splitlines():
+                _log(log, line, Colors.GRAY)
         if res.returncode != 0:
-            print_color(f"❌ {model} 編譯失敗", Colors.RED)
+            _log(log, f"❌ {model} 編譯失敗", Colors.RED)
             return None
 
         bin_files = list(Path(build_path).glob('*.bin'))
         if not bin_files:
-            print_color(f"❌ 找不到 {model} 編譯後的 .bin 檔案", Colors.RED)
+            _log(log, f"❌ 找不到 {model} 編譯後的 .bin 檔案", Colors.RED)
             return None
 
         bin_file = bin_files[0]
         file_size = bin_file.stat().st_size / 1024
-        print_color(f"✓ {model} 編譯成功: {bin_file.name}", Colors.GREEN)
-        print_color(f"檔案大小: {file_size:.2f} KB", Colors.WHITE)
+        _log(log, f"✓ {model} 編譯成功: {bin_file.name}", Colors.GREEN)
+        _log(log, f"檔案大小: {file_size:.2f} KB", Colors.WHITE)
+        sketch_name = bin_file.name[:-len('.bin')]
+        firmware_size.save_cli_summary(build_path, sketch_name, res.stdout)
+        stack_usage.collect(work_dir, build_path, sketch_name)
+
+        if cache_key:
+            try:
+                build_cache.store(cache_key, build_path, {'model': model, 'fqbn': fqbn})
+                build_cache.evict(max_bytes=build_cache.DEFAULT_MAX_BYTES)
+            except OSError as e:
+                _log(log, f"⚠ 寫入編譯快取失敗: {e}", Colors.YELLOW)
         return str(bin_file)
     except Exception as e:
-        print_color(f"❌ {model} 編譯過程出錯: {e}", Colors.RED)
+        _log(log, f"❌ {model} 編譯過程出錯: {e}", Colors.RED)
         return None
+    finally:
+        if temp_work_dir:
+            shutil.rmtree(temp_work_dir, ignore_errors=True)
+
+def _build_variant_job(project_dir, fqbn, variant, build_opts):
+    """單一變體的平行編譯工作，回傳 (bin_path, 暫存的輸出)"""
+    log = []
+    # 增量模式本身就是每個變體獨立的固定目錄，其餘情況用一次性的暫存目錄
+    work_dir = None if build_opts.get('incremental') else tempfile.mkdtemp(prefix=f"hoctrl-{variant['model']}-")
+    try:
+        bin_path = build_firmware(project_dir, fqbn, variant['model'], variant,
+                                  work_dir=work_dir, log=log, **build_opts)
+    finally:
+        if work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+    return bin_path, log
+
+def build_variants(project_dir, fqbn, variants, jobs=1, **build_opts):
+    """編譯所有硬體變體，回傳 {model: bin_path}（失敗者為 None）
+
+    jobs > 1 時以執行緒池同時執行多個 arduino-cli，每個變體各自一個 build 目錄，
+    編譯輸出會暫存，待該變體完成後再整段印出，避免多個變體的訊息交錯。
+    build_opts 會原樣傳給 build_firmware（use_cache、incremental）。
+    """
+    jobs = min(jobs, len(variants))
+    if jobs <= 1:
+        results = {}
+        for variant in variants:
+            results[variant['model']] = build_firmware(project_dir, fqbn, variant['model'], variant,
+                                                       **build_opts)
+            if not results[variant['model']]:
+                break
+        return results
+
+    print_header(f"平行編譯 {len(variants)} 個變體（同時 {jobs} 個）")
+    results = {}
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        futures = {
+            pool.submit(_build_variant_job, project_dir, fqbn, variant, build_opts): variant
+            for variant in variants
+        }
+        for future in as_completed(futures):
+            vmodel = futures[future]['model']
+            bin_path, log = future.result()
+            print_color(f"{'─'*50}", Colors.CYAN)
+            print_color(f"  編譯輸出: {vmodel}", Colors.CYAN)
+            print_color(f"{'─'*50}", Colors.CYAN)
+            for message, color in log:
+                print_color(message, color)
+            results[vmodel] = bin_path
+    return results
+
+# ── 大小與堆疊預算 ──────────────────────────────────────────────────
+
+def check_firmware_size(project_dir, cfg, model, bin_path, version, allow_growth=False):
+    """檢查映像是否放得進 OTA 分區並符合預算，結果附加到 build/size_history.jsonl
+
+    放不進 OTA 分區（含保留空間）一律失敗；allow_growth 只放寬相對上一版的成長上限。
+    """
+    print_header(f"大小檢查: {model}")
+    budget = dict(cfg.get('size_budget') or {})
+    if allow_growth:
+        budget['growth'] = float('inf')
+    try:
+        report, previous, failures = firmware_size.check_build(
+            os.path.dirname(bin_path), model, version,
+            os.path.join(project_dir, 'partitions.csv'), budget)
+    except (firmware_size.SizeError, OSError) as e:
+        print_color(f"❌ 無法分析韌體大小: {e}", Colors.RED)
+        return False
+    for line in firmware_size.format_report(report, previous):
+        print_color(line, Colors.WHITE)
+    if previous:
+        for name, old, new in firmware_size.library_diff(report, previous, limit=5):
+            print_color(f"  {name:<28} {new - old:+,} bytes", Colors.GRAY)
+    for failure in failures:
+        print_color(f"❌ {failure}", Colors.RED)
+    if not failures:
+        print_color("✓ 大小檢查通過", Colors.GREEN)
+    return not failures
+
+def check_stack_usage(model, bin_path):
+    """以 .su 與反組譯的呼叫圖計算各入口最壞堆疊深度；超過執行緒堆疊大小時回傳 False
+
+    沒有 .su 摘要（例如快取中的舊編譯結果）時只提示並視為通過。
+    """
+    print_header(f"堆疊檢查: {model}")
+    try:
+        report = stack_usage.analyze(os.path.dirname(bin_path))
+    except stack_usage.StackError as e:
+        print_color(f"⚠ 略過堆疊檢查: {e}", Colors.YELLOW)
+        return True
+    for line in stack_usage.format_report(report):
+        color = Colors.RED if line.startswith('❌') else Colors.YELLOW if line.startswith('⚠') else Colors.WHITE
+        print_color(line, color)
+    overflow = stack_usage.over_limit(report)
+    if overflow:
+        print_color(f"❌ {', '.join(overflow)} 的最壞堆疊深度超過執行緒堆疊大小", Colors.RED)
+    return not overflow
 
 # ── 上傳韌體 ────────────────────────────────────────────────────────
 
@@ -246,99 +430,78 @@ def get_firebase_project_id():
         print_color(f"⚠ 無法讀取 Firebase 專案 ID: {e}", Colors.YELLOW)
         return None
 
-def upload_to_firebase(bin_path, project_dir, model, version, changelog="更新"):
-    print_header("上傳韌體")
+# 每個 tag 一把鎖：多個變體/附加檔同時上傳到同一個 release 時，
+# 「release view → release create」必須一次只有一個執行緒，否則會重複建立同一個 release
+_github_tag_locks = {}
+_github_tag_locks_guard = threading.Lock()
 
-    file_name = f"{model}_v{version}.bin"
-    storage_path = f"firmware/{model}/{file_name}"
+def _github_tag_lock(repo, tag_name):
+    with _github_tag_locks_guard:
+        return _github_tag_locks.setdefault((repo, tag_name), threading.Lock())
 
-    print_color(f"上傳檔案: {file_name}", Colors.YELLOW)
-
-    # 方法1: 使用 GitHub Releases (優先)
-    if check_command('gh'):
-        try:
-            print_color("使用 GitHub Releases 上傳...", Colors.YELLOW)
-            gh_cmd = r'C:\Program Files\GitHub CLI\gh.exe' if platform.system() == 'Windows' else 'gh'
-            repo = os.getenv('GITHUB_REPO', 'maotou316/hoctrl-firmware')
-            tag_name = f"v{version}"
-
-            build_dir = os.path.join(project_dir, 'build')
-            renamed_file = os.path.join(build_dir, f'{model}_v{version}.bin')
-            if bin_path != renamed_file and not os.path.exists(renamed_file):
-                shutil.copy(bin_path, renamed_file)
-                bin_path = renamed_file
-            elif os.path.exists(renamed_file):
-                bin_path = renamed_file
-
-            print_color(f"Repository: {repo}", Colors.GRAY)
-            print_color(f"Tag: {tag_name}", Colors.GRAY)
-
-            check_cmd = [gh_cmd, 'release', 'view', tag_name, '--repo', repo]
-            check_res = subprocess.run(check_cmd, capture_output=True, text=True)
-
-            if check_res.returncode == 0:
-                print_color(f"Release {tag_name} 已存在，上傳檔案...", Colors.GRAY)
-                upload_cmd = [
-                    gh_cmd, 'release', 'upload', tag_name,
-                    bin_path, '--clobber', '--repo', repo
-                ]
-            else:
-                print_color(f"建立新 Release {tag_name}...", Colors.GRAY)
-                upload_cmd = [
-                    gh_cmd, 'release', 'create', tag_name,
-                    bin_path,
-                    '--title', f"{model} v{version}",
-                    '--notes', f"韌體版本 {version}\n\n{changelog}",
-                    '--repo', repo
-                ]
-
-            res = subprocess.run(upload_cmd, capture_output=True, text=True)
-            if res.returncode == 0:
-                uploaded_file_name = f"{model}_v{version}.bin"
-                download_url = f"https://github.com/{repo}/releases/download/{tag_name}/{uploaded_file_name}"
-                print_color("✓ 上傳成功", Colors.GREEN)
-                print_color(f"下載 URL: {download_url}", Colors.WHITE)
-                return download_url
-            else:
-                print_color(f"GitHub 上傳失敗: {res.stderr}", Colors.RED)
-        except Exception as e:
-            print_color(f"GitHub Releases 上傳失敗: {e}", Colors.YELLOW)
+def _upload_github(bin_path, project_dir, model, version, changelog, file_name):
+    """上傳到 GitHub Releases，成功回傳下載 URL"""
+    repo = os.getenv('GITHUB_REPO', 'maotou316/hoctrl-firmware')
+    with _github_tag_lock(repo, f"v{version}"):
+        return _upload_github_locked(bin_path, project_dir, model, version, changelog, file_name, repo)
 
-    # 方法2: 使用 Python 直接上傳到 Firebase Storage
+def _upload_github_locked(bin_path, project_dir, model, version, changelog, file_name, repo):
     try:
-        from google.cloud import storage
-        from google.oauth2 import service_account
-
-        service_account_path = _find_service_account_key(project_dir)
-
-        if service_account_path:
-            print_color(f"使用 Service Account: {service_account_path}", Colors.GRAY)
-            credentials = service_account.Credentials.from_service_account_file(
-                service_account_path
-            )
-            storage_client = storage.Client(credentials=credentials, project='hoctrl')
+        print_color("使用 GitHub Releases 上傳...", Colors.YELLOW)
+        gh_cmd = toolchain.which('gh') or 'gh'
+        tag_name = f"v{version}"
+
+        # gh 以檔名作為 asset 名稱；每次都以 bin_path 覆寫，避免上傳上次留下的舊映像
+        build_dir = os.path.join(project_dir, 'build')
+        renamed_file = os.path.join(build_dir, file_name)
+        if os.path.abspath(bin_path) != os.path.abspath(renamed_file):
+            os.makedirs(build_dir, exist_ok=True)
+            tmp = renamed_file + '.tmp'
+            shutil.copyfile(bin_path, tmp)
+            os.replace(tmp, renamed_file)
+            bin_path = renamed_file
+
+        print_color(f"Repository: {repo}", Colors.GRAY)
+        print_color(f"Tag: {tag_name}", Colors.GRAY)
+
+        check_cmd = [gh_cmd, 'release', 'view', tag_name, '--repo', repo]
+        check_res = subprocess.run(check_cmd, capture_output=True, text=True)
+
+        if check_res.returncode == 0:
+            print_color(f"Release {tag_name} 已存在，上傳檔案...", Colors.GRAY)
+            upload_cmd = [
+                gh_cmd, 'release', 'upload', tag_name,
+                bin_path, '--clobber', '--repo', repo
+            ]
         else:
-            print_color("嘗試使用預設認證...", Colors.GRAY)
-            storage_client = storage.Client(project='hoctrl')
+            print_color(f"建立新 Release {tag_name}...", Colors.GRAY)
+            upload_cmd = [
+                gh_cmd, 'release', 'create', tag_name,
+                bin_path,
+                '--title', f"{model} v{version}",
+                '--notes', f"韌體版本 {version}\n\n{changelog}",
+                '--repo', repo
+            ]
+
+        res = subprocess.run(upload_cmd, capture_output=True, text=True)
+        if res.returncode == 0:
+            download_url = f"https://github.com/{repo}/releases/download/{tag_name}/{file_name}"
+            print_color("✓ 上傳成功", Colors.GREEN)
+            print_color(f"下載 URL: {download_url}", Colors.WHITE)
+            return download_url
+        else:
+            print_color(f"GitHub 上傳失敗: {res.stderr}", Colors.RED)
+    except Exception as e:
+        print_color(f"GitHub Releases 上傳失敗: {e}", Colors.YELLOW)
+    return None
 
-        bucket_name = 'hoctrl.firebasestorage.app'
-        try:
-            bucket = storage_client.get_bucket(bucket_name)
-            print_color(f"使用現有 bucket: {bucket_name}", Colors.GRAY)
-        except Exception:
-            print_color(f"Bucket {bucket_name} 不存在，正在建立...", Colors.YELLOW)
-            try:
-                bucket = storage_client.create_bucket(bucket_name, location='asia-east1')
-                print_color("✓ Bucket 建立成功", Colors.GREEN)
-            except Exception as create_error:
-                print_color(f"建立 bucket 失敗: {create_error}", Colors.YELLOW)
-                bucket_name = 'hoctrl.appspot.com'
-                print_color(f"嘗試使用預設 bucket: {bucket_name}", Colors.GRAY)
-                try:
-                    bucket = storage_client.get_bucket(bucket_name)
-                except Exception:
-                    bucket = storage_client.create_bucket(bucket_name, location='asia-east1')
-                    print_color("✓ 預設 bucket 建立成功", Colors.GREEN)
+def _upload_storage_client(bin_path, project_dir, model, version, changelog, file_name):
+    """使用 Python 直接上傳到 Firebase Storage，成功回傳下載 URL"""
+    storage_path = f"firmware/{model}/{file_name}"
+    try:
+        print_color(cloud_clients.describe('storage', project_dir), Colors.GRAY)
+        bucket = cloud_clients.get_bucket(project_dir)
+        print_color(f"使用 bucket: {bucket.name}", Colors.GRAY)
 
         print_color("正在上傳...", Colors.YELLOW)
         blob = bucket.blob(storage_path)
@@ -353,31 +516,108 @@ def upload_to_firebase(bin_path, project_dir, model, version, changelog="更新"
         print_color("⚠ 未安裝 google-cloud-storage", Colors.YELLOW)
     except Exception as e:
         print_color(f"⚠ Firebase Storage 上傳失敗: {e}", Colors.YELLOW)
+        if cloud_clients.is_not_found(e):
+            # 記錄的 bucket 已不存在，下次上傳重新探測
+            cloud_clients.forget_bucket()
         if os.getenv('DEBUG'):
             import traceback
             traceback.print_exc()
+    return None
 
-    # 方法3: 使用 gsutil
-    if check_command('gsutil'):
-        bucket = "gs://hoctrl.firebasestorage.app"
-        try:
-            print_color("使用 gsutil 上傳...", Colors.YELLOW)
-            subprocess.run(
-                ['gsutil', 'cp', bin_path, f"{bucket}/{storage_path}"],
-                check=True
-            )
-            subprocess.run(
-                ['gsutil', 'acl', 'ch', '-u', 'AllUsers:R', f"{bucket}/{storage_path}"],
-                check=True
-            )
-            download_url = f"https://storage.googleapis.com/hoctrl.firebasestorage.app/{storage_path}"
-            print_color("✓ 上傳成功", Colors.GREEN)
-            print_color(f"下載 URL: {download_url}", Colors.WHITE)
+def _upload_gsutil(bin_path, project_dir, model, version, changelog, file_name):
+    """使用 gsutil 上傳，成功回傳下載 URL"""
+    storage_path = f"firmware/{model}/{file_name}"
+    bucket = "gs://hoctrl.firebasestorage.app"
+    try:
+        print_color("使用 gsutil 上傳...", Colors.YELLOW)
+        subprocess.run(
+            ['gsutil', 'cp', bin_path, f"{bucket}/{storage_path}"],
+            check=True
+        )
+        subprocess.run(
+            ['gsutil', 'acl', 'ch', '-u', 'AllUsers:R', f"{bucket}/{storage_path}"],
+            check=True
+        )
+        download_url = f"https://storage.googleapis.com/hoctrl.firebasestorage.app/{storage_path}"
+        print_color("✓ 上傳成功", Colors.GREEN)
+        print_color(f"下載 URL: {download_url}", Colors.WHITE)
+        return download_url
+    except subprocess.CalledProcessError as e:
+        print_color(f"❌ 上傳失敗: {e}", Colors.RED)
+    return None
+
+def _upload_local(bin_path, project_dir, model, version, changelog, file_name):
+    """複製到本機鏡像目錄（HOCTRL_LOCAL_MIRROR），URL 前綴由 HOCTRL_LOCAL_MIRROR_URL 指定"""
+    mirror_dir = os.getenv('HOCTRL_LOCAL_MIRROR')
+    try:
+        dest_dir = os.path.join(mirror_dir, 'firmware', model)
+        os.makedirs(dest_dir, exist_ok=True)
+        dest = os.path.join(dest_dir, file_name)
+        tmp = dest + '.tmp'
+        shutil.copyfile(bin_path, tmp)
+        os.replace(tmp, dest)
+        base_url = os.getenv('HOCTRL_LOCAL_MIRROR_URL')
+        if base_url:
+            download_url = f"{base_url.rstrip('/')}/firmware/{model}/{file_name}"
+        else:
+            download_url = Path(dest).resolve().as_uri()
+        print_color(f"✓ 已複製到本機鏡像: {dest}", Colors.GREEN)
+        return download_url
+    except OSError as e:
+        print_color(f"❌ 本機鏡像複製失敗: {e}", Colors.RED)
+    return None
+
+# 上傳目的地：依序為逐一備援時的嘗試順序；新增目的地只要在此加入一筆
+# upload(bin_path, project_dir, model, version, changelog, file_name) -> URL 或 None
+UPLOAD_BACKENDS = {
+    'github': {
+        'label': 'GitHub Releases',
+        'available': lambda: check_command('gh'),
+        'upload': _upload_github,
+    },
+    'storage': {
+        'label': 'Firebase Storage (Python)',
+        'available': cloud_clients.storage_available,
+        'upload': _upload_storage_client,
+    },
+    'gsutil': {
+        'label': 'gsutil',
+        'available': lambda: check_command('gsutil'),
+        'upload': _upload_gsutil,
+    },
+    'local': {
+        'label': '本機鏡像',
+        'available': lambda: bool(os.getenv('HOCTRL_LOCAL_MIRROR')),
+        'upload': _upload_local,
+    },
+}
+
+# 逐一備援模式的嘗試順序（本機鏡像只在鏡像模式或明確指定時使用）
+FALLBACK_ORDER = ['github', 'storage', 'gsutil']
+
+def upload_to_firebase(bin_path, project_dir, model, version, changelog="更新",
+                       file_name=None, allow_manual=True):
+    print_header("上傳韌體")
+
+    file_name = file_name or f"{model}_v{version}.bin"
+    storage_path = f"firmware/{model}/{file_name}"
+
+    print_color(f"上傳檔案: {file_name}", Colors.YELLOW)
+
+    # 方法1～3: GitHub Releases → Firebase Storage → gsutil，前一個失敗才試下一個
+    for name in FALLBACK_ORDER:
+        backend = UPLOAD_BACKENDS[name]
+        # Python Storage 客戶端未安裝時仍呼叫一次，讓它印出提示
+        if name != 'storage' and not backend['available']():
+            continue
+        download_url = backend['upload'](bin_path, project_dir, model, version, changelog, file_name)
+        if download_url:
             return download_url
-        except subprocess.CalledProcessError as e:
-            print_color(f"❌ 上傳失敗: {e}", Colors.RED)
 
     # 方法4: 手動上傳提示
+    if not allow_manual:
+        print_color(f"⚠ {file_name} 自動上傳失敗，略過", Colors.YELLOW)
+        return None
     print_color("\n⚠ 自動上傳失敗，請手動上傳", Colors.YELLOW)
     print_color(f"\n檔案位置: {os.path.abspath(bin_path)}", Colors.CYAN)
     print_color(f"Firebase Storage 路徑: {storage_path}", Colors.CYAN)
@@ -393,38 +633,238 @@ def upload_to_firebase(bin_path, project_dir, model, version, changelog="更新"
     download_url = input("\n請輸入下載 URL (或直接按 Enter 使用預期的 URL): ").strip()
     return download_url if download_url else default_url
 
-# ── Firestore 更新 ──────────────────────────────────────────────────
+def file_sha256(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(65536), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+def verify_remote(url, expected_sha256, attempts=3, timeout=60):
+    """下載遠端檔案計算 SHA-256，與本機檔案相符回傳 True"""
+    for attempt in range(attempts):
+        if attempt:
+            time.sleep(2 * attempt)  # CDN 剛上傳的檔案可能還沒生效
+        try:
+            h = hashlib.sha256()
+            with urllib.request.urlopen(url, timeout=timeout) as res:
+                for chunk in iter(lambda: res.read(65536), b''):
+                    h.update(chunk)
+            if h.hexdigest() == expected_sha256:
+                return True
+        except (OSError, ValueError):
+            pass
+    return False
 
-def _find_service_account_key(project_dir):
-    """在多個位置搜尋 serviceAccountKey.json"""
-    candidates = [
-        os.path.join(project_dir, 'serviceAccountKey.json'),
-        os.path.join('..', 'hoctrl', 'serviceAccountKey.json'),
-    ]
-    for path in candidates:
-        if os.path.exists(path):
-            return path
-    return None
+def upload_to_mirrors(bin_path, project_dir, model, version, changelog, names, file_name=None):
+    """同時上傳到多個目的地並逐一以 SHA-256 驗證，回傳驗證通過的 URL list（依 names 順序）"""
+    file_name = file_name or f"{model}_v{version}.bin"
+    print_header(f"鏡像上傳: {file_name}")
+    names = [n for n in names if UPLOAD_BACKENDS[n]['available']()]
+    if not names:
+        print_color("⚠ 沒有可用的上傳目的地", Colors.YELLOW)
+        return []
+    print_color(f"目的地: {', '.join(UPLOAD_BACKENDS[n]['label'] for n in names)}", Colors.GRAY)
+    local_sha256 = file_sha256(bin_path)
+
+    def job(name):
+        url = UPLOAD_BACKENDS[name]['upload'](bin_path, project_dir, model, version, changelog, file_name)
+        return url, bool(url) and verify_remote(url, local_sha256)
+
+    verified = {}
+    with ThreadPoolExecutor(max_workers=len(names)) as pool:
+        futures = {pool.submit(job, name): name for name in names}
+        for future in as_completed(futures):
+            name = futures[future]
+            label = UPLOAD_BACKENDS[name]['label']
+            try:
+                url, ok = future.result()
+            except Exception as e:
+                url, ok = None, False
+                print_color(f"❌ {label} 上傳出錯: {e}", Colors.RED)
+            if ok:
+                verified[name] = url
+                print_color(f"✓ {label} SHA-256 驗證通過", Colors.GREEN)
+            elif url:
+                print_color(f"❌ {label} SHA-256 驗證失敗: {url}", Colors.RED)
+            else:
+                print_color(f"❌ {label} 上傳失敗", Colors.RED)
+    return [verified[n] for n in names if n in verified]
 
-def update_firestore(project_dir, model, version, download_url, changelog, min_version):
+def parse_mirrors(value):
+    """解析 --mirrors 參數：'all' 代表所有目的地，否則為逗號分隔的名稱"""
+    if value is None:
+        return None
+    if value == 'all':
+        return list(UPLOAD_BACKENDS)
+    names = [n.strip() for n in value.split(',') if n.strip()]
+    unknown = [n for n in names if n not in UPLOAD_BACKENDS]
+    if unknown:
+        raise argparse.ArgumentTypeError(f"未知的上傳目的地: {', '.join(unknown)}")
+    return names
+
+def upload_artifact(path, project_dir, model, version, changelog, mirrors=None,
+                    file_name=None, allow_manual=True):
+    """上傳一個發布檔案，回傳 (主要 URL, 所有鏡像 URL)
+
+    mirrors 為 None 時沿用逐一備援；否則同時上傳到 mirrors 列出的目的地，
+    以第一個驗證通過的目的地（依 mirrors 順序）作為主要 URL。
+    """
+    if mirrors is None:
+        url = upload_to_firebase(path, project_dir, model, version, changelog,
+                                 file_name=file_name, allow_manual=allow_manual)
+        return url, [url] if url else []
+    urls = upload_to_mirrors(path, project_dir, model, version, changelog, mirrors, file_name)
+    return (urls[0] if urls else None), urls
+
+# ── 差分更新檔 ──────────────────────────────────────────────────────
+
+# 每次發布的完整映像都封存一份，作為之後產生差分檔的基準版本
+RELEASES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'build', 'releases')
+
+def _version_key(version):
+    return tuple(int(p) if p.isdigit() else 0 for p in version.split('.'))
+
+def archive_release(bin_path, model, version):
+    """把本次發布的 .bin 封存到 build/releases/{model}/"""
+    model_dir = os.path.join(RELEASES_DIR, model)
+    os.makedirs(model_dir, exist_ok=True)
+    archived = os.path.join(model_dir, f"{model}_v{version}.bin")
+    shutil.copy2(bin_path, archived)
+    return archived
+
+def previous_releases(model, version, limit):
+    """回傳已封存、比目前版本舊的版本 [(version, path)]，新到舊排序，最多 limit 個"""
+    model_dir = os.path.join(RELEASES_DIR, model)
+    if not os.path.isdir(model_dir):
+        return []
+    pattern = re.compile(rf'^{re.escape(model)}_v(.+)\.bin$')
+    found = []
+    for name in os.listdir(model_dir):
+        match = pattern.match(name)
+        if match and _version_key(match.group(1)) < _version_key(version):
+            found.append((match.group(1), os.path.join(model_dir, name)))
+    found.sort(key=lambda item: _version_key(item[0]), reverse=True)
+    return found[:limit]
+
+def build_deltas(bin_path, project_dir, model, version, limit):
+    """對每個先前發布的版本產生差分檔並印出大小報告，回傳差分檔資訊 list"""
+    print_header(f"產生差分更新檔: {model}")
+    previous = previous_releases(model, version, limit)
+    if not previous:
+        print_color("沒有可用的舊版本封存，略過差分檔", Colors.GRAY)
+        return []
+
+    with open(bin_path, 'rb') as f:
+        new_image = f.read()
+    out_dir = os.path.join(project_dir, 'build')
+    deltas = []
+    print_color(f"完整映像: {len(new_image) / 1024:.2f} KB", Colors.WHITE)
+    for old_version, old_path in previous:
+        with open(old_path, 'rb') as f:
+            old_image = f.read()
+        patch = ota_delta.make_delta(old_image, new_image)
+        # 產生後立即以參考實作還原一次，確保差分檔正確
+        try:
+            ota_delta.apply_delta(old_image, patch)
+        except ota_delta.DeltaError as e:
+            print_color(f"❌ v{old_version} → v{version} 差分檔驗證失敗: {e}", Colors.RED)
+            continue
+        file_name = f"{model}_v{old_version}_to_v{version}.hodf"
+        delta_path = os.path.join(out_dir, file_name)
+        with open(delta_path, 'wb') as f:
+            f.write(patch)
+        ratio = len(patch) * 100 / max(len(new_image), 1)
+        print_color(f"  v{old_version:<10} → {len(patch) / 1024:>8.2f} KB ({ratio:5.1f}%)", Colors.GRAY)
+        deltas.append({
+            'from_version': old_version,
+            'path': delta_path,
+            'file_name': file_name,
+            'size': len(patch),
+            'sha256': hashlib.sha256(patch).hexdigest(),
+        })
+    return deltas
+
+def upload_deltas(deltas, project_dir, model, version, changelog, mirrors=None):
+    """上傳差分檔，回傳寫入 Firestore 的 deltas 欄位內容"""
+    entries = []
+    for delta in deltas:
+        url, urls = upload_artifact(delta['path'], project_dir, model, version, changelog, mirrors,
+                                    file_name=delta['file_name'], allow_manual=False)
+        if url:
+            entry = {
+                'from_version': delta['from_version'],
+                'url': url,
+                'size': delta['size'],
+                'sha256': delta['sha256'],
+            }
+            if mirrors is not None:
+                entry['mirrors'] = urls
+            entries.append(entry)
+    return entries
+
+def build_compressed(bin_path, project_dir, model, version):
+    """產生 HOZ 壓縮映像，並以設備緩衝區大小串流解壓驗證一次"""
+    with open(bin_path, 'rb') as f:
+        raw = f.read()
+    packed = ota_compress.compress(raw)
+    try:
+        restored, _ = ota_compress.decode_stream(io.BytesIO(packed))
+    except ota_compress.CompressError as e:
+        print_color(f"❌ 壓縮映像驗證失敗: {e}", Colors.RED)
+        return None
+    if restored != raw:
+        print_color("❌ 壓縮映像解壓後內容不符", Colors.RED)
+        return None
+    file_name = f"{model}_v{version}.bin.hoz"
+    packed_path = os.path.join(project_dir, 'build', file_name)
+    with open(packed_path, 'wb') as f:
+        f.write(packed)
+    print_color(f"壓縮映像: {len(raw) / 1024:.2f} KB → {len(packed) / 1024:.2f} KB "
+                f"({len(packed) * 100 / max(len(raw), 1):.1f}%)", Colors.GRAY)
+    return {'path': packed_path, 'file_name': file_name, 'size': len(packed),
+            'raw_size': len(raw), 'sha256': hashlib.sha256(packed).hexdigest()}
+
+def publish_ota_artifacts(bin_path, project_dir, model, version, changelog, args, mirror_urls=None):
+    """封存本次映像；依參數產生並上傳差分檔、壓縮映像，回傳 Firestore 額外欄位"""
+    extra_fields = {}
+    # 鏡像模式下記錄所有驗證通過的 URL 與雜湊，設備可在鏡像間切換並自行驗證
+    if args.mirrors is not None:
+        extra_fields['mirrors'] = mirror_urls or []
+        extra_fields['sha256'] = file_sha256(bin_path)
+    deltas = build_deltas(bin_path, project_dir, model, version, args.delta_history) if args.delta else []
+    archive_release(bin_path, model, version)
+    if deltas:
+        extra_fields['deltas'] = upload_deltas(deltas, project_dir, model, version, changelog, args.mirrors)
+
+    if args.compress:
+        print_header(f"產生壓縮映像: {model}")
+        packed = build_compressed(bin_path, project_dir, model, version)
+        if packed:
+            url, urls = upload_artifact(packed['path'], project_dir, model, version, changelog, args.mirrors,
+                                        file_name=packed['file_name'], allow_manual=False)
+            if url:
+                extra_fields['compressed'] = {
+                    'format': 'hoz1',
+                    'url': url,
+                    'size': packed['size'],
+                    'raw_size': packed['raw_size'],
+                    'sha256': packed['sha256'],
+                }
+                if args.mirrors is not None:
+                    extra_fields['compressed']['mirrors'] = urls
+    return extra_fields
+
+# ── Firestore 更新 ──────────────────────────────────────────────────
+
+def update_firestore(project_dir, model, version, download_url, changelog, min_version,
+                     extra_fields=None):
     print_header("更新 Firestore 記錄")
 
     # 方法1: 使用 Python Firebase Admin SDK
     try:
-        from google.cloud import firestore
-        from google.oauth2 import service_account
-
-        service_account_path = _find_service_account_key(project_dir)
-
-        if service_account_path:
-            print_color(f"使用 Service Account: {service_account_path}", Colors.GRAY)
-            credentials = service_account.Credentials.from_service_account_file(
-                service_account_path
-            )
-            db = firestore.Client(credentials=credentials, project='hoctrl')
-        else:
-            print_color("嘗試使用預設認證...", Colors.GRAY)
-            db = firestore.Client(project='hoctrl')
+        print_color(cloud_clients.describe('firestore', project_dir), Colors.GRAY)
+        db = cloud_clients.firestore_client(project_dir)
 
         print_color("正在更新 Firestore...", Colors.YELLOW)
         update_data = {
@@ -432,24 +872,18 @@ def update_firestore(project_dir, model, version, download_url, changelog, min_v
             'download_url': download_url,
             'changelog': changelog,
             'min_version': min_version,
-            'publish_time': firestore.SERVER_TIMESTAMP
+            'publish_time': cloud_clients.server_timestamp()
         }
+        update_data.update(extra_fields or {})
         db.collection('firmware_updates').document(model).set(update_data, merge=True)
         print_color("✓ Firestore 更新成功", Colors.GREEN)
         print_color(f"文件路徑: firmware_updates/{model}", Colors.WHITE)
         return True
 
     except ImportError:
-        print_color("⚠ 未安裝 google-cloud-firestore，正在自動安裝...", Colors.YELLOW)
-        try:
-            subprocess.run(
-                [sys.executable, '-m', 'pip', 'install', 'google-cloud-firestore'],
-                check=True
-            )
-            print_color("✓ 安裝成功，重新嘗試更新 Firestore...", Colors.GREEN)
-            return update_firestore(project_dir, model, version, download_url, changelog, min_version)
-        except subprocess.CalledProcessError:
-            print_color("❌ 自動安裝 google-cloud-firestore 失敗", Colors.RED)
+        # 發布途中不自動安裝套件；需要時先執行 python toolchain.py preflight 確認相依套件
+        print_color("⚠ 未安裝 google-cloud-firestore，改用 Node.js（pip install google-cloud-firestore）",
+                    Colors.YELLOW)
     except Exception as e:
         print_color(f"⚠ Python 更新 Firestore 失敗: {e}", Colors.YELLOW)
 
@@ -471,6 +905,7 @@ const updateData = {{
   min_version: '{min_version}',
   publish_time: admin.firestore.Timestamp.now()
 }};
+Object.assign(updateData, {json.dumps(extra_fields or {}, ensure_ascii=False)});
 
 db.collection('firmware_updates')
   .doc('{model}')
@@ -522,11 +957,547 @@ db.collection('firmware_updates')
     print_color(f"   - changelog: {changelog}", Colors.GRAY)
     print_color(f"   - min_version: {min_version}", Colors.GRAY)
     print_color(f"   - publish_time: (使用 Timestamp.now())", Colors.GRAY)
+    for key, value in (extra_fields or {}).items():
+        print_color(f"   - {key}: {json.dumps(value, ensure_ascii=False)}", Colors.GRAY)
 
     return False
 
+# ── 發布清單 ────────────────────────────────────────────────────────
+
+MANIFESTS_DIR = os.path.join(RELEASES_DIR, 'manifests')
+
+def build_release_manifest(cfg, version, changelog, min_version, entries):
+    """建立發布清單；entries 為 [{'model', 'bin_path', 'download_url', 'extra_fields'}]"""
+    variants = []
+    for entry in entries:
+        variant = {
+            'model': entry['model'],
+            'download_url': entry['download_url'],
+            'sha256': file_sha256(entry['bin_path']),
+            'size': os.path.getsize(entry['bin_path']),
+        }
+        variant.update(entry.get('extra_fields') or {})
+        variants.append(variant)
+    return {
+        'release_id': f"{cfg['dir']}_v{version}",
+        'label': cfg['label'],
+        'version': version,
+        'changelog': changelog,
+        'min_version': min_version,
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'variants': variants,
+    }
+
+def save_release_manifest(manifest):
+    os.makedirs(MANIFESTS_DIR, exist_ok=True)
+    path = os.path.join(MANIFESTS_DIR, f"{manifest['release_id']}.json")
+    tmp = path + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, path)
+    print_color(f"發布清單: {path}", Colors.GRAY)
+    return path
+
+def _manifest_writes(manifest):
+    """發布清單對應的 Firestore 寫入 [(collection, document, data)]，publish_time 由各後端補上"""
+    writes = []
+    for variant in manifest['variants']:
+        data = {
+            'version': manifest['version'],
+            'changelog': manifest['changelog'],
+            'min_version': manifest['min_version'],
+        }
+        data.update({k: v for k, v in variant.items() if k != 'model'})
+        writes.append(('firmware_updates', variant['model'], data))
+    writes.append(('firmware_releases', manifest['release_id'], dict(manifest)))
+    return writes
+
+def _commit_local(path, writes):
+    """離線測試用：把所有文件寫進同一個 JSON 檔，以 os.replace 確保全有或全無"""
+    cloud_clients.LocalFirestore(path).commit(
+        [(collection, document, dict(data, publish_time=cloud_clients.LOCAL_TIMESTAMP), True)
+         for collection, document, data in writes])
+
+def _commit_node(writes):
+    """以 Node.js firebase-admin 的 batch 一次寫入"""
+    flutter_dir = Path("../hoctrl")
+    node_script = f"""
+const admin = require('firebase-admin');
+const serviceAccount = require('./serviceAccountKey.json');
+
+admin.initializeApp({{
+  credential: admin.credential.cert(serviceAccount)
+}});
+
+const db = admin.firestore();
+const writes = {json.dumps(writes, ensure_ascii=False)};
+const batch = db.batch();
+for (const [collection, document, data] of writes) {{
+  data.publish_time = admin.firestore.Timestamp.now();
+  batch.set(db.collection(collection).doc(document), data, {{ merge: true }});
+}}
+batch.commit()
+  .then(() => {{
+    console.log('✓ Firestore 批次寫入成功');
+    process.exit(0);
+  }})
+  .catch((error) => {{
+    console.error('❌ Firestore 批次寫入失敗:', error);
+    process.exit(1);
+  }});
+"""
+    script_path = flutter_dir / "temp_firestore_batch.js"
+    try:
+        if not check_command('node'):
+            raise FileNotFoundError("未安裝 Node.js")
+        with open(script_path, 'w', encoding='utf-8') as f:
+            f.write(node_script)
+        print_color("使用 Node.js 批次更新 Firestore...", Colors.YELLOW)
+        res = subprocess.run(
+            ['node', 'temp_firestore_batch.js'],
+            cwd=str(flutter_dir),
+            capture_output=True,
+            text=True
+        )
+        if res.returncode == 0:
+            return True
+        print_color("❌ Node.js 更新失敗", Colors.RED)
+        print_color(res.stderr, Colors.RED)
+    except Exception as e:
+        print_color(f"❌ Node.js 更新失敗: {e}", Colors.RED)
+    finally:
+        if script_path.exists():
+            script_path.unlink()
+    return False
+
+def commit_release_manifest(project_dir, manifest, local_path=None):
+    """把發布清單中所有變體以單一批次寫入 Firestore，全部成功或全部不生效"""
+    print_header("批次更新 Firestore 記錄")
+    writes = _manifest_writes(manifest)
+    for collection, document, _ in writes:
+        print_color(f"  {collection}/{document}", Colors.GRAY)
+
+    if local_path:
+        try:
+            _commit_local(local_path, writes)
+            print_color(f"✓ 已寫入本機 Firestore 檔案: {local_path}", Colors.GREEN)
+            return True
+        except (OSError, ValueError) as e:
+            print_color(f"❌ 寫入本機 Firestore 檔案失敗: {e}", Colors.RED)
+            return False
+
+    # 方法1: Python 客戶端 batch
+    try:
+        print_color(cloud_clients.describe('firestore', project_dir), Colors.GRAY)
+        db = cloud_clients.firestore_client(project_dir)
+        publish_time = cloud_clients.server_timestamp()
+        batch = db.batch()
+        for collection, document, data in writes:
+            data = dict(data, publish_time=publish_time)
+            batch.set(db.collection(collection).document(document), data, merge=True)
+        print_color("正在批次更新 Firestore...", Colors.YELLOW)
+        batch.commit()
+        print_color(f"✓ Firestore 批次更新成功（{len(writes)} 份文件）", Colors.GREEN)
+        return True
+    except ImportError:
+        print_color("⚠ 未安裝 google-cloud-firestore", Colors.YELLOW)
+    except Exception as e:
+        print_color(f"⚠ Python 批次更新 Firestore 失敗: {e}", Colors.YELLOW)
+
+    # 方法2: Node.js batch
+    if _commit_node(writes):
+        print_color("✓ Firestore 批次更新成功", Colors.GREEN)
+        return True
+
+    # 方法3: 手動更新提示
+    print_color("\n⚠ 自動更新 Firestore 失敗，所有變體皆未更新", Colors.YELLOW)
+    print_color("請依發布清單手動更新以下文件（或修正問題後重新執行）:", Colors.WHITE)
+    for collection, document, data in writes:
+        if collection == 'firmware_updates':
+            print_color(f"  {collection}/{document}: version={data['version']} download_url={data['download_url']}",
+                        Colors.GRAY)
+    return False
+
+# ── 發布流程 ────────────────────────────────────────────────────────
+
+class Release:
+    """單一型號的一次發布。每個步驟完成後立即寫入發布日誌（release_journal），
+    --resume 時沿用日誌中的版本號並略過已完成的步驟
+
+    步驟：version → build:{model} → check:{model} → upload:{model} → artifacts:{model} → firestore
+    """
+
+    def __init__(self, relay, args):
+        self.relay = relay
+        self.cfg = MODEL_CONFIGS[relay]
+        self.args = args
+        self.project_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), self.cfg['dir'])
+        self.variants = self.cfg.get('variants')
+        self.journal = None
+        self.model = None
+        self.version = None
+        self.changelog = None
+        self.min_version = None
+        self.bin_paths = {}
+        self.uploaded = []
+        self.firestore_ok = False
+        # 發布列車在背景執行緒上傳，不能停下來等手動上傳
+        self.allow_manual = True
+
+    @property
+    def models(self):
+        return [v['model'] for v in self.variants] if self.variants else [self.model]
+
+    def _abort(self, step, message):
+        print_color(f"\n❌ {message}", Colors.RED)
+        if step:
+            self.journal.fail(step, message)
+        print_color(f"修正問題後執行 python publish.py {self.relay} --resume，"
+                    f"會沿用版本 {self.version} 並略過已完成的步驟", Colors.YELLOW)
+        return False
+
+    def prepare(self):
+        """讀取韌體資訊並決定版本號：新發布時遞增版本，--resume 時沿用日誌中的版本"""
+        firmware_info = get_firmware_info(self.project_dir, self.cfg['ino'], self.cfg)
+        if not firmware_info:
+            print_color("\n❌ 無法讀取韌體資訊", Colors.RED)
+            return False
+        self.model = firmware_info['model']
+
+        journal = release_journal.Journal.load(self.cfg['dir'])
+        if journal and not journal.finished:
+            if not self.args.resume:
+                print_color(f"\n❌ {self.cfg['dir']} 有未完成的發布 v{journal.version}（{journal.path}）", Colors.RED)
+                print_color(f"以 --resume 繼續，或執行 python release_journal.py discard {self.cfg['dir']} 放棄",
+                            Colors.YELLOW)
+                return False
+            self.journal = journal
+            self.version = journal.version
+            print_header("繼續未完成的發布")
+            print_color(f"版本: {journal.data['previous_version']} → {self.version}", Colors.WHITE)
+            for step, entry in journal.data['steps'].items():
+                if entry.get('status') == release_journal.STATUS_DONE:
+                    print_color(f"  ✓ {step}", Colors.GRAY)
+            if self.args.changelog and self.args.changelog != journal.params['changelog']:
+                print_color("⚠ 沿用日誌中的更新說明，忽略本次的 -c", Colors.YELLOW)
+        else:
+            if self.args.resume:
+                # 重試失敗的發布時不能悄悄遞增版本、發布一個新版本
+                status = f"v{journal.version} 已發布完成" if journal else "沒有發布日誌"
+                print_color(f"\n❌ {self.cfg['dir']} 沒有可繼續的發布（{status}）", Colors.RED)
+                print_color(f"要開始新的發布請不帶 --resume 執行 python publish.py {self.relay}", Colors.YELLOW)
+                return False
+            # 自動將版本號加 1
+            print_header("遞增版本號")
+            old_version = firmware_info['version']
+            self.version = increment_version(old_version)
+            print_color(f"舊版本: {old_version}", Colors.GRAY)
+            print_color(f"新版本: {self.version}", Colors.GREEN)
+
+            changelog = self.args.changelog
+            if not changelog:
+                changelog = "修正錯誤，優化效能"
+                print_color(f"使用預設更新說明: {changelog}", Colors.GRAY)
+            self.journal = release_journal.Journal.create(
+                self.cfg['dir'], self.version, old_version,
+                {'changelog': changelog, 'min_version': self.args.min_version})
+
+        self.changelog = self.journal.params['changelog']
+        self.min_version = self.journal.params['min_version']
+        # 日誌先於 .ino 寫入，兩者之間中斷時 --resume 會補上版本號
+        if not self.journal.done('version') or firmware_info['version'] != self.version:
+            if not update_firmware_version(self.project_dir, self.cfg['ino'], self.version):
+                return self._abort('version', "無法更新版本號")
+            self.journal.record('version', ino=self.cfg['ino'])
+
+        # 確認更新資訊
+        print_header("確認更新資訊")
+        print_color(f"韌體版本: {self.version}", Colors.WHITE)
+        print_color(f"最低版本: {self.min_version}", Colors.WHITE)
+        print_color(f"\n更新說明:\n{self.changelog}", Colors.WHITE)
+        return True
+
+    def _reuse_build(self, model):
+        """日誌中已完成、且檔案內容未變的編譯結果"""
+        result = self.journal.result(f'build:{model}')
+        if result and os.path.exists(result['bin_path']) and file_sha256(result['bin_path']) == result['sha256']:
+            return result['bin_path']
+        return None
+
+    def build(self):
+        """編譯尚未完成的型號/變體，接著做大小與堆疊檢查"""
+        build_opts = {'use_cache': not self.args.no_cache, 'incremental': self.args.incremental}
+        pending = []
+        for model in self.models:
+            bin_path = self._reuse_build(model)
+            if bin_path:
+                print_color(f"✓ {model} 沿用已編譯的映像: {bin_path}", Colors.GREEN)
+                self.bin_paths[model] = bin_path
+            else:
+                pending.append(model)
+
+        if pending:
+            if self.variants:
+                # 多變體：先編譯全部變體（可平行），再逐一檢查
+                jobs = self.args.jobs if self.args.jobs > 0 else (os.cpu_count() or 1)
+                built = build_variants(self.project_dir, self.cfg['fqbn'],
+                                       [v for v in self.variants if v['model'] in pending], jobs, **build_opts)
+            else:
+                print_color(f"設備型號: {self.model}", Colors.WHITE)
+                built = {self.model: build_firmware(self.project_dir, self.cfg['fqbn'], self.model, **build_opts)}
+            for model in pending:
+                bin_path = built.get(model)
+                if not bin_path:
+                    return self._abort(f'build:{model}', f"{model} 編譯失敗，中止發布")
+                self.journal.record(f'build:{model}', bin_path=bin_path, sha256=file_sha256(bin_path),
+                                    size=os.path.getsize(bin_path))
+                self.bin_paths[model] = bin_path
+        return self._check()
+
+    def _check(self):
+        failed = []
+        for model in self.models:
+            step = f'check:{model}'
+            if self.journal.done(step):
+                continue
+            problems = []
+            if not self.args.skip_size_check and not check_firmware_size(
+                    self.project_dir, self.cfg, model, self.bin_paths[model], self.version,
+                    self.args.allow_size_growth):
+                problems.append('大小')
+            if not self.args.skip_stack_check and not check_stack_usage(model, self.bin_paths[model]):
+                problems.append('堆疊')
+            if problems:
+                self.journal.fail(step, f"未通過{'、'.join(problems)}檢查")
+                failed.append(f"{model}（{'、'.join(problems)}）")
+            else:
+                self.journal.record(step, size_checked=not self.args.skip_size_check,
+                                    stack_checked=not self.args.skip_stack_check)
+        if failed:
+            return self._abort(None, f"{', '.join(failed)} 未通過檢查，中止發布")
+        return True
+
+    def _upload_model(self, model, allow_manual=True):
+        """上傳一個型號/變體的映像與 OTA 附加檔，回傳發布清單項目；失敗回傳 None"""
+        bin_path = self.bin_paths[model]
+        step = f'upload:{model}'
+        uploaded = self.journal.result(step)
+        if uploaded:
+            print_color(f"✓ {model} 已上傳: {uploaded['download_url']}", Colors.GREEN)
+        else:
+            download_url, mirror_urls = upload_artifact(bin_path, self.project_dir, model, self.version,
+                                                        self.changelog, self.args.mirrors, allow_manual=allow_manual)
+            if not download_url:
+                self.journal.fail(step, "上傳失敗")
+                return None
+            uploaded = {'download_url': download_url, 'mirror_urls': mirror_urls}
+            self.journal.record(step, **uploaded)
+
+        step = f'artifacts:{model}'
+        artifacts = self.journal.result(step)
+        if artifacts is None:
+            artifacts = {'extra_fields': publish_ota_artifacts(bin_path, self.project_dir, model, self.version,
+                                                               self.changelog, self.args, uploaded['mirror_urls'])}
+            self.journal.record(step, **artifacts)
+        return {'model': model, 'bin_path': bin_path, 'download_url': uploaded['download_url'],
+                'extra_fields': artifacts['extra_fields']}
+
+    def upload(self):
+        """上傳所有型號/變體；多變體時各變體的上傳與附加檔同時進行
+        （同一個 GitHub release 的建立由 _upload_github 的 tag 鎖串行化）"""
+        models = self.models
+        entries = {}
+        if len(models) == 1:
+            entries[models[0]] = self._upload_model(models[0], self.allow_manual)
+        else:
+            print_header(f"同時上傳 {len(models)} 個變體")
+            with ThreadPoolExecutor(max_workers=len(models)) as pool:
+                # 同時上傳時不能互動，手動上傳留到之後逐一處理
+                futures = {pool.submit(self._upload_model, m, False): m for m in models}
+                for future in as_completed(futures):
+                    model = futures[future]
+                    try:
+                        entries[model] = future.result()
+                    except Exception as e:
+                        print_color(f"❌ {model} 上傳出錯: {e}", Colors.RED)
+                        entries[model] = None
+            if self.args.mirrors is None and self.allow_manual:
+                for model in models:
+                    if entries[model] is None:
+                        entries[model] = self._upload_model(model)
+
+        failed = [m for m in models if entries[m] is None]
+        if failed:
+            return self._abort(None, f"{', '.join(failed)} 上傳失敗，中止發布")
+        self.uploaded = [entries[m] for m in models]
+        return True
+
+    def commit(self):
+        """寫入 Firestore；多變體以發布清單單一批次寫入，避免只有部分變體收到更新"""
+        if self.journal.done('firestore'):
+            self.firestore_ok = True
+        elif self.variants:
+            manifest = build_release_manifest(self.cfg, self.version, self.changelog, self.min_version, self.uploaded)
+            save_release_manifest(manifest)
+            self.firestore_ok = commit_release_manifest(self.project_dir, manifest, self.args.firestore_local)
+        else:
+            entry = self.uploaded[0]
+            self.firestore_ok = update_firestore(self.project_dir, entry['model'], self.version,
+                                                 entry['download_url'], self.changelog, self.min_version,
+                                                 entry['extra_fields'])
+        if self.firestore_ok:
+            self.journal.record('firestore')
+            self.journal.finish()
+        else:
+            self.journal.fail('firestore', "Firestore 未更新")
+        return self.firestore_ok
+
+    def print_summary(self):
+        if self.variants:
+            success_count = len(self.uploaded) if self.firestore_ok else 0
+            total_count = len(self.uploaded)
+            if success_count == total_count:
+                print_color(f"\n╔════════════════════════════════════════╗", Colors.GREEN)
+                print_color(f"║   ✓ 所有韌體發布完成！({success_count}/{total_count})       ║", Colors.GREEN)
+                print_color(f"╚════════════════════════════════════════╝", Colors.GREEN)
+            else:
+                print_color(f"\n╔════════════════════════════════════════╗", Colors.YELLOW)
+                print_color(f"║   ⚠ 部分韌體發布完成 ({success_count}/{total_count})         ║", Colors.YELLOW)
+                print_color(f"╚════════════════════════════════════════╝", Colors.YELLOW)
+
+            print_color(f"\n版本: {self.version}", Colors.WHITE)
+            for entry in self.uploaded:
+                status = "✓" if self.firestore_ok else "❌"
+                print_color(f"  {status} {entry['model']} - {entry['download_url']}",
+                            Colors.GREEN if self.firestore_ok else Colors.RED)
+        elif self.firestore_ok:
+            print_color("\n╔════════════════════════════════════════╗", Colors.GREEN)
+            print_color("║        ✓ 韌體發布完成！              ║", Colors.GREEN)
+            print_color("╚════════════════════════════════════════╝", Colors.GREEN)
+            print_color(f"\n版本: {self.version}", Colors.WHITE)
+            print_color(f"下載 URL: {self.uploaded[0]['download_url']}", Colors.WHITE)
+        else:
+            print_color("\n╔════════════════════════════════════════╗", Colors.YELLOW)
+            print_color("║    ⚠ 韌體已上傳，但 Firestore 未更新 ║", Colors.YELLOW)
+            print_color("╚════════════════════════════════════════╝", Colors.YELLOW)
+            print_color(f"\n版本: {self.version}", Colors.WHITE)
+            print_color(f"下載 URL: {self.uploaded[0]['download_url']}", Colors.WHITE)
+
+        if self.firestore_ok:
+            print_color("\n設備將在下次連線時收到更新通知\n", Colors.YELLOW)
+        else:
+            print_color(f"\n請手動更新 Firestore，或修正問題後執行 python publish.py {self.relay} --resume 重新寫入"
+                        "（不會重新編譯或上傳）\n", Colors.YELLOW)
+
+# ── 發布列車 ────────────────────────────────────────────────────────
+
+def run_train(releases):
+    """依序發布多個型號：主執行緒逐一編譯與檢查，上傳與 Firestore 寫入交給單一背景執行緒，
+    因此編譯第 N+1 個型號時第 N 個型號同時在上傳。上傳一次只跑一個型號，不會同時寫入同一個
+    GitHub release；Storage bucket 與 Firestore 客戶端在整串發布中共用。
+    某個型號失敗不影響其他型號，回傳 {relay: 結果}"""
+    started = time.monotonic()
+    timings = {r.relay: {} for r in releases}
+    results = {}
+
+    def ship(release):
+        t0 = time.monotonic()
+        try:
+            return release.upload() and release.commit()
+        finally:
+            timings[release.relay]['ship'] = time.monotonic() - t0
+
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        futures = {}
+        for release in releases:
+            release.allow_manual = False
+            print_header(f"發布列車：{release.cfg['label']}")
+            t0 = time.monotonic()
+            try:
+                ready = release.prepare() and release.build()
+            except Exception as e:
+                print_color(f"❌ {release.cfg['label']} 編譯出錯: {e}", Colors.RED)
+                ready = False
+            timings[release.relay]['build'] = time.monotonic() - t0
+            if ready:
+                futures[release.relay] = pool.submit(ship, release)
+            else:
+                results[release.relay] = 'build'
+
+        for release in releases:
+            future = futures.get(release.relay)
+            if future is None:
+                continue
+            try:
+                ok = future.result()
+            except Exception as e:
+                print_color(f"❌ {release.cfg['label']} 上傳出錯: {e}", Colors.RED)
+                ok = False
+            if ok:
+                results[release.relay] = 'done'
+            else:
+                results[release.relay] = 'firestore' if release.uploaded else 'upload'
+
+    # 背景上傳時不能互動；沒有指定 --mirrors 時，上傳失敗的型號在這裡逐一改走可手動上傳的流程
+    for release in releases:
+        if results[release.relay] == 'upload' and release.args.mirrors is None:
+            print_header(f"重新上傳：{release.cfg['label']}")
+            release.allow_manual = True
+            if release.upload():
+                results[release.relay] = 'done' if release.commit() else 'firestore'
+
+    print_train_summary(releases, results, timings, time.monotonic() - started)
+    return results
+
+TRAIN_RESULTS = {
+    'done': ('✓ 完成', Colors.GREEN),
+    'build': ('❌ 版本/編譯/檢查失敗', Colors.RED),
+    'upload': ('❌ 上傳失敗', Colors.RED),
+    'firestore': ('⚠ 已上傳，Firestore 未更新', Colors.YELLOW),
+}
+
+def print_train_summary(releases, results, timings, elapsed):
+    done = sum(1 for r in results.values() if r == 'done')
+    color = Colors.GREEN if done == len(releases) else Colors.YELLOW
+    print_color(f"\n╔════════════════════════════════════════╗", color)
+    print_color(f"║   發布列車完成 ({done}/{len(releases)})                    ║", color)
+    print_color(f"╚════════════════════════════════════════╝", color)
+
+    print_color(f"\n{'型號':<10}{'版本':<10}{'編譯':>8}{'上傳':>8}  結果", Colors.WHITE)
+    for release in releases:
+        label, color = TRAIN_RESULTS[results[release.relay]]
+        t = timings[release.relay]
+        ship = f"{t['ship']:.1f}s" if 'ship' in t else '-'
+        print_color(f"{release.cfg['dir']:<12}{release.version or '-':<12}{t['build']:>9.1f}s{ship:>10}  {label}",
+                    color)
+        for entry in release.uploaded:
+            print_color(f"    {entry['model']} - {entry['download_url']}", Colors.GRAY)
+
+    serial = sum(t.get('build', 0) + t.get('ship', 0) for t in timings.values())
+    print_color(f"\n總耗時 {elapsed:.1f} 秒（逐一發布約 {serial:.1f} 秒）", Colors.WHITE)
+
+    failed = [r.relay for r in releases if results[r.relay] != 'done']
+    if failed:
+        print_color(f"修正問題後執行 python publish.py {','.join(map(str, failed))} --resume，"
+                    "已完成的步驟不會重做\n", Colors.YELLOW)
+    else:
+        print_color("設備將在下次連線時收到更新通知\n", Colors.YELLOW)
+
 # ── 主程式 ──────────────────────────────────────────────────────────
 
+def parse_relays(value):
+    """型號參數：1、2、3，all 或逗號分隔（如 1,3），回傳依編號排序的清單"""
+    if value.strip().lower() in ('all', 'a'):
+        return sorted(MODEL_CONFIGS)
+    try:
+        relays = sorted({int(v) for v in value.split(',') if v.strip()})
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"無效的型號: {value}（1、2、3、all 或如 1,3）")
+    unknown = [r for r in relays if r not in MODEL_CONFIGS]
+    if not relays or unknown:
+        raise argparse.ArgumentTypeError(f"無效的型號: {value}（1、2、3、all 或如 1,3）")
+    return relays
+
 def select_relay():
     """互動式選擇型號"""
     print_color("\n╔════════════════════════════════════════╗", Colors.CYAN)
@@ -535,16 +1506,14 @@ def select_relay():
     print_color("請選擇要發布的型號:\n", Colors.WHITE)
     for num, cfg in MODEL_CONFIGS.items():
         print_color(f"  {num}) {cfg['label']}", Colors.WHITE)
+    print_color("  a) 全部型號", Colors.WHITE)
     print_color("", Colors.NC)
     while True:
         try:
-            choice = input("請輸入型號編號 (1-3): ").strip()
-            num = int(choice)
-            if num in MODEL_CONFIGS:
-                return num
-            print_color("⚠ 請輸入 1、2 或 3", Colors.YELLOW)
-        except ValueError:
-            print_color("⚠ 請輸入數字", Colors.YELLOW)
+            choice = input("請輸入型號編號 (1-3，多個以逗號分隔，a = 全部): ").strip()
+            return parse_relays(choice)
+        except argparse.ArgumentTypeError:
+            print_color("⚠ 請輸入 1、2、3、a 或如 1,3", Colors.YELLOW)
         except EOFError:
             sys.exit(0)
 
@@ -557,143 +1526,83 @@ def main():
                '  python publish.py 2\n'
                '  python publish.py 3 -c "修正 WiFi 連接問題"\n'
                '  python publish.py 1 -y -m 1.0.0\n'
+               '  python publish.py 2 --resume\n'
+               '  python publish.py all -c "修正排程"\n'
+               '  python publish.py 1,3\n'
     )
-    parser.add_argument('relay', type=int, choices=[1, 2, 3], nargs='?', default=None,
-                        help='繼電器型號 (1=hoRelay1, 2=hoRelay2, 3=hoRelay3)')
+    parser.add_argument('relay', type=parse_relays, nargs='?', default=None,
+                        help='繼電器型號 (1=hoRelay1, 2=hoRelay2, 3=hoRelay3；all 或 1,3 依序發布多個型號)')
     parser.add_argument('-c', '--changelog', help='更新說明')
     parser.add_argument('-m', '--min-version', default='1.3.5', help='最低版本要求')
     parser.add_argument('-y', '--yes', action='store_true', help='跳過確認直接發布')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='多變體同時編譯的數量（0 = CPU 核心數，預設 1 逐一編譯）')
+    parser.add_argument('--no-cache', action='store_true', help='不使用編譯快取，一律重新編譯')
+    parser.add_argument('--delta', action='store_true',
+                        help='對先前發布的版本產生差分更新檔並一併上傳')
+    parser.add_argument('--delta-history', type=int, default=3,
+                        help='產生差分檔的舊版本數量上限（預設 3）')
+    parser.add_argument('--compress', action='store_true',
+                        help='額外產生並上傳 HOZ 壓縮映像（串流解壓，標頭含原始大小與 CRC-32）')
+    parser.add_argument('--mirrors', nargs='?', const='all', type=parse_mirrors, default=None,
+                        help='同時上傳到多個目的地並以 SHA-256 驗證（all 或逗號分隔：'
+                             + ','.join(UPLOAD_BACKENDS) + '）')
+    parser.add_argument('--firestore-local', metavar='FILE',
+                        help='多變體發布時改寫入本機 JSON 檔（離線測試用，不連線 Firestore）')
+    parser.add_argument('--incremental', action='store_true',
+                        help='增量編譯：保留 build path 與核心快取，重用已編譯的 ESP32 核心與函式庫')
+    parser.add_argument('--allow-size-growth', action='store_true',
+                        help='允許映像比上一版成長超過預算（仍須放得進 OTA 分區）')
+    parser.add_argument('--skip-size-check', action='store_true', help='略過大小與記憶體預算檢查')
+    parser.add_argument('--skip-stack-check', action='store_true', help='略過堆疊深度檢查')
+    parser.add_argument('--resume', action='store_true',
+                        help='從發布日誌繼續上次中斷的發布（沿用同一版本號，略過已完成的步驟）')
     args = parser.parse_args()
 
-    relay = args.relay if args.relay is not None else select_relay()
-    cfg = MODEL_CONFIGS[relay]
+    relays = args.relay if args.relay is not None else select_relay()
+    releases = [Release(relay, args) for relay in relays]
 
-    # 以腳本所在目錄為基準計算 project_dir
-    script_dir = os.path.dirname(os.path.abspath(__file__))
-    project_dir = os.path.join(script_dir, cfg['dir'])
-
-    if not os.path.isdir(project_dir):
-        print_color(f"❌ 找不到目錄: {project_dir}", Colors.RED)
-        sys.exit(1)
+    for release in releases:
+        if not os.path.isdir(release.project_dir):
+            print_color(f"❌ 找不到目錄: {release.project_dir}", Colors.RED)
+            sys.exit(1)
 
     print_color(f"\n╔════════════════════════════════════════╗", Colors.CYAN)
-    print_color(f"║   {cfg['label']:^36s} ║", Colors.CYAN)
+    for release in releases:
+        print_color(f"║   {release.cfg['label']:^36s} ║", Colors.CYAN)
     print_color(f"║   韌體發布自動化腳本                  ║", Colors.CYAN)
     print_color(f"╚════════════════════════════════════════╝\n", Colors.CYAN)
 
-    # 檢查必要工具
+    # 檢查必要工具（多型號時只檢查一次）
     if not check_requirements():
         print_color("\n❌ 缺少必要工具，無法繼續", Colors.RED)
         sys.exit(1)
 
-    # 讀取韌體資訊
-    firmware_info = get_firmware_info(project_dir, cfg['ino'], cfg)
-    if not firmware_info:
-        print_color("\n❌ 無法讀取韌體資訊", Colors.RED)
-        sys.exit(1)
-
-    version = firmware_info['version']
-    model = firmware_info['model']
-
-    # 自動將版本號加 1
-    print_header("遞增版本號")
-    old_version = version
-    version = increment_version(version)
-    print_color(f"舊版本: {old_version}", Colors.GRAY)
-    print_color(f"新版本: {version}", Colors.GREEN)
-
-    if not update_firmware_version(project_dir, cfg['ino'], version):
-        print_color("\n❌ 無法更新版本號", Colors.RED)
-        sys.exit(1)
-
-    # 確認更新資訊
-    print_header("確認更新資訊")
-    print_color(f"韌體版本: {version}", Colors.WHITE)
-    print_color(f"最低版本: {args.min_version}", Colors.WHITE)
-
-    changelog = args.changelog
-    if not changelog:
-        changelog = "修正錯誤，優化效能"
-        print_color(f"使用預設更新說明: {changelog}", Colors.GRAY)
-
-    print_color(f"\n更新說明:\n{changelog}", Colors.WHITE)
-
-    # 判斷是否有多變體
-    variants = cfg.get('variants')
-
-    if variants:
-        # 多變體：逐一編譯、上傳、更新
-        results = []
-        for variant in variants:
-            vmodel = variant['model']
-            print_color(f"\n{'─'*50}", Colors.CYAN)
-            print_color(f"  處理變體: {vmodel} (GPIO {variant['relay_pin']})", Colors.CYAN)
-            print_color(f"{'─'*50}", Colors.CYAN)
-
-            bin_path = build_firmware(project_dir, cfg['fqbn'], vmodel, variant)
-            if not bin_path:
-                print_color(f"\n❌ {vmodel} 編譯失敗，中止發布", Colors.RED)
-                sys.exit(1)
-
-            download_url = upload_to_firebase(bin_path, project_dir, vmodel, version, changelog)
-            if not download_url:
-                print_color(f"\n❌ {vmodel} 上傳失敗，中止發布", Colors.RED)
-                sys.exit(1)
-                continue
-
-            update_firestore(project_dir, vmodel, version, download_url, changelog, args.min_version)
-            results.append({'model': vmodel, 'success': True, 'url': download_url})
-
-        # 摘要
-        success_count = sum(1 for r in results if r['success'])
-        total_count = len(results)
-
-        if success_count == total_count:
-            print_color(f"\n╔════════════════════════════════════════╗", Colors.GREEN)
-            print_color(f"║   ✓ 所有韌體發布完成！({success_count}/{total_count})       ║", Colors.GREEN)
-            print_color(f"╚════════════════════════════════════════╝", Colors.GREEN)
-        else:
-            print_color(f"\n╔════════════════════════════════════════╗", Colors.YELLOW)
-            print_color(f"║   ⚠ 部分韌體發布完成 ({success_count}/{total_count})         ║", Colors.YELLOW)
-            print_color(f"╚════════════════════════════════════════╝", Colors.YELLOW)
-
-        print_color(f"\n版本: {version}", Colors.WHITE)
-        for r in results:
-            status = "✓" if r['success'] else "❌"
-            url_info = f" - {r['url']}" if r.get('url') else ""
-            print_color(f"  {status} {r['model']}{url_info}", Colors.GREEN if r['success'] else Colors.RED)
-        print_color("\n設備將在下次連線時收到更新通知\n", Colors.YELLOW)
-
-    else:
-        # 單一型號：原有流程
-        print_color(f"設備型號: {model}", Colors.WHITE)
-
-        bin_path = build_firmware(project_dir, cfg['fqbn'], model)
-        if not bin_path:
-            print_color("\n❌ 編譯失敗，無法繼續", Colors.RED)
+    if len(releases) > 1:
+        # 先確認每個型號的日誌狀態與 --resume 相符，避免列車跑到一半才停在某個型號
+        journals = {r.cfg['dir']: release_journal.Journal.load(r.cfg['dir']) for r in releases}
+        pending = [name for name, j in journals.items() if j and not j.finished]
+        if not args.resume and pending:
+            for name in pending:
+                print_color(f"❌ {name} 有未完成的發布 v{journals[name].version}", Colors.RED)
+            print_color("以 --resume 繼續，或以 release_journal.py discard 放棄後再發布", Colors.YELLOW)
             sys.exit(1)
-
-        download_url = upload_to_firebase(bin_path, project_dir, model, version, changelog)
-        if not download_url:
-            print_color("\n❌ 上傳失敗，無法繼續", Colors.RED)
+        if args.resume and len(pending) < len(journals):
+            for name in journals:
+                if name not in pending:
+                    print_color(f"❌ {name} 沒有可繼續的發布", Colors.RED)
+            print_color(f"--resume 只能指定有未完成發布的型號（{', '.join(pending) or '無'}）", Colors.YELLOW)
             sys.exit(1)
+        results = run_train(releases)
+        if any(r != 'done' for r in results.values()):
+            sys.exit(1)
+        return
 
-        firestore_ok = update_firestore(project_dir, model, version, download_url, changelog, args.min_version)
-
-        if firestore_ok:
-            print_color("\n╔════════════════════════════════════════╗", Colors.GREEN)
-            print_color("║        ✓ 韌體發布完成！              ║", Colors.GREEN)
-            print_color("╚════════════════════════════════════════╝", Colors.GREEN)
-            print_color(f"\n版本: {version}", Colors.WHITE)
-            print_color(f"下載 URL: {download_url}", Colors.WHITE)
-            print_color("\n設備將在下次連線時收到更新通知\n", Colors.YELLOW)
-        else:
-            print_color("\n╔════════════════════════════════════════╗", Colors.YELLOW)
-            print_color("║    ⚠ 韌體已上傳，但 Firestore 未更新 ║", Colors.YELLOW)
-            print_color("╚════════════════════════════════════════╝", Colors.YELLOW)
-            print_color(f"\n版本: {version}", Colors.WHITE)
-            print_color(f"下載 URL: {download_url}", Colors.WHITE)
-            print_color("\n請手動更新 Firestore 後，設備才會收到更新通知\n", Colors.YELLOW)
+    release = releases[0]
+    if not (release.prepare() and release.build() and release.upload()):
+        sys.exit(1)
+    release.commit()
+    release.print_summary()
 
 if __name__ == '__main__':
     try:
@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""
+hoRelay 發布日誌
+每次發布在 build/journal/{型號目錄}.json 記錄版本號、發布參數與每個步驟的結果，
+每完成一步立即寫入（暫存檔 + os.replace）。發布中途失敗時以 publish.py --resume 從中斷處繼續：
+沿用同一個版本號，略過已完成的編譯、檢查與上傳，不會再遞增一次版本
+
+用法:
+  python release_journal.py list                 # 各型號最近一次發布的狀態
+  python release_journal.py show ho_relay2       # 列出每個步驟
+  python release_journal.py discard ho_relay2    # 放棄未完成的發布（.ino 的版本號維持不變）
+"""
+
+import os
+import sys
+import json
+import argparse
+import threading
+from datetime import datetime
+
+JOURNAL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'build', 'journal')
+
+STATUS_RUNNING = 'running'
+STATUS_DONE = 'done'
+STATUS_FAILED = 'failed'
+
+def _now():
+    return datetime.now().isoformat(timespec='seconds')
+
+class Journal:
+    """單一型號目錄的發布日誌；record / fail 可從多個執行緒呼叫"""
+
+    def __init__(self, path, data):
+        self.path = path
+        self.data = data
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, name, journal_dir=JOURNAL_DIR):
+        path = os.path.join(journal_dir, f"{name}.json")
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                return cls(path, json.load(f))
+        except FileNotFoundError:
+            return None
+
+    @classmethod
+    def create(cls, name, version, previous_version, params, journal_dir=JOURNAL_DIR):
+        """開始新的發布；同名的舊日誌（已完成者）會被覆寫"""
+        journal = cls(os.path.join(journal_dir, f"{name}.json"), {
+            'name': name,
+            'version': version,
+            'previous_version': previous_version,
+            'params': params,
+            'status': STATUS_RUNNING,
+            'created': _now(),
+            'updated': _now(),
+            'steps': {},
+        })
+        journal.save()
+        return journal
+
+    @property
+    def version(self):
+        return self.data['version']
+
+    @property
+    def params(self):
+        return self.data['params']
+
+    @property
+    def finished(self):
+        return self.data['status'] == STATUS_DONE
+
+    def done(self, step):
+        return self.data['steps'].get(step, {}).get('status') == STATUS_DONE
+
+    def result(self, step):
+        """已完成步驟記錄的結果 dict；未完成回傳 None"""
+        entry = self.data['steps'].get(step)
+        if not entry or entry.get('status') != STATUS_DONE:
+            return None
+        return {k: v for k, v in entry.items() if k not in ('status', 'at')}
+
+    def record(self, step, **result):
+        with self._lock:
+            self.data['steps'][step] = dict(result, status=STATUS_DONE, at=_now())
+            self._save()
+
+    def fail(self, step, error):
+        with self._lock:
+            self.data['steps'][step] = {'status': STATUS_FAILED, 'error': str(error), 'at': _now()}
+            self.data['status'] = STATUS_FAILED
+            self._save()
+
+    def finish(self):
+        with self._lock:
+            self.data['status'] = STATUS_DONE
+            self._save()
+
+    def save(self):
+        with self._lock:
+            self._save()
+
+    def _save(self):
+        self.data['updated'] = _now()
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(self.data, f, ensure_ascii=False, indent=2)
+        os.replace(tmp, self.path)
+
+def list_journals(journal_dir=JOURNAL_DIR):
+    if not os.path.isdir(journal_dir):
+        return []
+    names = sorted(n[:-len('.json')] for n in os.listdir(journal_dir) if n.endswith('.json'))
+    return [j for j in (Journal.load(n, journal_dir) for n in names) if j]
+
+# ── 命令列 ──────────────────────────────────────────────────────────
+
+def main():
+    parser = argparse.ArgumentParser(description='hoRelay 發布日誌')
+    sub = parser.add_subparsers(dest='command', required=True)
+    sub.add_parser('list', help='各型號最近一次發布的狀態')
+    p_show = sub.add_parser('show', help='列出每個步驟')
+    p_show.add_argument('name', help='型號目錄（如 ho_relay2）')
+    p_discard = sub.add_parser('discard', help='放棄未完成的發布')
+    p_discard.add_argument('name', help='型號目錄（如 ho_relay2）')
+    args = parser.parse_args()
+
+    if args.command == 'list':
+        journals = list_journals()
+        if not journals:
+            print("沒有發布日誌")
+        for j in journals:
+            steps = j.data['steps']
+            done = sum(1 for s in steps.values() if s.get('status') == STATUS_DONE)
+            print(f"{j.data['name']:<12} v{j.version:<10} {j.data['status']:<8} "
+                  f"{done}/{len(steps)} 步  {j.data['updated']}")
+        return
+
+    journal = Journal.load(args.name)
+    if not journal:
+        print(f"❌ 找不到發布日誌: {args.name}")
+        sys.exit(1)
+    if args.command == 'show':
+        print(f"{journal.data['name']} v{journal.data['previous_version']} → v{journal.version}  "
+              f"{journal.data['status']}（{journal.data['created']} 開始）")
+        for step, entry in journal.data['steps'].items():
+            detail = entry.get('error') or entry.get('download_url') or ''
+            print(f"  {'✓' if entry.get('status') == STATUS_DONE else '❌'} {step:<24} {entry.get('at', '')}  {detail}")
+    elif args.command == 'discard':
+        if journal.finished:
+            print(f"v{journal.version} 已發布完成，不需要放棄")
+            return
+        os.remove(journal.path)
+        print(f"已放棄 v{journal.version} 的發布日誌；.ino 仍為 v{journal.version}，下次發布會從此版本再遞增")
+
+if __name__ == '__main__':
+    main()
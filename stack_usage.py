@@ -0,0 +1,341 @@
+#!/usr/bin/env python3
+"""
+hoRelay 韌體堆疊用量分析
+編譯時加上 -fstack-usage，gcc 會為每個物件檔輸出 .su（每個函式的堆疊框大小）；
+本工具把 .su 彙整成 {sketch}.stack.json，再以工具鏈的 objdump 反組譯 .elf 建立呼叫圖，
+計算各執行緒入口（loop、MQTT 回呼、BLE 回呼、OTA）的最壞堆疊深度，並標出堆疊框過大的函式
+
+用法:
+  python stack_usage.py report ho_relay3/build                 # 各入口最壞深度與大堆疊框函式
+  python stack_usage.py report ho_relay3/build --threshold 256 --json stack.json
+  python stack_usage.py collect build/work/xxx/sketch ho_relay3/build ho_relay3.ino   # 手動彙整 .su
+
+限制:
+  - ESP-IDF 與 Arduino 核心的預編譯函式庫沒有 .su，這些函式的堆疊框以 0 計算，結果是下限
+  - 虛擬函式、函式指標等間接呼叫無法從反組譯得知，MQTT / BLE 回呼以 TASKS 中的 context 補上呼叫端
+  - 遞迴只計算一層，並另外列出
+"""
+
+import os
+import re
+import sys
+import json
+import glob
+import struct
+import argparse
+import subprocess
+from pathlib import Path
+
+import toolchain
+
+STACK_SUFFIX = '.stack.json'
+DEFAULT_THRESHOLD = 512
+
+# arduino-esp32 的 loopTask 堆疊 (CONFIG_ARDUINO_LOOP_STACK_SIZE) 與 Bluedroid BTC 執行緒堆疊
+LOOP_STACK = 8192
+BLE_STACK = 8192
+
+# 每個執行緒入口：entries 為分析起點，context 為執行到入口前已在堆疊上的呼叫端（間接呼叫補上）
+TASKS = {
+    'loop': {'entries': ['loop'], 'context': ['loopTask'], 'stack': LOOP_STACK},
+    'mqtt': {'entries': ['mqttCallback'], 'context': ['loopTask', 'loop', 'PubSubClient::loop'],
+             'stack': LOOP_STACK},
+    'ota': {'entries': ['startFirmwareUpdate'],
+            'context': ['loopTask', 'loop', 'PubSubClient::loop', 'mqttCallback'], 'stack': LOOP_STACK},
+    'ble': {'entries': ['MyCallbacks::onWrite', 'MyServerCallbacks::onConnect', 'MyServerCallbacks::onDisconnect'],
+            'context': [], 'stack': BLE_STACK},
+}
+
+# 直接呼叫與尾呼叫的指令（RISC-V：ESP32-C3；Xtensa：ESP32）
+CALL_MNEMONICS = {'jal', 'jalr', 'call', 'tail', 'j', 'call0', 'call4', 'call8', 'call12', 'j.l'}
+ELF_MACHINES = {0xF3: 'riscv32-esp-elf', 0x5E: 'xtensa-esp32-elf'}
+
+class StackError(Exception):
+    pass
+
+# ── 函式名稱 ────────────────────────────────────────────────────────
+
+_CLONE_SUFFIX = re.compile(r'(\s*\[clone [^\]]*\])+$|(\.(constprop|isra|part|cold|lto_priv)\.\d+)+$')
+
+def short_name(decl):
+    """'virtual void MyCallbacks::onWrite(BLECharacteristic*)' → 'MyCallbacks::onWrite'
+
+    .su、objdump -C 與入口設定都以這個形式比對；同名多載會合併為一個節點（取較大的堆疊框）。
+    """
+    decl = _CLONE_SUFFIX.sub('', decl.strip())
+    depth = 0
+    end = len(decl)
+    for i, ch in enumerate(decl):
+        if ch == '<':
+            depth += 1
+        elif ch == '>':
+            depth -= 1
+        elif ch == '(' and depth <= 0 and not decl[:i].endswith('operator'):
+            end = i
+            break
+    head = decl[:end].rstrip()
+    depth = 0
+    start = 0
+    for i, ch in enumerate(head):
+        if ch == '<':
+            depth += 1
+        elif ch == '>':
+            depth -= 1
+        elif ch in ' *&' and depth <= 0:
+            start = i + 1
+    return _CLONE_SUFFIX.sub('', head[start:])
+
+# ── .su ─────────────────────────────────────────────────────────────
+
+_SU_LOCATION = re.compile(r'^(.*?:\d+:\d+):(.*)$')
+
+def parse_su(path):
+    """讀取一個 .su 檔，回傳 [(name, bytes, qualifier, location)]
+
+    每行格式: ho_relay3.ino.cpp:457:6:void mqttCallback(char*, byte*, unsigned int)<TAB>1104<TAB>static
+    """
+    rows = []
+    with open(path, 'r', encoding='utf-8', errors='replace') as f:
+        for line in f:
+            parts = line.rstrip('\n').split('\t')
+            if len(parts) < 3 or not parts[1].isdigit():
+                continue
+            match = _SU_LOCATION.match(parts[0])
+            location, decl = match.groups() if match else ('', parts[0])
+            rows.append((short_name(decl), int(parts[1]), parts[2], os.path.basename(location)))
+    return rows
+
+def collect(work_dir, build_path, sketch_name):
+    """彙整 build path 下所有 .su，寫成 build 目錄中的 {sketch}.stack.json，回傳函式數"""
+    functions = {}
+    for su in glob.glob(os.path.join(work_dir, '**', '*.su'), recursive=True):
+        for name, size, qualifier, location in parse_su(su):
+            known = functions.get(name)
+            if known is None or size > known['bytes']:
+                functions[name] = {'bytes': size, 'qualifier': qualifier, 'location': location}
+    if functions:
+        with open(os.path.join(build_path, sketch_name + STACK_SUFFIX), 'w', encoding='utf-8') as f:
+            json.dump({'functions': functions}, f, ensure_ascii=False)
+    return len(functions)
+
+# ── 呼叫圖 ──────────────────────────────────────────────────────────
+
+def elf_toolchain_prefix(elf_path):
+    with open(elf_path, 'rb') as f:
+        header = f.read(20)
+    if header[:4] != b'\x7fELF':
+        raise StackError(f"{elf_path} 不是 ELF 檔案")
+    machine, = struct.unpack_from('<H', header, 18)
+    return ELF_MACHINES.get(machine)
+
+def find_objdump(elf_path, explicit=None):
+    """依 ELF 架構在 PATH 與 Arduino15 工具目錄中尋找對應的 objdump"""
+    if explicit:
+        return explicit
+    prefix = elf_toolchain_prefix(elf_path)
+    if not prefix:
+        return None
+    name = f"{prefix}-objdump"
+    # 遞迴搜尋 Arduino15 很慢，結果記錄在 toolchain 的工具記錄中
+    return toolchain.resolve(name, lambda: _find_arduino15_tool(name))
+
+def _find_arduino15_tool(name):
+    roots = [os.path.expanduser('~/.arduino15'), os.path.expanduser('~/Library/Arduino15'),
+             os.path.expandvars(r'%LOCALAPPDATA%\Arduino15')]
+    for root in roots:
+        matches = sorted(glob.glob(os.path.join(root, 'packages', '*', 'tools', '**', 'bin', name + '*'),
+                                   recursive=True))
+        if matches:
+            return matches[-1]
+    return None
+
+_FUNCTION_HEADER = re.compile(r'^[0-9a-f]+ <(.+)>:$')
+_INSTRUCTION = re.compile(r'^\s*[0-9a-f]+:\s+(\S+)\s*(.*)$')
+_TARGET = re.compile(r'<([^<>]+(?:<[^>]*>[^<>]*)*)>\s*$')
+
+def parse_disassembly(lines):
+    """解析 objdump -d -C 輸出，回傳 {呼叫端: set(被呼叫端)}"""
+    graph = {}
+    current = None
+    for line in lines:
+        header = _FUNCTION_HEADER.match(line)
+        if header:
+            current = short_name(header.group(1))
+            graph.setdefault(current, set())
+            continue
+        if current is None:
+            continue
+        match = _INSTRUCTION.match(line)
+        if not match or match.group(1) not in CALL_MNEMONICS:
+            continue
+        target = _TARGET.search(match.group(2))
+        if not target or '+0x' in target.group(1):
+            # 函式內的跳轉（<foo+0x1c>）不是呼叫
+            continue
+        graph[current].add(short_name(target.group(1)))
+    return graph
+
+def call_graph(elf_path, objdump):
+    res = subprocess.run([objdump, '-d', '-C', '--no-show-raw-insn', elf_path],
+                         capture_output=True, text=True, errors='replace')
+    if res.returncode != 0:
+        raise StackError(f"objdump 失敗: {res.stderr.strip()[:200]}")
+    return parse_disassembly(res.stdout.splitlines())
+
+# ── 分析 ────────────────────────────────────────────────────────────
+
+class StackAnalysis:
+    def __init__(self, functions, graph):
+        self.functions = functions
+        self.graph = graph
+        self.recursive = set()
+        self._memo = {}
+
+    def frame(self, name):
+        info = self.functions.get(name)
+        return info['bytes'] if info else 0
+
+    def worst(self, name, stack=()):
+        """回傳 (最壞深度, 路徑)；遇到遞迴時不再展開並記錄"""
+        if name in self._memo:
+            return self._memo[name]
+        if name in stack:
+            self.recursive.add(name)
+            return 0, []
+        best_depth, best_path = 0, []
+        for callee in self.graph.get(name, ()):
+            depth, path = self.worst(callee, stack + (name,))
+            if depth > best_depth:
+                best_depth, best_path = depth, path
+        result = (self.frame(name) + best_depth, [name] + best_path)
+        self._memo[name] = result
+        return result
+
+    def task(self, spec):
+        context = sum(self.frame(n) for n in spec['context'])
+        best = None
+        for entry in spec['entries']:
+            if entry not in self.functions and entry not in self.graph:
+                continue
+            depth, path = self.worst(entry)
+            if best is None or depth > best[0]:
+                best = (depth, path)
+        if best is None:
+            return None
+        depth, path = best
+        path = [n for n in spec['context'] if self.frame(n)] + path
+        return {
+            'depth': context + depth,
+            'stack': spec['stack'],
+            'path': path,
+            'frames': [self.frame(n) for n in path],
+            'unknown': [n for n in path if n not in self.functions],
+            'dynamic': [n for n in path if 'dynamic' in self.functions.get(n, {}).get('qualifier', '')],
+        }
+
+    def large_frames(self, threshold):
+        rows = [(n, i['bytes'], i['qualifier'], i['location']) for n, i in self.functions.items()
+                if i['bytes'] >= threshold]
+        rows.sort(key=lambda r: -r[1])
+        return rows
+
+def _find(build_dir, suffix):
+    found = sorted(Path(build_dir).glob(f'*{suffix}'))
+    return str(found[0]) if found else None
+
+def analyze(build_dir, tasks=TASKS, threshold=DEFAULT_THRESHOLD, objdump=None):
+    """分析 build 目錄（需有 .stack.json 與 .elf），回傳報告 dict"""
+    stack_path = _find(build_dir, STACK_SUFFIX)
+    if not stack_path:
+        raise StackError(f"{build_dir} 中找不到 {STACK_SUFFIX}（需以 -fstack-usage 編譯）")
+    with open(stack_path, 'r', encoding='utf-8') as f:
+        functions = json.load(f)['functions']
+    elf_path = _find(build_dir, '.elf')
+    graph = {}
+    warnings = []
+    tool = find_objdump(elf_path, objdump) if elf_path else None
+    if tool:
+        graph = call_graph(elf_path, tool)
+    else:
+        warnings.append('找不到 objdump，只計算入口函式本身的堆疊框')
+    analysis = StackAnalysis(functions, graph)
+    report = {'tasks': {}, 'warnings': warnings,
+              'large_frames': [{'function': n, 'bytes': b, 'qualifier': q, 'location': l}
+                               for n, b, q, l in analysis.large_frames(threshold)]}
+    for name, spec in tasks.items():
+        result = analysis.task(spec)
+        if result:
+            report['tasks'][name] = result
+    report['recursive'] = sorted(analysis.recursive)
+    return report
+
+def over_limit(report, margin=0.0):
+    """回傳最壞深度超過堆疊大小（扣除保留比例）的入口名稱"""
+    return [name for name, t in report['tasks'].items() if t['depth'] > t['stack'] * (1 - margin)]
+
+def format_report(report):
+    lines = []
+    for name, t in report['tasks'].items():
+        mark = '❌' if t['depth'] > t['stack'] else '✓'
+        lines.append(f"{mark} {name:<5} 最壞 {t['depth']:>6,} / {t['stack']:,} bytes "
+                     f"({t['depth'] * 100 / t['stack']:.0f}%)")
+        chain = ' → '.join(f"{n}({b})" for n, b in zip(t['path'][:8], t['frames']))
+        lines.append(f"     {chain}{' → …' if len(t['path']) > 8 else ''}")
+        if t['dynamic']:
+            lines.append(f"     ⚠ 動態堆疊框: {', '.join(t['dynamic'])}")
+        if t['unknown']:
+            lines.append(f"     路徑上 {len(t['unknown'])} 個函式沒有 .su（預編譯函式庫），以 0 計算")
+    for row in report['large_frames']:
+        lines.append(f"⚠ {row['function']:<40} {row['bytes']:>6,} bytes  {row['qualifier']:<10} {row['location']}")
+    if report['recursive']:
+        lines.append(f"⚠ 遞迴: {', '.join(report['recursive'])}")
+    lines += [f"⚠ {w}" for w in report['warnings']]
+    return lines
+
+# ── 命令列 ──────────────────────────────────────────────────────────
+
+def _parse_stack_override(values):
+    overrides = {}
+    for value in values or []:
+        name, _, size = value.partition('=')
+        if name not in TASKS or not size.isdigit():
+            raise argparse.ArgumentTypeError(f"格式為 任務=bytes，任務: {', '.join(TASKS)}")
+        overrides[name] = int(size)
+    return overrides
+
+def main():
+    parser = argparse.ArgumentParser(description='hoRelay 韌體堆疊用量分析')
+    sub = parser.add_subparsers(dest='command', required=True)
+    p = sub.add_parser('report', help='計算各入口最壞堆疊深度')
+    p.add_argument('build_dir')
+    p.add_argument('--threshold', type=int, default=DEFAULT_THRESHOLD,
+                   help=f'標出堆疊框 ≥ 此大小的函式（預設 {DEFAULT_THRESHOLD}）')
+    p.add_argument('--stack', action='append', help='覆寫任務堆疊大小，如 ble=6144（可重複）')
+    p.add_argument('--objdump', help='objdump 路徑（預設依 ELF 架構自動尋找）')
+    p.add_argument('--json', help='將報告寫入 JSON 檔')
+    p = sub.add_parser('collect', help='彙整 .su 檔')
+    p.add_argument('work_dir')
+    p.add_argument('build_dir')
+    p.add_argument('sketch_name')
+    args = parser.parse_args()
+
+    try:
+        if args.command == 'collect':
+            print(f"已彙整 {collect(args.work_dir, args.build_dir, args.sketch_name)} 個函式")
+            return
+        tasks = {name: dict(spec) for name, spec in TASKS.items()}
+        for name, size in _parse_stack_override(args.stack).items():
+            tasks[name]['stack'] = size
+        report = analyze(args.build_dir, tasks, args.threshold, args.objdump)
+        print('\n'.join(format_report(report)))
+        if args.json:
+            with open(args.json, 'w', encoding='utf-8') as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
+        if over_limit(report):
+            sys.exit(1)
+    except (StackError, OSError, ValueError, argparse.ArgumentTypeError) as e:
+        print(f"❌ {e}")
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+"""
+hoRelay 精簡二進位狀態格式 (schema 1) 與編解碼器
+韌體以 BINARY_STATUS=1 編譯時，除了 JSON 狀態外另以 retained 發布到 hoban/{device_id}/status/bin；
+原本訂閱 hoban/+/status 的工具不受影響。大量解碼時有 numpy 就一次轉成欄位陣列，
+否則以 struct.iter_unpack 逐筆解開再轉成 array
+
+用法:
+  python status_codec.py size                     # 比較 JSON 與二進位大小
+  python status_codec.py bench --count 100000     # 比較 JSON 與二進位大量解碼速度
+  python status_codec.py decode 01050064...       # 解碼十六進位字串
+
+格式 (little-endian，固定 25 bytes):
+  schema       u8      1
+  flags        u8      bit0 WiFi 已連線、bit1 繼電器開啟
+  status       u8      STATUS_CODES 的索引
+  progress     u8      OTA 進度 (0~100)，只在 updating 時有意義
+  uptime       u32     開機秒數（JSON 的 timestamp）
+  version      u8 u8 u16  主、次、修訂版本號
+  rssi         i8      dBm
+  model        u8      MODEL_CODES 的索引，0 = 未知
+  server       u8      SERVER_CODES 的索引，0 = 自訂伺服器
+  ip           4 bytes IPv4
+  mac          6 bytes 與 device_id 相同順序（hoban- 後的 12 位十六進位）
+"""
+
+import sys
+import json
+import time
+import array
+import struct
+import argparse
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+import hoban_mqtt
+
+SCHEMA_VERSION = 1
+BINARY_SUFFIX = '/bin'
+BINARY_WILDCARD = hoban_mqtt.STATUS_WILDCARD + BINARY_SUFFIX
+
+RECORD = struct.Struct('<BBBBIBBHbBB4s6s')
+FIELDS = ('schema', 'flags', 'status', 'progress', 'uptime', 'major', 'minor', 'patch',
+          'rssi', 'model', 'server', 'ip', 'mac')
+
+FLAG_WIFI = 0x01
+FLAG_RELAY = 0x02
+
+# 新增代碼只能附加在尾端，既有代碼不可更動
+STATUS_CODES = ('online', 'updating', 'offline', 'reset', 'update_success', 'update_failed')
+MODEL_CODES = (None, 'hoRelay1', 'hoRelay2', 'hoRelay2-1', 'hoRelay3')
+SERVER_CODES = (None,) + hoban_mqtt.PUBLIC_BROKERS
+
+if np is not None:
+    NUMPY_DTYPE = np.dtype([
+        ('schema', 'u1'), ('flags', 'u1'), ('status', 'u1'), ('progress', 'u1'),
+        ('uptime', '<u4'), ('major', 'u1'), ('minor', 'u1'), ('patch', '<u2'),
+        ('rssi', 'i1'), ('model', 'u1'), ('server', 'u1'), ('ip', 'u1', (4,)), ('mac', 'u1', (6,)),
+    ])
+
+class CodecError(Exception):
+    pass
+
+def binary_status_topic(device_id):
+    return hoban_mqtt.status_topic(device_id) + BINARY_SUFFIX
+
+def _code(table, value):
+    try:
+        return table.index(value)
+    except ValueError:
+        return 0
+
+def _version_parts(version):
+    parts = (str(version or '0.0.0').split('.') + ['0', '0'])[:3]
+    try:
+        return int(parts[0]) & 0xFF, int(parts[1]) & 0xFF, int(parts[2]) & 0xFFFF
+    except ValueError:
+        return 0, 0, 0
+
+def encode(status, device_id=None):
+    """把 JSON 狀態 dict 編成二進位（模擬器與測試用；韌體直接填結構）"""
+    wifi = status.get('wifi') or {}
+    device = status.get('device') or {}
+    device_id = device_id or status.get('device_id', '')
+    try:
+        mac = bytes.fromhex(device_id.rpartition('-')[2])
+    except ValueError:
+        mac = b''
+    try:
+        ip = bytes(int(p) for p in wifi.get('ip', '0.0.0.0').split('.'))
+    except ValueError:
+        ip = b''
+    flags = (FLAG_WIFI if wifi.get('connected') else 0) | (FLAG_RELAY if device.get('relay') else 0)
+    status_code = STATUS_CODES.index(status['status']) if status.get('status') in STATUS_CODES else 0
+    return RECORD.pack(
+        SCHEMA_VERSION, flags, status_code, int(device.get('update_progress', 0)) & 0xFF,
+        int(status.get('timestamp', 0)) & 0xFFFFFFFF, *_version_parts(status.get('version')),
+        max(-128, min(127, int(wifi.get('rssi', 0)))), _code(MODEL_CODES, status.get('model')),
+        _code(SERVER_CODES, status.get('server')), ip.ljust(4, b'\0')[:4], mac.ljust(6, b'\0')[:6])
+
+def decode(payload):
+    """解成與 JSON 狀態相同結構的 dict，可直接交給 FleetIndex.update"""
+    if len(payload) != RECORD.size:
+        raise CodecError(f"長度 {len(payload)} 不符 schema {SCHEMA_VERSION} 的 {RECORD.size} bytes")
+    (schema, flags, status, progress, uptime, major, minor, patch,
+     rssi, model, server, ip, mac) = RECORD.unpack(payload)
+    if schema != SCHEMA_VERSION:
+        raise CodecError(f"不支援的 schema 版本: {schema}")
+    data = {
+        'device_id': 'hoban-' + mac.hex(),
+        'status': STATUS_CODES[status] if status < len(STATUS_CODES) else 'unknown',
+        'version': f"{major}.{minor}.{patch}",
+        'timestamp': uptime,
+        'wifi': {'connected': bool(flags & FLAG_WIFI), 'rssi': rssi, 'ip': '.'.join(map(str, ip))},
+        'device': {'relay': 1 if flags & FLAG_RELAY else 0},
+    }
+    if model and model < len(MODEL_CODES):
+        data['model'] = MODEL_CODES[model]
+    if server and server < len(SERVER_CODES):
+        data['server'] = SERVER_CODES[server]
+    if data['status'] == 'updating':
+        data['device']['update_progress'] = progress
+    return data
+
+def decode_bulk(payloads):
+    """大量解碼：回傳 {欄位: 陣列}，長度或 schema 不符的訊息略過
+
+    數值欄位為 numpy 陣列（有 numpy 時）或 array.array；ip / mac 為 (n, 4) / (n, 6) 陣列或 bytes list。
+    """
+    valid = [p for p in payloads if len(p) == RECORD.size and p[0] == SCHEMA_VERSION]
+    blob = b''.join(valid)
+    if np is not None:
+        records = np.frombuffer(blob, dtype=NUMPY_DTYPE)
+        return {name: records[name] for name in FIELDS}
+    columns = list(zip(*RECORD.iter_unpack(blob))) if blob else [()] * len(FIELDS)
+    typecodes = ('B', 'B', 'B', 'B', 'I', 'B', 'B', 'H', 'b', 'B', 'B')
+    result = {name: array.array(code, column) for name, code, column in zip(FIELDS, typecodes, columns)}
+    result['ip'] = list(columns[11])
+    result['mac'] = list(columns[12])
+    return result
+
+# ── 命令列 ──────────────────────────────────────────────────────────
+
+SAMPLE_STATUS = {
+    'device_id': 'hoban-a1b2c3d4e5f6', 'status': 'online', 'version': '2.0.4', 'model': 'hoRelay2',
+    'server': 'mqttgo.io', 'timestamp': 86400,
+    'wifi': {'connected': True, 'ssid': 'farm-gateway', 'rssi': -67, 'ip': '192.168.1.23'},
+    'device': {'relay': 0},
+}
+
+def _sample_payloads(count):
+    payloads = []
+    for i in range(count):
+        status = dict(SAMPLE_STATUS, device_id=f"hoban-{i:012x}", timestamp=i)
+        status['wifi'] = dict(SAMPLE_STATUS['wifi'], rssi=-40 - i % 50)
+        payloads.append((json.dumps(status, separators=(',', ':')).encode(), encode(status)))
+    return payloads
+
+def main():
+    parser = argparse.ArgumentParser(description='hoRelay 二進位狀態編解碼工具')
+    sub = parser.add_subparsers(dest='command', required=True)
+    sub.add_parser('size', help='比較 JSON 與二進位大小')
+    p = sub.add_parser('bench', help='比較大量解碼速度')
+    p.add_argument('--count', type=int, default=100000)
+    p = sub.add_parser('decode', help='解碼十六進位字串')
+    p.add_argument('hex')
+    args = parser.parse_args()
+
+    try:
+        if args.command == 'size':
+            text, binary = _sample_payloads(1)[0]
+            print(f"JSON:   {len(text)} bytes")
+            print(f"二進位: {len(binary)} bytes ({len(binary) * 100 / len(text):.0f}%)")
+        elif args.command == 'bench':
+            samples = _sample_payloads(args.count)
+            started = time.perf_counter()
+            rssi = [json.loads(t)['wifi']['rssi'] for t, _ in samples]
+            json_seconds = time.perf_counter() - started
+            started = time.perf_counter()
+            columns = decode_bulk([b for _, b in samples])
+            bulk_seconds = time.perf_counter() - started
+            assert list(columns['rssi']) == rssi
+            backend = 'numpy' if np is not None else 'struct.iter_unpack'
+            print(f"JSON 逐筆解析: {json_seconds * 1000:.0f} ms")
+            print(f"二進位批次解碼 ({backend}): {bulk_seconds * 1000:.0f} ms "
+                  f"（{json_seconds / max(bulk_seconds, 1e-9):.0f} 倍）")
+        elif args.command == 'decode':
+            print(json.dumps(decode(bytes.fromhex(args.hex)), ensure_ascii=False, indent=2))
+    except (CodecError, ValueError) as e:
+        print(f"❌ {e}")
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,502 @@
+#!/usr/bin/env python3
+"""
+hoRelay 車隊遙測時序資料庫
+訂閱 hoban/+/status，把每則狀態附加到本機的欄位式儲存：每台設備每個欄位一個只附加的檔案，
+依時間分區（原始資料每日、5 分鐘彙總每月、1 小時彙總每年），查詢時以 mmap 讀取並二分搜尋時間欄，
+保存期限到期時整個分區目錄刪除
+
+用法:
+  python telemetry_store.py ingest --broker mqttgo.io                     # 常駐收集並定期彙總/清理
+  python telemetry_store.py query --device hoban-a1b2c3d4e5f6 --since 24h  # 單台 RSSI 時間序列
+  python telemetry_store.py online --since 7d --tier 1h                   # 全車隊在線比例
+  python telemetry_store.py rollup                                        # 手動彙總
+  python telemetry_store.py prune                                         # 依保存期限刪除舊分區
+  python telemetry_store.py stats                                         # 各層資料量
+
+目錄結構 ({data}/{tier}/{partition}/{device_id}/{column}.col):
+  raw/20261018/hoban-a1b2c3d4e5f6/ts.col        u32 epoch 秒
+                                   rssi.col      i8  (-128 = 無資料)
+                                   status.col    u8  status_codec.STATUS_CODES 索引 (255 = 其他)
+                                   uptime.col    u32 設備開機秒數
+                                   server.col    u16 字典代碼 (dictionary.json)
+                                   version.col   u16 字典代碼
+  5m/202610/... 與 1h/2026/...     ts, count, online, rssi_min, rssi_max, rssi_sum, rssi_n, restarts
+"""
+
+import os
+import sys
+import json
+import mmap
+import time
+import array
+import bisect
+import shutil
+import asyncio
+import argparse
+import calendar
+
+import hoban_mqtt
+import status_codec
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+DATA_DIR = os.path.join(SCRIPT_DIR, 'build', 'telemetry')
+
+RSSI_MISSING = -128
+STATUS_OTHER = 255
+ONLINE = status_codec.STATUS_CODES.index('online')
+UPDATING = status_codec.STATUS_CODES.index('updating')
+
+RAW_COLUMNS = (('ts', 'I'), ('rssi', 'b'), ('status', 'B'), ('uptime', 'I'),
+               ('server', 'H'), ('version', 'H'))
+ROLLUP_COLUMNS = (('ts', 'I'), ('count', 'H'), ('online', 'H'), ('rssi_min', 'b'), ('rssi_max', 'b'),
+                  ('rssi_sum', 'i'), ('rssi_n', 'H'), ('restarts', 'H'))
+
+# 分區鍵格式、彙總區間（秒）與預設保存天數
+TIERS = {
+    'raw': {'partition': '%Y%m%d', 'bucket': None, 'retention_days': 7, 'columns': RAW_COLUMNS},
+    '5m': {'partition': '%Y%m', 'bucket': 300, 'retention_days': 90, 'columns': ROLLUP_COLUMNS},
+    '1h': {'partition': '%Y', 'bucket': 3600, 'retention_days': 730, 'columns': ROLLUP_COLUMNS},
+}
+ROLLUP_TIERS = ('5m', '1h')
+
+# ── 分區 ────────────────────────────────────────────────────────────
+
+def partition_key(tier, ts):
+    return time.strftime(TIERS[tier]['partition'], time.gmtime(ts))
+
+def partition_range(tier, key):
+    """分區的 [開始, 結束) epoch 秒"""
+    if tier == 'raw':
+        start = calendar.timegm(time.strptime(key, '%Y%m%d'))
+        return start, start + 86400
+    if tier == '5m':
+        year, month = int(key[:4]), int(key[4:6])
+        nxt = (year + month // 12, month % 12 + 1)
+        return calendar.timegm((year, month, 1, 0, 0, 0)), calendar.timegm((nxt[0], nxt[1], 1, 0, 0, 0))
+    year = int(key)
+    return calendar.timegm((year, 1, 1, 0, 0, 0)), calendar.timegm((year + 1, 1, 1, 0, 0, 0))
+
+class ColumnView:
+    """以 mmap 開啟的唯讀欄位檔；檔案為空時視為長度 0"""
+
+    def __init__(self, path, typecode):
+        self._file = None
+        self._map = None
+        self.values = memoryview(b'').cast('B')
+        size = os.path.getsize(path) if os.path.exists(path) else 0
+        itemsize = array.array(typecode).itemsize
+        size -= size % itemsize  # 略過寫到一半的尾端
+        if size:
+            self._file = open(path, 'rb')
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            self.values = memoryview(self._map)[:size].cast(typecode)
+
+    def __len__(self):
+        return len(self.values)
+
+    def close(self):
+        self.values.release()
+        if self._map:
+            self._map.close()
+            self._file.close()
+
+# ── 儲存 ────────────────────────────────────────────────────────────
+
+class TelemetryStore:
+    def __init__(self, root=DATA_DIR, retention=None):
+        self.root = root
+        self.retention = {tier: spec['retention_days'] for tier, spec in TIERS.items()}
+        self.retention.update(retention or {})
+        self._pending = {}
+        self._dict_path = os.path.join(root, 'dictionary.json')
+        self._meta_path = os.path.join(root, 'meta.json')
+        self.dictionary = self._load(self._dict_path, {'server': [''], 'version': ['']})
+        self.meta = self._load(self._meta_path, {'watermark': {tier: {} for tier in ROLLUP_TIERS}})
+        self._codes = {name: {v: i for i, v in enumerate(values)} for name, values in self.dictionary.items()}
+        self._dict_dirty = False
+        os.makedirs(root, exist_ok=True)
+
+    @staticmethod
+    def _load(path, default):
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        return default
+
+    def _save(self, path, data):
+        tmp = path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp, path)
+
+    def _code(self, name, value):
+        codes = self._codes[name]
+        value = value or ''
+        if value not in codes:
+            codes[value] = len(self.dictionary[name])
+            self.dictionary[name].append(value)
+            self._dict_dirty = True
+        return codes[value]
+
+    def _dir(self, tier, key, device_id):
+        return os.path.join(self.root, tier, key, device_id)
+
+    # 寫入
+
+    def append(self, device_id, ts, data):
+        """緩衝一筆狀態；flush() 時才寫入磁碟"""
+        wifi = data.get('wifi') if isinstance(data.get('wifi'), dict) else {}
+        rssi = wifi.get('rssi')
+        status = data.get('status')
+        row = (
+            int(ts),
+            max(-127, min(127, int(rssi))) if isinstance(rssi, (int, float)) else RSSI_MISSING,
+            status_codec.STATUS_CODES.index(status) if status in status_codec.STATUS_CODES else STATUS_OTHER,
+            int(data.get('timestamp', 0)) & 0xFFFFFFFF,
+            self._code('server', data.get('server')),
+            self._code('version', data.get('version')),
+        )
+        self._pending.setdefault((partition_key('raw', ts), device_id), []).append(row)
+
+    def flush(self):
+        """把緩衝的資料依分區與設備批次附加到欄位檔"""
+        rows_written = 0
+        for (key, device_id), rows in self._pending.items():
+            rows_written += len(rows)
+            self._write_rows('raw', key, device_id, rows)
+        self._pending.clear()
+        if self._dict_dirty:
+            self._save(self._dict_path, self.dictionary)
+            self._dict_dirty = False
+        return rows_written
+
+    def _write_rows(self, tier, key, device_id, rows):
+        directory = self._dir(tier, key, device_id)
+        os.makedirs(directory, exist_ok=True)
+        columns = list(zip(*rows))
+        # ts 最後寫入：讀取端以 ts 長度為準，中途中斷也不會讀到不完整的列
+        order = list(range(1, len(columns))) + [0]
+        for index in order:
+            name, typecode = TIERS[tier]['columns'][index]
+            with open(os.path.join(directory, name + '.col'), 'ab') as f:
+                f.write(array.array(typecode, columns[index]).tobytes())
+
+    # 讀取
+
+    def partitions(self, tier, start=None, end=None):
+        base = os.path.join(self.root, tier)
+        if not os.path.isdir(base):
+            return []
+        keys = []
+        for key in sorted(os.listdir(base)):
+            p_start, p_end = partition_range(tier, key)
+            if (end is None or p_start < end) and (start is None or p_end > start):
+                keys.append(key)
+        return keys
+
+    def devices(self, tier='raw', start=None, end=None):
+        found = set()
+        for key in self.partitions(tier, start, end):
+            found.update(os.listdir(os.path.join(self.root, tier, key)))
+        return sorted(found)
+
+    def read(self, tier, device_id, start, end, fields):
+        """讀取 [start, end) 內的資料，回傳 {欄位: list}；以 mmap + 二分搜尋只取需要的區段"""
+        types = dict(TIERS[tier]['columns'])
+        result = {name: [] for name in ('ts',) + tuple(fields)}
+        for key in self.partitions(tier, start, end):
+            directory = self._dir(tier, key, device_id)
+            if not os.path.isdir(directory):
+                continue
+            ts = ColumnView(os.path.join(directory, 'ts.col'), 'I')
+            try:
+                lo = bisect.bisect_left(ts.values, start)
+                hi = bisect.bisect_left(ts.values, end)
+                if lo >= hi:
+                    continue
+                result['ts'] += ts.values[lo:hi].tolist()
+                for name in fields:
+                    column = ColumnView(os.path.join(directory, name + '.col'), types[name])
+                    try:
+                        result[name] += column.values[lo:hi].tolist()
+                    finally:
+                        column.close()
+            finally:
+                ts.close()
+        return result
+
+    # 彙總
+
+    def rollup(self, now=None):
+        """把原始資料彙總成 5m / 1h；只處理已結束的區間，水位記錄於 meta.json"""
+        now = int(now if now is not None else time.time())
+        written = {}
+        for tier in ROLLUP_TIERS:
+            bucket = TIERS[tier]['bucket']
+            complete = now - now % bucket
+            watermarks = self.meta['watermark'].setdefault(tier, {})
+            earliest = min(watermarks.values(), default=0)
+            count = 0
+            for device_id in self.devices('raw', earliest, complete):
+                since = watermarks.get(device_id, 0)
+                data = self.read('raw', device_id, since, complete, ('rssi', 'status', 'uptime'))
+                rows = self._aggregate(data, bucket)
+                if not rows:
+                    continue
+                by_partition = {}
+                for row in rows:
+                    by_partition.setdefault(partition_key(tier, row[0]), []).append(row)
+                for key, part_rows in by_partition.items():
+                    self._write_rows(tier, key, device_id, part_rows)
+                watermarks[device_id] = rows[-1][0] + bucket
+                count += len(rows)
+            written[tier] = count
+        self._save(self._meta_path, self.meta)
+        return written
+
+    @staticmethod
+    def _aggregate(data, bucket):
+        rows = []
+        current = None
+        prev_uptime = None
+        for ts, rssi, status, uptime in zip(data['ts'], data['rssi'], data['status'], data['uptime']):
+            start = ts - ts % bucket
+            if current is None or current[0] != start:
+                if current:
+                    rows.append(tuple(current))
+                current = [start, 0, 0, 127, -128, 0, 0, 0]
+            current[1] += 1
+            if status in (ONLINE, UPDATING):
+                current[2] += 1
+            if rssi != RSSI_MISSING:
+                current[3] = min(current[3], rssi)
+                current[4] = max(current[4], rssi)
+                current[5] += rssi
+                current[6] += 1
+            # 開機秒數倒退代表設備重新開機，用來找出不穩定的現場
+            if prev_uptime is not None and uptime and uptime < prev_uptime:
+                current[7] += 1
+            if uptime:
+                prev_uptime = uptime
+        if current:
+            rows.append(tuple(current))
+        return [(r[0], min(r[1], 0xFFFF), min(r[2], 0xFFFF), r[3] if r[6] else RSSI_MISSING,
+                 r[4] if r[6] else RSSI_MISSING, r[5], min(r[6], 0xFFFF), min(r[7], 0xFFFF)) for r in rows]
+
+    # 保存期限
+
+    def prune(self, now=None):
+        """刪除整個分區都超過保存期限的目錄，回傳刪除的分區"""
+        now = now if now is not None else time.time()
+        removed = []
+        for tier in TIERS:
+            cutoff = now - self.retention[tier] * 86400
+            for key in self.partitions(tier):
+                if partition_range(tier, key)[1] <= cutoff:
+                    shutil.rmtree(os.path.join(self.root, tier, key))
+                    removed.append(f"{tier}/{key}")
+        return removed
+
+    # 查詢
+
+    def series(self, device_id, start, end, field='rssi', tier=None):
+        """單台設備的時間序列；未指定 tier 時依範圍長度自動選擇"""
+        tier = tier or auto_tier(start, end)
+        if tier == 'raw':
+            data = self.read('raw', device_id, start, end, (field,))
+            if field == 'rssi':
+                return [(t, v) for t, v in zip(data['ts'], data['rssi']) if v != RSSI_MISSING]
+            if field in ('server', 'version'):
+                names = self.dictionary[field]
+                return [(t, names[v] if v < len(names) else '?') for t, v in zip(data['ts'], data[field])]
+            return list(zip(data['ts'], data[field]))
+        if field != 'rssi':
+            raise ValueError(f"彙總資料只提供 rssi，{field} 請使用 --tier raw")
+        data = self.read(tier, device_id, start, end, ('rssi_min', 'rssi_max', 'rssi_sum', 'rssi_n'))
+        return [(t, round(s / n, 1), lo, hi)
+                for t, lo, hi, s, n in zip(data['ts'], data['rssi_min'], data['rssi_max'],
+                                            data['rssi_sum'], data['rssi_n']) if n]
+
+    def online_ratio(self, start, end, tier='5m'):
+        """每個區間在線設備數 / 範圍內出現過的設備數"""
+        if tier == 'raw':
+            raise ValueError("在線比例請使用 5m 或 1h 彙總")
+        online = {}
+        devices = self.devices(tier, start, end)
+        for device_id in devices:
+            data = self.read(tier, device_id, start, end, ('online',))
+            for t, n in zip(data['ts'], data['online']):
+                if n:
+                    online[t] = online.get(t, 0) + 1
+        bucket = TIERS[tier]['bucket']
+        first = start - start % bucket
+        return [(t, online.get(t, 0), len(devices)) for t in range(first, end, bucket)] if devices else []
+
+    def stats(self):
+        result = {}
+        for tier in TIERS:
+            size = 0
+            files = 0
+            for dirpath, _, filenames in os.walk(os.path.join(self.root, tier)):
+                for name in filenames:
+                    size += os.path.getsize(os.path.join(dirpath, name))
+                    files += 1
+            result[tier] = {'partitions': len(self.partitions(tier)), 'files': files, 'bytes': size}
+        return result
+
+def auto_tier(start, end):
+    span = end - start
+    if span <= 2 * 86400:
+        return 'raw'
+    if span <= 60 * 86400:
+        return '5m'
+    return '1h'
+
+# ── 收集 ────────────────────────────────────────────────────────────
+
+class Ingestor:
+    """MQTT on_message 回呼：略過 retained 舊狀態與指令確認，只緩衝即時狀態"""
+
+    def __init__(self, store):
+        self.store = store
+        self.received = 0
+
+    def on_message(self, message):
+        if message.retain or not message.payload:
+            return
+        device_id = hoban_mqtt.device_id_from_topic(message.topic)
+        if not device_id:
+            return
+        if message.topic.endswith(status_codec.BINARY_SUFFIX):
+            try:
+                data = status_codec.decode(message.payload)
+            except status_codec.CodecError:
+                return
+        elif message.topic.endswith('/status'):
+            data = hoban_mqtt.parse_status(message.payload)
+            if 'ack' in data or 'event' in data:
+                return
+        else:
+            return
+        self.store.append(device_id, time.time(), data)
+        self.received += 1
+
+async def ingest(args, store):
+    ingestor = Ingestor(store)
+    host, port = hoban_mqtt.parse_broker(args.broker)
+    client = hoban_mqtt.MQTTClient(host, port, client_id=f"hoctrl-telemetry-{int(time.time())}",
+                                   username=args.username, password=args.password,
+                                   on_message=ingestor.on_message)
+    topic = status_codec.BINARY_WILDCARD if args.binary else hoban_mqtt.STATUS_WILDCARD
+    await client.connect()
+    await client.subscribe(topic)
+    print(f"已連線 {host}:{port}，資料目錄: {store.root}")
+
+    async def keep_connected():
+        # 獨立於寫入迴圈：重連期間仍照常寫入已收到的資料並執行彙總與清理
+        while True:
+            await asyncio.sleep(1)
+            if not client.connected:
+                print("⚠ 與 broker 的連線中斷，重新連線中...")
+                await hoban_mqtt.reconnect(client, topic, log=print)
+                print(f"已重新連線 {host}:{port}，訂閱 {topic}")
+
+    supervisor = asyncio.ensure_future(keep_connected())
+    last_rollup = time.time()
+    try:
+        while True:
+            await asyncio.sleep(args.flush)
+            rows = store.flush()
+            if time.time() - last_rollup >= args.rollup_interval:
+                written = store.rollup()
+                removed = store.prune()
+                last_rollup = time.time()
+                print(f"彙總 {written}，刪除分區 {removed or '無'}")
+            elif rows:
+                print(f"寫入 {rows} 筆（{rows / args.flush:.0f} 筆/秒）")
+    finally:
+        supervisor.cancel()
+        store.flush()
+        await client.disconnect()
+
+# ── 命令列 ──────────────────────────────────────────────────────────
+
+def parse_time(value, now):
+    """'24h'、'7d'、'30m' 表示距今多久；純數字為 epoch 秒"""
+    units = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+    if value[-1:] in units:
+        return int(now - float(value[:-1]) * units[value[-1]])
+    return int(float(value))
+
+def _fmt_ts(ts):
+    return time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(ts))
+
+def main():
+    parser = argparse.ArgumentParser(description='hoRelay 車隊遙測時序資料庫')
+    parser.add_argument('--data', default=DATA_DIR, help='資料目錄（預設 build/telemetry）')
+    parser.add_argument('--raw-days', type=float, help=f"原始資料保存天數（預設 {TIERS['raw']['retention_days']}）")
+    parser.add_argument('--5m-days', dest='days_5m', type=float, help=f"5 分鐘彙總保存天數（預設 {TIERS['5m']['retention_days']}）")
+    parser.add_argument('--1h-days', dest='days_1h', type=float, help=f"1 小時彙總保存天數（預設 {TIERS['1h']['retention_days']}）")
+    sub = parser.add_subparsers(dest='command', required=True)
+    p = sub.add_parser('ingest', help='訂閱狀態並寫入')
+    p.add_argument('--broker', default='mqttgo.io')
+    p.add_argument('--username')
+    p.add_argument('--password')
+    p.add_argument('--binary', action='store_true', help='改訂閱二進位狀態')
+    p.add_argument('--flush', type=float, default=10, help='寫入間隔秒數（預設 10）')
+    p.add_argument('--rollup-interval', type=float, default=300, help='彙總與清理間隔秒數（預設 300）')
+    p = sub.add_parser('query', help='單台設備時間序列')
+    p.add_argument('--device', required=True)
+    p.add_argument('--field', default='rssi', choices=('rssi', 'status', 'uptime', 'server', 'version'))
+    p.add_argument('--since', default='24h')
+    p.add_argument('--until')
+    p.add_argument('--tier', choices=tuple(TIERS))
+    p.add_argument('--csv', action='store_true')
+    p = sub.add_parser('online', help='全車隊在線比例')
+    p.add_argument('--since', default='24h')
+    p.add_argument('--until')
+    p.add_argument('--tier', default='5m', choices=ROLLUP_TIERS)
+    sub.add_parser('rollup', help='彙總已結束的區間')
+    sub.add_parser('prune', help='依保存期限刪除舊分區')
+    sub.add_parser('stats', help='各層資料量')
+    args = parser.parse_args()
+
+    retention = {k: v for k, v in (('raw', args.raw_days), ('5m', args.days_5m), ('1h', args.days_1h)) if v}
+    store = TelemetryStore(args.data, retention)
+    now = time.time()
+    try:
+        if args.command == 'ingest':
+            asyncio.run(ingest(args, store))
+        elif args.command == 'query':
+            start = parse_time(args.since, now)
+            end = parse_time(args.until, now) if args.until else int(now) + 1
+            points = store.series(args.device, start, end, args.field, args.tier)
+            for point in points:
+                if args.csv:
+                    print(','.join(str(v) for v in point))
+                else:
+                    print(f"{_fmt_ts(point[0])}  " + '  '.join(str(v) for v in point[1:]))
+            if not args.csv:
+                print(f"共 {len(points)} 筆（{args.tier or auto_tier(start, end)}）")
+        elif args.command == 'online':
+            start = parse_time(args.since, now)
+            end = parse_time(args.until, now) if args.until else int(now)
+            for ts, online, total in store.online_ratio(start, end, args.tier):
+                ratio = online / total if total else 0
+                print(f"{_fmt_ts(ts)}  {online:>5}/{total:<5} {ratio:>6.1%}  {'█' * round(ratio * 30)}")
+        elif args.command == 'rollup':
+            print(f"已彙總: {store.rollup()}")
+        elif args.command == 'prune':
+            removed = store.prune()
+            print(f"已刪除 {len(removed)} 個分區" + (f": {', '.join(removed)}" if removed else ''))
+        elif args.command == 'stats':
+            for tier, s in store.stats().items():
+                print(f"{tier:<4} 分區 {s['partitions']:>4}  檔案 {s['files']:>7}  {s['bytes'] / 1024 / 1024:>9.1f} MB")
+    except (OSError, asyncio.TimeoutError, hoban_mqtt.MQTTError, ValueError) as e:
+        print(f"❌ {e}")
+        sys.exit(1)
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+"""
+hoctrl 發布工具鏈探測
+外部工具（arduino-cli、firebase、gh、gsutil、node、objdump）的位置記錄在 build/toolchain.json，
+每次執行只對記錄的執行檔做一次 stat：執行檔被更新、移除，或 PATH 目錄有變動時才重新搜尋。
+preflight 一次解析全部工具與選用的 Python 套件並執行 --version 驗證，適合放在 CI 的準備步驟
+
+用法:
+  python toolchain.py preflight            # 解析並驗證全部工具與 Python 套件，缺少必要工具時結束碼為 1
+  python toolchain.py show                 # 顯示記錄的工具位置（不重新搜尋）
+  python toolchain.py clear                # 清除記錄，下次使用時重新搜尋
+"""
+
+import os
+import sys
+import json
+import shutil
+import argparse
+import platform
+import threading
+import subprocess
+import importlib.util
+
+RECORD_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'build', 'toolchain.json')
+
+# required: publish.py 缺少時無法發布；windows: Windows 上 PATH 以外的常見安裝位置
+TOOLS = {
+    'arduino-cli': {
+        'required': True,
+        'install': 'https://arduino.github.io/arduino-cli/',
+        'version': ['version'],
+        'windows': [
+            r'C:\Program Files\Arduino CLI\arduino-cli.exe',
+            r'C:\Program Files (x86)\Arduino CLI\arduino-cli.exe',
+            r'%LOCALAPPDATA%\Arduino15\arduino-cli.exe',
+            r'%USERPROFILE%\AppData\Local\Programs\Arduino CLI\arduino-cli.exe',
+        ],
+    },
+    'firebase': {
+        'required': True,
+        'install': 'npm install -g firebase-tools',
+        'version': ['--version'],
+    },
+    'gh': {
+        'required': False,
+        'install': 'https://cli.github.com/',
+        'version': ['--version'],
+        'windows': [r'C:\Program Files\GitHub CLI\gh.exe'],
+    },
+    'gsutil': {
+        'required': False,
+        'install': 'https://cloud.google.com/storage/docs/gsutil_install',
+        'version': ['version'],
+    },
+    'node': {
+        'required': False,
+        'install': 'https://nodejs.org/',
+        'version': ['--version'],
+    },
+}
+
+# 選用的 Python 套件：未安裝時對應的上傳/寫入方式會被略過，發布途中不會自動安裝
+PACKAGES = {
+    'google.cloud.storage': 'google-cloud-storage',
+    'google.cloud.firestore': 'google-cloud-firestore',
+}
+
+_lock = threading.Lock()
+_record = None
+
+# ── 記錄 ────────────────────────────────────────────────────────────
+
+def _stat(path):
+    try:
+        st = os.stat(path)
+        return [st.st_size, st.st_mtime_ns]
+    except OSError:
+        return None
+
+def _path_signature():
+    """PATH 內容與各目錄的 mtime；安裝或移除執行檔會改變目錄 mtime"""
+    dirs = [d for d in os.environ.get('PATH', '').split(os.pathsep) if d]
+    return [[d, (_stat(d) or [0, 0])[1]] for d in dirs]
+
+def _load():
+    global _record
+    if _record is None:
+        try:
+            with open(RECORD_PATH, 'r', encoding='utf-8') as f:
+                _record = json.load(f)
+        except (OSError, ValueError):
+            _record = {}
+        _record.setdefault('tools', {})
+    return _record
+
+def _save():
+    os.makedirs(os.path.dirname(RECORD_PATH), exist_ok=True)
+    tmp = RECORD_PATH + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(_record, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, RECORD_PATH)
+
+def _valid(entry, path_sig):
+    if entry.get('path'):
+        # 找到的工具：執行檔大小與 mtime 未變即有效
+        return _stat(entry['path']) == entry.get('stat')
+    # 沒找到的工具：PATH 與各目錄都沒變動才沿用
+    return entry.get('path_sig') == path_sig
+
+def _search(name, fallback=None):
+    found = shutil.which(name)
+    if not found and platform.system() == 'Windows':
+        for candidate in TOOLS.get(name, {}).get('windows', []):
+            candidate = os.path.expandvars(candidate)
+            if os.path.exists(candidate):
+                found = candidate
+                break
+    if not found and fallback:
+        found = fallback()
+    return os.path.abspath(found) if found else None
+
+def resolve(name, fallback=None):
+    """工具的完整路徑，找不到回傳 None。fallback 為 PATH 以外的搜尋方式（如 Arduino15 工具目錄）"""
+    with _lock:
+        record = _load()
+        entry = record['tools'].get(name)
+        path_sig = None
+        if entry is not None and not entry.get('path'):
+            path_sig = _path_signature()
+        if entry is not None and _valid(entry, path_sig):
+            return entry['path']
+
+        path = _search(name, fallback)
+        entry = {'path': path, 'stat': _stat(path) if path else None}
+        if not path:
+            entry['path_sig'] = path_sig or _path_signature()
+        record['tools'][name] = entry
+        try:
+            _save()
+        except OSError:
+            pass
+        return path
+
+def which(name):
+    return resolve(name)
+
+def clear():
+    global _record
+    with _lock:
+        _record = {'tools': {}}
+        try:
+            os.remove(RECORD_PATH)
+        except FileNotFoundError:
+            pass
+
+def has_package(module):
+    """只查找模組，不實際匯入（google-cloud 套件匯入很慢）"""
+    try:
+        return importlib.util.find_spec(module) is not None
+    except ImportError:
+        return False
+
+# ── 預檢 ────────────────────────────────────────────────────────────
+
+def tool_version(path, args):
+    try:
+        res = subprocess.run([path] + args, capture_output=True, text=True, timeout=30)
+    except (OSError, subprocess.TimeoutExpired):
+        return None
+    if res.returncode != 0:
+        return None
+    lines = (res.stdout or res.stderr).strip().splitlines()
+    return lines[0] if lines else ''
+
+def preflight():
+    """重新解析全部工具並執行 --version 驗證，回傳 [(名稱, 必要, 路徑, 版本或 None)]"""
+    clear()
+    results = []
+    for name, spec in TOOLS.items():
+        path = resolve(name)
+        version = tool_version(path, spec['version']) if path else None
+        results.append((name, spec['required'], path, version))
+    with _lock:
+        for name, _, _, version in results:
+            _record['tools'][name]['version'] = version
+        _save()
+    return results
+
+# ── 命令列 ──────────────────────────────────────────────────────────
+
+def main():
+    parser = argparse.ArgumentParser(description='hoctrl 發布工具鏈探測')
+    sub = parser.add_subparsers(dest='command', required=True)
+    sub.add_parser('preflight', help='解析並驗證全部工具與 Python 套件')
+    sub.add_parser('show', help='顯示記錄的工具位置')
+    sub.add_parser('clear', help='清除記錄')
+    args = parser.parse_args()
+
+    if args.command == 'preflight':
+        ok = True
+        for name, required, path, version in preflight():
+            if path and version is not None:
+                print(f"✓ {name:<12} {version}  ({path})")
+            elif path:
+                print(f"⚠ {name:<12} 無法執行  ({path})")
+                ok = ok and not required
+            else:
+                print(f"{'❌' if required else '⚠'} {name:<12} 未安裝（{TOOLS[name]['install']}）")
+                ok = ok and not required
+        for module, package in PACKAGES.items():
+            if has_package(module):
+                print(f"✓ {package}")
+            else:
+                print(f"⚠ {package:<24} 未安裝（pip install {package}），對應的 Python 上傳/寫入會略過")
+        print(f"\n記錄: {RECORD_PATH}")
+        if not ok:
+            print("❌ 缺少必要工具")
+            sys.exit(1)
+    elif args.command == 'show':
+        tools = _load()['tools']
+        if not tools:
+            print("沒有記錄（執行 preflight 或 publish.py 時建立）")
+        for name, entry in tools.items():
+            print(f"{name:<24} {entry.get('path') or '未找到'}  {entry.get('version') or ''}")
+    elif args.command == 'clear':
+        clear()
+        print("已清除工具記錄")
+
+if __name__ == '__main__':
+    main()